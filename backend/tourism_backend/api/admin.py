@@ -5,7 +5,12 @@ from django.contrib import admin
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, Region, Category, Attraction, Review, Route, RouteStop, Booking
+from django import forms
+from django.contrib import messages
+from django.db import transaction
+from django.db.models import F
+from . import inventory
+from .models import UserProfile, Region, Category, Attraction, Review, Route, RouteStop, Booking, Conversation, ConversationTurn, Departure
 
 # 1. Настройка Профиля Пользователя
 class UserProfileInline(admin.StackedInline):
@@ -76,8 +81,89 @@ class BookingAdmin(admin.ModelAdmin):
     # Поле поиска (ищет по имени юзера и названию маршрута)
     search_fields = ('user__username', 'user__email', 'route__title')
     
-    # Поля только для чтения (чтобы случайно не изменить дату создания)
-    readonly_fields = ('created_at',)
-    
-    # Можно менять статус прямо из общего списка (опционально)
-    list_editable = ('status',)
+    # Поля только для чтения (чтобы случайно не изменить дату создания).
+    # Статус, маршрут, дата и число людей определяют занятые места выезда: их меняют только
+    # бронирование, оплата и отмена (api/inventory.py), иначе места "утекут"
+    readonly_fields = ('created_at', 'departure', 'expires_at', 'status', 'route', 'date', 'people_count')
+    actions = ['cancel_bookings']
+
+    @admin.action(description='Cancel selected bookings (seats go back to the departure)')
+    def cancel_bookings(self, request, queryset):
+        cancelled = sum(inventory.cancel(booking) for booking in queryset)
+        self.message_user(request, f'{cancelled} bookings cancelled')
+
+    def delete_model(self, request, obj):
+        # Удаленная бронь больше не держит места
+        with transaction.atomic():
+            inventory.cancel(obj)
+            obj.delete()
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for booking in queryset:
+                inventory.cancel(booking)
+            queryset.delete()
+
+
+# Выезды маршрутов с ограниченным числом мест (api/inventory.py)
+class DepartureForm(forms.ModelForm):
+    class Meta:
+        model = Departure
+        fields = ('route', 'date', 'capacity')
+
+    def clean_capacity(self):
+        capacity = self.cleaned_data['capacity']
+        if self.instance.pk:
+            # Страница админки выполняется в транзакции: строка выезда заблокирована до
+            # сохранения, и брони не изменят остаток между этой проверкой и save_model
+            self.current = Departure.objects.select_for_update().values('capacity', 'seats_available').get(
+                pk=self.instance.pk
+            )
+            sold = self.current['capacity'] - self.current['seats_available']
+            if capacity < sold:
+                raise forms.ValidationError(f'{sold} seats are already booked')
+        return capacity
+
+@admin.register(Departure)
+class DepartureAdmin(admin.ModelAdmin):
+    form = DepartureForm
+    list_display = ('route', 'date', 'capacity', 'seats_available')
+    list_filter = ('date',)
+    search_fields = ('route__title',)
+    readonly_fields = ('seats_available',)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # seats_available не перезаписываем значением, прочитанным при открытии формы:
+        # за это время могли пройти брони. Вместимость меняет остаток на разницу тем же
+        # атомарным UPDATE, что и брони
+        obj.save(update_fields=['route', 'date'])
+        delta = obj.capacity - form.current['capacity']
+        if not delta:
+            return
+        # Условие повторяет CheckConstraint: без блокировок строк (SQLite) бронь могла
+        # пройти после проверки формы — тогда вместимость не меняем, а не падаем с 500
+        updated = Departure.objects.filter(pk=obj.pk, seats_available__gte=-delta).update(
+            capacity=obj.capacity, seats_available=F('seats_available') + delta
+        )
+        if not updated:
+            self.message_user(
+                request, 'Capacity was not changed: seats were booked meanwhile, try again', messages.ERROR,
+            )
+
+
+# 6. Диалоги с ИИ-гидом: расход токенов по каждому диалогу
+class ConversationTurnInline(admin.TabularInline):
+    model = ConversationTurn
+    extra = 0
+    can_delete = False
+    readonly_fields = ('question', 'reply', 'context', 'tokens', 'prompt_tokens', 'completion_tokens', 'summarized', 'created_at')
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'turns_count', 'prompt_tokens', 'completion_tokens', 'updated_at')
+    list_filter = ('updated_at',)
+    search_fields = ('user__username', 'summary')
+    readonly_fields = ('summary', 'prompt_tokens', 'completion_tokens', 'turns_count', 'created_at', 'updated_at')
+    inlines = [ConversationTurnInline]
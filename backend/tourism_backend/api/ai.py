@@ -0,0 +1,345 @@
+import json
+import logging
+from functools import lru_cache
+from types import SimpleNamespace
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import conversations, images
+from .ai_cache import cache_key, reply_cache
+from .ai_upstream import UpstreamBusy, gate
+from .models import Attraction, Route
+from .vectors import vector_index
+
+logger = logging.getLogger(__name__)
+
+AI_MODEL = getattr(settings, 'AI_MODEL', 'gpt-4o-mini')  # Дешевая модель
+AI_MAX_TOKENS = getattr(settings, 'AI_MAX_TOKENS', 500)  # Ограничение длины ответа
+
+EMPTY_QUERY_REPLY = "Спроси меня что-нибудь!"
+AI_ERROR_REPLY = "Ошибка связи с ИИ."
+AI_BUSY_REPLY = "ИИ-гид сейчас перегружен, попробуйте через минуту."
+
+# Расход токенов ответа, который не потребовал запроса к модели
+NO_USAGE = SimpleNamespace(prompt_tokens=0, completion_tokens=0)
+
+
+# --- Клиенты OpenAI ---
+# Создаются лениво: без ключа модуль импортируется, а OPENAI_BASE_URL позволяет
+# направить запросы на любой OpenAI-совместимый сервер (в тестах — локальная заглушка).
+# max_retries=0: повторы после 429 делает общий шлюз (api/ai_upstream.py), чтобы
+# пауза действовала на все запросы процесса, а не на один
+
+@lru_cache(maxsize=4)
+def _client(api_key, base_url):
+    return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+
+@lru_cache(maxsize=4)
+def _async_client(api_key, base_url):
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+
+def get_client():
+    return _client(settings.OPENAI_API_KEY, settings.OPENAI_BASE_URL)
+
+
+def get_async_client():
+    return _async_client(settings.OPENAI_API_KEY, settings.OPENAI_BASE_URL)
+
+
+# --- Контекст из базы ---
+
+def find_context_items(user_query, build_absolute_uri):
+    # Возвращает карточки для фронтенда и контекст для модели по строке на находку:
+    # {'attraction:3': "- Kolsai Lakes: ...\n"} (в диалоге по ключам убираются повторы).
+    # Ищем совпадения в базе, чтобы ИИ знал о наших турах, а не выдумывал.
+    # Поиск идет по векторному индексу в памяти (api/vectors.py): вопрос целым
+    # предложением находит и достопримечательности, и маршруты без запроса к БД.
+    recommendations = []
+    context = {}
+
+    # Берем только первые 3, чтобы не перегружать
+    hits = vector_index.search(user_query, k=3)
+    ids = {'attraction': [], 'route': []}
+    for kind, pk, score in hits:
+        ids[kind].append(pk)
+    objects = {
+        'attraction': Attraction.objects.filter(status='active').in_bulk(ids['attraction']) if ids['attraction'] else {},
+        'route': Route.objects.in_bulk(ids['route']) if ids['route'] else {},
+    }
+
+    for kind, pk, score in hits:
+        obj = objects[kind].get(pk)
+        if obj is None:
+            # Индекс другого процесса еще не знает об удалении
+            continue
+        # Текст для ИИ: "Название - Описание (первые 300 букв)"
+        desc_text = obj.description[:300] if obj.description else "No description"
+        if kind == 'attraction':
+            # Собираем данные для карточки на сайте
+            # Карточке в чате хватает копии размера card (api/images.py)
+            img_url = build_absolute_uri(images.preferred_url(obj.image, obj.image_variants)) if obj.image else ""
+            title = obj.name
+            context[f"{kind}:{pk}"] = f"- {obj.name}: {desc_text}...\n"
+        else:
+            img_url = obj.image
+            title = obj.title
+            context[f"{kind}:{pk}"] = f"- Route {obj.title} ({obj.duration_days} days, {obj.budget_range}): {desc_text}...\n"
+        recommendations.append({'id': obj.id, 'title': title, 'image': img_url, 'type': kind})
+
+    return recommendations, context
+
+
+def find_context(user_query, build_absolute_uri):
+    # -> (карточки для фронтенда, текст-контекст для модели)
+    recommendations, context = find_context_items(user_query, build_absolute_uri)
+    return recommendations, conversations.context_text(context)
+
+
+def build_messages(context_data, user_query):
+    # Инструкция для нейросети (System Prompt): "Ты гид, используй данные из базы"
+    system_instruction = (
+        "You are a guide for TourismKZ. "
+        f"Use this DB data to answer: {context_data}"
+    )
+    return [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": user_query},
+    ]
+
+
+def complete_with_usage(messages, max_tokens=AI_MAX_TOKENS):
+    # -> (текст ответа, usage). usage может быть None у OpenAI-совместимых серверов
+    ai_response = get_client().chat.completions.create(
+        model=AI_MODEL, messages=messages, max_tokens=max_tokens,
+    )
+    return ai_response.choices[0].message.content, ai_response.usage
+
+
+def complete(messages):
+    return complete_with_usage(messages)[0]
+
+
+def answer_with_usage(user_query, context_data):
+    # Ответ из кэша, если похожий вопрос уже задавали при том же контексте из базы.
+    # Ошибки не кэшируются: следующий запрос снова пойдет к модели.
+    # Если такой же вопрос уже обрабатывается — ждем его ответ, а не спрашиваем модель второй раз.
+    # -> (reply, usage); ответы из кэша и чужого запроса токенов не тратят
+    key = cache_key(user_query, context_data)
+    reply = reply_cache.get(key)
+    if reply is not None:
+        return reply, NO_USAGE
+
+    future, leader = gate.join(key)
+    if not leader:
+        return gate.wait(future), NO_USAGE
+    try:
+        reply, usage = gate.call(lambda: complete_with_usage(build_messages(context_data, user_query)))
+    except Exception as error:
+        gate.finish(key, error=error)
+        raise
+    reply_cache.set(key, reply)
+    gate.finish(key, result=reply)
+    return reply, usage
+
+
+def answer(user_query, context_data):
+    return answer_with_usage(user_query, context_data)[0]
+
+
+# --- Диалоги (api/conversations.py) ---
+
+def summarize(previous_summary, turns):
+    # Сворачивает старые реплики в пересказ. -> (summary, prompt_tokens, completion_tokens)
+    messages = conversations.summary_messages(previous_summary, turns)
+    try:
+        summary, usage = gate.call(
+            lambda: complete_with_usage(messages, max_tokens=conversations.AI_SUMMARY_MAX_TOKENS)
+        )
+    except Exception:
+        logger.exception('AI summary failed')
+        return conversations.fallback_summary(previous_summary, turns), 0, 0
+    if usage is None:
+        return summary, conversations.count_message_tokens(messages), conversations.count_tokens(summary)
+    return summary, usage.prompt_tokens, usage.completion_tokens
+
+
+def prepare_conversation(conversation, user_query, build_absolute_uri):
+    # -> (recommendations, context, messages). context — данные из базы, которые модель
+    # получает с этим вопросом впервые (их запоминает record_turn). messages=None — в диалоге
+    # еще нет истории, и вопрос можно обработать без нее (кэш ответов, single-flight)
+    recommendations, context = find_context_items(user_query, build_absolute_uri)
+    messages = None
+    if conversations.has_history(conversation):
+        messages, context = conversations.build_messages(conversation, context, user_query, summarize)
+    return recommendations, context, messages
+
+
+def answer_in_conversation(conversation, user_query, context, messages):
+    # -> (reply, usage). Ответ записывается в диалог вместе с расходом токенов
+    if messages is None:
+        context_data = conversations.context_text(context)
+        reply, usage = answer_with_usage(user_query, context_data)
+        messages = build_messages(context_data, user_query)
+    else:
+        reply, usage = gate.call(lambda: complete_with_usage(messages))
+    return reply, conversations.record_turn(conversation, user_query, reply, context, messages, usage)
+
+
+# --- Потоковый ответ (Server-Sent Events) ---
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream_model(messages, result):
+    # Токены ответа по мере генерации. В result — полный ответ и usage
+    # (OpenAI присылает его последним чанком благодаря include_usage)
+    parts = []
+
+    def create():
+        return get_async_client().chat.completions.create(
+            model=AI_MODEL, messages=messages, max_tokens=AI_MAX_TOKENS,
+            stream=True, stream_options={'include_usage': True},
+        )
+
+    async with gate.stream(create) as stream:
+        async for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                result['usage'] = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield sse_event('token', {'text': chunk.choices[0].delta.content})
+    result['reply'] = ''.join(parts)
+
+
+async def _stream_shared(user_query, context_data, result):
+    # Вопрос без истории диалога: кэш ответов и single-flight
+    key = cache_key(user_query, context_data)
+    cached = reply_cache.get(key)
+    if cached is not None:
+        # Попадание в кэш — весь ответ одним событием, модель не вызываем
+        result.update(reply=cached, usage=NO_USAGE)
+        yield sse_event('token', {'text': cached})
+        return
+
+    future, leader = gate.join(key)
+    if not leader:
+        # Такой же вопрос уже стримится другому клиенту — ждем его ответ целиком
+        try:
+            result.update(reply=await gate.wait_async(future), usage=NO_USAGE)
+            yield sse_event('token', {'text': result['reply']})
+        except UpstreamBusy:
+            yield sse_event('error', {'text': AI_BUSY_REPLY})
+        except Exception:
+            yield sse_event('error', {'text': AI_ERROR_REPLY})
+        return
+
+    error = None
+    try:
+        async for event in _stream_model(build_messages(context_data, user_query), result):
+            yield event
+    except UpstreamBusy as exc:
+        error = exc
+        yield sse_event('error', {'text': AI_BUSY_REPLY})
+    except Exception as exc:
+        error = exc
+        logger.exception('AI stream failed')
+        yield sse_event('error', {'text': AI_ERROR_REPLY})
+    else:
+        # Кэшируем только полностью полученный ответ (клиент мог отключиться раньше)
+        reply_cache.set(key, result['reply'])
+    finally:
+        if 'reply' not in result and error is None:
+            error = RuntimeError('AI stream interrupted')
+        gate.finish(key, result=result.get('reply'), error=error)
+
+
+async def stream_reply(recommendations, user_query, context, conversation=None, messages=None):
+    # Сначала карточки (они готовы сразу), потом текст ответа по мере генерации.
+    # В диалоге после ответа приходит событие usage: id диалога и расход токенов
+    yield sse_event('recommendations', recommendations)
+    context_data = conversations.context_text(context)
+    result = {}
+    if messages is None:
+        async for event in _stream_shared(user_query, context_data, result):
+            yield event
+    else:
+        try:
+            async for event in _stream_model(messages, result):
+                yield event
+        except UpstreamBusy:
+            yield sse_event('error', {'text': AI_BUSY_REPLY})
+        except Exception:
+            logger.exception('AI stream failed')
+            yield sse_event('error', {'text': AI_ERROR_REPLY})
+
+    if conversation is not None and 'reply' in result:
+        usage = await sync_to_async(conversations.record_turn)(
+            conversation, user_query, result['reply'], context,
+            messages or build_messages(context_data, user_query), result.get('usage'),
+        )
+        yield sse_event('usage', usage)
+    yield sse_event('done', {})
+
+
+def _request_user(request):
+    # Обычная Django-вьюха: JWT из заголовка Authorization проверяем сами, как DRF.
+    # Сессию (request.user) не используем: вьюха без CSRF-проверки, и cookie
+    # не должна открывать чужому сайту диалоги пользователя
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        authenticated = None
+    return authenticated[0] if authenticated else AnonymousUser()
+
+
+def _prepare_stream(request, user_query, conversation_id):
+    conversation = conversations.load(conversation_id, _request_user(request))
+    recommendations, context, messages = prepare_conversation(
+        conversation, user_query, request.build_absolute_uri
+    )
+    return recommendations, user_query, context, conversation, messages
+
+
+async def _empty_reply():
+    yield sse_event('recommendations', [])
+    yield sse_event('token', {'text': EMPTY_QUERY_REPLY})
+    yield sse_event('done', {})
+
+
+@csrf_exempt
+async def ask_stream(request):
+    # Асинхронный вариант /api/ai/ask/: под ASGI не держит воркер, пока модель отвечает.
+    # POST {"message": "..."} (для fetch), пользователь — только по JWT.
+    # Необязательный "conversation": id диалога из события usage предыдущего ответа
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        payload = json.loads(request.body or b'{}')
+        payload.get('message')
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest('Invalid JSON')
+
+    user_query = str(payload.get('message', '')).strip()
+    if not user_query:
+        events = _empty_reply()
+    else:
+        # ORM синхронный — выполняем поиск (и пересказ старых реплик) в пуле потоков
+        events = stream_reply(*await sync_to_async(_prepare_stream)(
+            request, user_query, payload.get('conversation')
+        ))
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию в nginx, иначе токены придут одной пачкой
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,89 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Кэш ответов ИИ-гида. Ключ — нормализованный вопрос + хэш контекста из базы:
+# похожие формулировки попадают в одну запись, а при изменении найденных
+# достопримечательностей меняется хэш контекста, и старый ответ больше не используется
+AI_CACHE_TTL = getattr(settings, 'AI_CACHE_TTL', 60 * 60 * 6)
+AI_CACHE_MAX_ENTRIES = getattr(settings, 'AI_CACHE_MAX_ENTRIES', 1000)
+
+# Слова, которые не меняют смысл вопроса ("где", "лучшие", "please" ...)
+STOP_WORDS = {
+    'a', 'an', 'the', 'in', 'on', 'to', 'for', 'of', 'is', 'are', 'what', 'where', 'which',
+    'best', 'top', 'go', 'visit', 'please', 'me', 'i', 'can', 'should', 'some', 'recommend',
+    'в', 'на', 'и', 'где', 'куда', 'какие', 'что', 'лучшие', 'самые', 'поехать', 'сходить',
+    'посетить', 'посоветуй', 'пожалуйста', 'мне', 'можно',
+}
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_query(query):
+    # "Where to go in Almaty?" и "almaty, where to go" -> "almaty".
+    # Порядок и повторы слов сохраняются: "from almaty to astana" и "from astana to almaty" —
+    # разные вопросы
+    words = [word for word in _WORD_RE.findall(query.lower()) if word not in STOP_WORDS]
+    return ' '.join(words) or query.strip().lower()
+
+
+def cache_key(query, context_data):
+    context_hash = hashlib.sha1(context_data.encode()).hexdigest()
+    return f'{normalize_query(query)}|{context_hash}'
+
+
+class ReplyCache:
+    # LRU с TTL в памяти процесса. Потокобезопасен: используется и из sync, и из async путей
+
+    def __init__(self, max_entries=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0,
+            }
+
+
+reply_cache = ReplyCache()
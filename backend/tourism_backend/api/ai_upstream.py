@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
+
+import openai
+from django.conf import settings
+
+from .timing import span
+
+# Все обращения к модели проходят через один шлюз на процесс:
+#  - одинаковые вопросы, заданные одновременно, делят один запрос к модели (single-flight);
+#  - одновременно идет не больше AI_MAX_CONCURRENCY запросов, остальные ждут в очереди,
+#    но не дольше AI_QUEUE_TIMEOUT секунд;
+#  - ответ 429 от OpenAI притормаживает все запросы процесса (экспоненциальная пауза,
+#    Retry-After учитывается), успешные ответы постепенно ее снимают
+AI_MAX_CONCURRENCY = getattr(settings, 'AI_MAX_CONCURRENCY', 8)
+AI_QUEUE_TIMEOUT = getattr(settings, 'AI_QUEUE_TIMEOUT', 15)
+AI_BACKOFF_BASE = getattr(settings, 'AI_BACKOFF_BASE', 1)
+AI_BACKOFF_MAX = getattr(settings, 'AI_BACKOFF_MAX', 30)
+
+
+class UpstreamBusy(Exception):
+    # Не дождались своей очереди к модели до дедлайна
+    pass
+
+
+class _Waiter:
+    # Место в очереди: потоку будим Event, корутине — Future ее event loop
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+def _retry_after(error):
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class UpstreamGate:
+
+    def __init__(self, limit=AI_MAX_CONCURRENCY, timeout=AI_QUEUE_TIMEOUT,
+                 backoff_base=AI_BACKOFF_BASE, backoff_max=AI_BACKOFF_MAX):
+        self.limit = limit
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._active = 0
+        self._backoff = 0
+        self._blocked_until = 0
+        self._flights = {}
+        self._stats = {
+            'calls': 0, 'queued_calls': 0, 'total_wait': 0.0, 'max_wait': 0.0,
+            'max_queue_depth': 0, 'timeouts': 0, 'rate_limited': 0, 'coalesced': 0,
+        }
+
+    # --- Очередь к слотам ---
+
+    def _enter(self, waiter):
+        # True — слот получен сразу, иначе waiter встал в очередь
+        with self._lock:
+            self._stats['calls'] += 1
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return True
+            self._waiters.append(waiter)
+            self._stats['queued_calls'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], len(self._waiters))
+            return False
+
+    def _leave_queue(self, waiter):
+        # True — успели выйти из очереди; False — слот уже передан нам в release()
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return False
+            self._stats['timeouts'] += 1
+            return True
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats['total_wait'] += waited
+            self._stats['max_wait'] = max(self._stats['max_wait'], waited)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Слот переходит следующему в очереди, счетчик активных не меняется
+                self._waiters.popleft().grant()
+            else:
+                self._active -= 1
+
+    def _backoff_delay(self, deadline):
+        delay = self._blocked_until - time.monotonic()
+        if delay <= 0:
+            return 0
+        if time.monotonic() + delay > deadline:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise UpstreamBusy()
+        return delay
+
+    def acquire(self, deadline):
+        started = time.monotonic()
+        delay = self._backoff_delay(deadline)
+        if delay:
+            time.sleep(delay)
+        waiter = _Waiter()
+        if not self._enter(waiter):
+            if not waiter.event.wait(max(0, deadline - time.monotonic())) and self._leave_queue(waiter):
+                raise UpstreamBusy()
+        self._record_wait(started)
+
+    async def acquire_async(self, deadline):
+        started = time.monotonic()
+        delay = self._backoff_delay(deadline)
+        if delay:
+            await asyncio.sleep(delay)
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not self._enter(waiter):
+            try:
+                await asyncio.wait({waiter.future}, timeout=max(0, deadline - time.monotonic()))
+            except asyncio.CancelledError:
+                # Клиент отключился, пока ждал: уходим из очереди или возвращаем полученный слот
+                if not self._leave_queue(waiter):
+                    self.release()
+                raise
+            if not waiter.future.done() and self._leave_queue(waiter):
+                raise UpstreamBusy()
+            await waiter.future
+        self._record_wait(started)
+
+    # --- Пауза после 429 ---
+
+    def rate_limited(self, error=None):
+        with self._lock:
+            self._stats['rate_limited'] += 1
+            self._backoff = min(self.backoff_max, max(self.backoff_base, self._backoff * 2))
+            pause = max(self._backoff, _retry_after(error) or 0)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+
+    def succeeded(self):
+        with self._lock:
+            self._backoff /= 2
+            if self._backoff < self.backoff_base:
+                self._backoff = 0
+
+    def retry_after(self):
+        # Для заголовка Retry-After ответа 503
+        return max(1, int(self._blocked_until - time.monotonic() + 0.999), int(self._backoff))
+
+    # --- Вызовы ---
+
+    def call(self, fn):
+        # Синхронный вызов модели: слот, повтор после 429, пока не вышел дедлайн
+        deadline = time.monotonic() + self.timeout
+        while True:
+            self.acquire(deadline)
+            try:
+                with span('external'):
+                    result = fn()
+            except openai.RateLimitError as error:
+                self.rate_limited(error)
+                continue
+            finally:
+                self.release()
+            self.succeeded()
+            return result
+
+    @asynccontextmanager
+    async def stream(self, create):
+        # Потоковый ответ держит слот, пока модель не закончит генерацию
+        deadline = time.monotonic() + self.timeout
+        while True:
+            await self.acquire_async(deadline)
+            try:
+                stream = await create()
+            except openai.RateLimitError as error:
+                self.release()
+                self.rate_limited(error)
+                continue
+            except BaseException:
+                self.release()
+                raise
+            break
+        try:
+            yield stream
+            self.succeeded()
+        finally:
+            self.release()
+
+    # --- Single-flight ---
+
+    def join(self, key):
+        # -> (future, leader). Лидер делает запрос и обязан вызвать finish(),
+        # остальные ждут его future
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._flights.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise UpstreamBusy()
+
+    async def wait_async(self, future):
+        try:
+            # shield: таймаут ожидающего не должен отменять запрос лидера
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamBusy()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            queued = stats.pop('queued_calls')
+            total_wait = stats.pop('total_wait')
+            stats.update({
+                'limit': self.limit,
+                'active': self._active,
+                'queue_depth': len(self._waiters),
+                'in_flight_questions': len(self._flights),
+                'avg_wait_ms': round(total_wait / stats['calls'] * 1000, 1) if stats['calls'] else 0,
+                'max_wait_ms': round(stats.pop('max_wait') * 1000, 1),
+                'queued_calls': queued,
+                'backoff_seconds': round(max(0, self._blocked_until - time.monotonic()), 2),
+            })
+            return stats
+
+
+gate = UpstreamGate()
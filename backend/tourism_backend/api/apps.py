@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (агрегаты рейтинга и т.п.)
+        from . import signals  # noqa: F401
+        # Обертка SQL-запросов для разбивки времени запроса (Server-Timing)
+        from . import timing  # noqa: F401
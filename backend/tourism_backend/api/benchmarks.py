@@ -0,0 +1,227 @@
+import json
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import catalog_io, counters
+from .models import Attraction, Booking, Departure, Review, Route, RouteStop, UserProfile
+
+# Замер эндпоинтов API: p50/p95 времени ответа, число SQL-запросов и размер ответа.
+# Запускается командой benchmark (на наполненной seed_data базе) и тестом
+# BenchmarkRegressionTests (число запросов сверяется с BASELINE_PATH).
+# Кэш каталога очищается перед каждым запросом: меряем путь до БД, а не попадание в кэш.
+# Замер ничего не оставляет в базе: весь прогон идет в транзакции, которая откатывается,
+# а каждый запрос — в точке сохранения, которая откатывается сразу после него. Поэтому
+# пишущие эндпоинты (брони, отзывы, импорт, регистрация) каждый раз видят одни и те же данные.
+# ИИ-эндпоинты не меряются — их время определяет внешний сервис
+
+BASELINE_PATH = Path(__file__).with_name('benchmark_baseline.json')
+BENCH_PASSWORD = 'bench12345'
+
+
+
+def _import_file(params):
+    # Файл выгрузки — новый объект на каждый запрос: загрузка его дочитывает до конца
+    return SimpleUploadedFile('attractions.ndjson', params['import_file'], content_type=catalog_io.FORMATS['ndjson'])
+
+
+# (имя, метод, путь, кто запрашивает, тело запроса, ожидаемый статус).
+# {attraction}, {route}, {review}, {booking}, {n} подставляются при запуске,
+# функция в теле получает те же параметры (файлы уходят multipart-формой)
+ENDPOINTS = [
+    ('attractions-list', 'get', '/api/attractions/', 'anon', None, 200),
+    ('attractions-list-page', 'get', '/api/attractions/?page=1', 'anon', None, 200),
+    ('attractions-list-staff', 'get', '/api/attractions/', 'admin', None, 200),
+    ('attractions-search', 'get', '/api/attractions/?search=lake', 'anon', None, 200),
+    ('attractions-detail', 'get', '/api/attractions/{attraction}/', 'anon', None, 200),
+    ('attractions-favorite-status', 'get', '/api/attractions/favorite_status/?ids={attraction}', 'user', None, 200),
+    ('attractions-nearby', 'get', '/api/attractions/nearby/?lat=43.24&lon=76.89&radius_km=200', 'anon', None, 200),
+    ('attractions-toggle-favorite', 'post', '/api/attractions/{attraction}/toggle_favorite/', 'user', None, 200),
+    ('attractions-export', 'get', '/api/attractions/export/?type=ndjson', 'admin', None, 200),
+    ('attractions-import', 'post', '/api/attractions/import/', 'admin', {'file': _import_file}, 200),
+    ('reviews-list', 'get', '/api/reviews/', 'anon', None, 200),
+    ('reviews-by-attraction', 'get', '/api/reviews/?attraction={attraction}', 'anon', None, 200),
+    ('reviews-list-staff', 'get', '/api/reviews/?page=1', 'admin', None, 200),
+    ('reviews-create', 'post', '/api/reviews/', 'user',
+     {'attraction': '{attraction}', 'rating': 4, 'text': 'Benchmark review {n}'}, 201),
+    ('reviews-moderate', 'post', '/api/reviews/{review}/moderate/', 'admin', {'status': 'approved'}, 200),
+    ('routes-list', 'get', '/api/routes/', 'anon', None, 200),
+    ('routes-detail', 'get', '/api/routes/{route}/', 'anon', None, 200),
+    ('routes-optimize', 'post', '/api/routes/{route}/optimize/', 'admin', {'apply': True}, 200),
+    ('routes-departures', 'get', '/api/routes/{route}/departures/', 'anon', None, 200),
+    ('categories-list', 'get', '/api/categories/', 'anon', None, 200),
+    ('regions-list', 'get', '/api/regions/', 'anon', None, 200),
+    ('search', 'get', '/api/search/?q=lake', 'anon', None, 200),
+    ('profiles-me', 'get', '/api/profiles/me/', 'user', None, 200),
+    ('profiles-me-update', 'patch', '/api/profiles/me/', 'user', {'bio': 'Benchmark bio {n}'}, 200),
+    ('bookings-list', 'get', '/api/bookings/', 'user', None, 200),
+    ('bookings-create', 'post', '/api/bookings/', 'user',
+     {'route': '{route}', 'date': '2030-01-01', 'people_count': 2}, 201),
+    ('bookings-pay', 'post', '/api/bookings/{booking}/pay/', 'user', None, 200),
+    ('bookings-delete', 'delete', '/api/bookings/{booking}/', 'user', None, 204),
+    ('admin-stats', 'get', '/api/admin/stats/', 'admin', None, 200),
+    ('auth-token', 'post', '/api/auth/token/', 'anon',
+     {'username': 'bench_user', 'password': BENCH_PASSWORD}, 200),
+    ('auth-register', 'post', '/api/auth/register/', 'anon',
+     {'username': 'bench_new_{n}', 'password': BENCH_PASSWORD}, 201),
+]
+
+
+def _fill(value, params):
+    if callable(value):
+        return value(params)
+    if isinstance(value, dict):
+        return {key: _fill(item, params) for key, item in value.items()}
+    if isinstance(value, str):
+        return value.format(**params)
+    return value
+
+
+def _bench_user(username, **extra):
+    user, created = User.objects.get_or_create(username=username, defaults=extra)
+    if created:
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+        UserProfile.objects.get_or_create(user=user)
+    return user
+
+
+def prepare():
+    # Пользователи для замеров и id объектов для путей. Данные должны уже быть в базе
+    attraction = Attraction.objects.filter(status='active').order_by('id').first()
+    route = Route.objects.order_by('id').first()
+    if attraction is None or route is None:
+        raise ValueError('Benchmark needs data: run "python manage.py seed_data" first')
+
+    user = _bench_user('bench_user')
+    admin = _bench_user('bench_admin', is_staff=True, is_superuser=True)
+    # Профиль пользователя не пустой: избранное и брони есть в обоих списках
+    user.favorites.add(*Attraction.objects.filter(status='active').order_by('id')[:20])
+    if not user.bookings.exists():
+        Booking.objects.bulk_create([
+            Booking(user=user, route=route, date='2030-01-01', people_count=1, total_price=100)
+            for _ in range(20)
+        ])
+    booking = user.bookings.filter(status='pending', departure__isnull=True).order_by('id').first()
+    review = Review.objects.filter(attraction=attraction).order_by('id').first()
+    if review is None:
+        review = Review.objects.create(author=admin, attraction=attraction, rating=5, text='Benchmark review')
+
+    # Оптимизатору нужны остановки, привязанные к местам с координатами, списку выездов — выезды
+    located = list(
+        Attraction.objects.filter(status='active', latitude__isnull=False, longitude__isnull=False)
+        .order_by('id').values_list('id', flat=True)[:20]
+    )
+    unlinked = list(route.stops.exclude(attraction__latitude__isnull=False).order_by('day_number', 'id'))
+    for position, stop in enumerate(unlinked):
+        stop.attraction_id = located[position % len(located)] if located else None
+    RouteStop.objects.bulk_update(unlinked, ['attraction'])
+    today = timezone.localdate()
+    Departure.objects.bulk_create([
+        Departure(route=route, date=today + timedelta(weeks=week), capacity=20, seats_available=20)
+        for week in range(1, 11)
+    ], ignore_conflicts=True)
+
+    sample = Attraction.objects.filter(pk__in=located[:20] or [attraction.id])
+    import_file = ''.join(catalog_io.export_lines(sample, 'ndjson')).encode()
+
+    clients = {'anon': APIClient()}
+    for role, account in (('user', user), ('admin', admin)):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(account).access_token}')
+        clients[role] = client
+    return clients, {
+        'attraction': attraction.id, 'route': route.id, 'review': review.id, 'booking': booking.id,
+        'import_file': import_file,
+    }
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def run(iterations=20, warmup=2, names=None):
+    # -> {имя: {'p50_ms', 'p95_ms', 'queries', 'bytes', 'status'}}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+        try:
+            return _measure(iterations, warmup, names)
+        finally:
+            transaction.set_rollback(True)
+
+
+def _measure(iterations, warmup, names):
+    clients, params = prepare()
+    results = {}
+    for name, method, path, role, body, expected_status in ENDPOINTS:
+        if names and name not in names:
+            continue
+        timings, queries, size = [], 0, 0
+        for n in range(warmup + iterations):
+            # Вне замера: кэш каталога пуст, буфер просмотров сброшен (иначе его запись
+            # в БД случайно попадет в чей-то замер)
+            cache.clear()
+            counters.flush()
+            request_params = {**params, 'n': f'{time.time_ns()}_{n}'}
+            data = _fill(body, request_params)
+            multipart = isinstance(data, dict) and any(isinstance(item, SimpleUploadedFile) for item in data.values())
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(clients[role], method)(
+                        _fill(path, request_params), data, format='multipart' if multipart else 'json'
+                    )
+                    # Потоковый ответ (выгрузка) читает БД по мере отдачи — дочитываем в замере
+                    content = b''.join(response.streaming_content) if response.streaming else response.content
+                    elapsed = time.perf_counter() - started
+                transaction.set_rollback(True)
+            if response.status_code != expected_status:
+                raise AssertionError(f'{name}: expected {expected_status}, got {response.status_code}')
+            if n >= warmup:
+                timings.append(elapsed * 1000)
+                queries = max(queries, len(captured))
+                size = len(content)
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'queries': queries,
+            'bytes': size,
+        }
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    Path(path).write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+def compare(results, baseline, check_latency=True, latency_tolerance=1.5, latency_slack_ms=5):
+    # -> список регрессий. Запросы сравниваются строго; время — с допуском,
+    # потому что зависит от машины: p95 > baseline * tolerance + slack
+    regressions = []
+    for name, current in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            regressions.append(f'{name}: no baseline (run "benchmark --update-baseline")')
+            continue
+        if current['queries'] > expected['queries']:
+            regressions.append(f"{name}: {current['queries']} SQL queries, baseline {expected['queries']}")
+        limit = expected['p95_ms'] * latency_tolerance + latency_slack_ms
+        if check_latency and current['p95_ms'] > limit:
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms, limit {limit:.1f} ms")
+    return regressions
@@ -0,0 +1,108 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# Номер поколения каталога: входит в ключ каждого закэшированного ответа.
+# Любое изменение каталога увеличивает его, и все старые ответы становятся недостижимы
+GENERATION_KEY = 'catalog:generation'
+MODIFIED_KEY = 'catalog:modified'
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+
+
+def _initial_generation():
+    # Ключ поколения может быть вытеснен из кэша. Начинаем с текущего времени в мс,
+    # чтобы новое поколение не совпало ни с одним из уже использованных
+    return time.time_ns() // 1_000_000
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, _initial_generation(), None)
+        cache.add(MODIFIED_KEY, time.time(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def get_last_modified():
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        modified = time.time()
+        cache.add(MODIFIED_KEY, modified, None)
+    return modified
+
+
+def _bump():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Ключа еще нет (или он вытеснен) — начинаем новую нумерацию
+        cache.set(GENERATION_KEY, _initial_generation(), None)
+    cache.set(MODIFIED_KEY, time.time(), None)
+
+
+def bump_generation():
+    # Сразу — чтобы больше не отдавать старые ответы, и после коммита — чтобы
+    # выбросить ответы, собранные из еще не закоммиченных данных
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _cache_key(request):
+    role = 'staff' if request.user.is_staff else 'public'
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'catalog:{get_generation()}:{role}:{path_hash}'
+
+
+class CachedCatalogMixin:
+    # Кэширует GET-ответы list/retrieve публичного каталога.
+    # Ключ: поколение + роль (staff видит черновики) + путь с query string.
+    # Поддерживает условные запросы (If-None-Match / If-Modified-Since -> 304)
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(super().retrieve, request, *args, **kwargs)
+
+    def _cached_response(self, handler, request, *args, **kwargs):
+        # Кэшируем только JSON; Browsable API и прочие рендеры идут как обычно
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+
+        key = _cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = request.accepted_renderer.render(
+                response.data, request.accepted_media_type, self.get_renderer_context()
+            )
+            entry = {
+                'content': content,
+                'content_type': f'{request.accepted_media_type}; charset=utf-8',
+                'etag': quote_etag(hashlib.md5(content).hexdigest()),
+                'last_modified': int(get_last_modified()),
+            }
+            cache.set(key, entry, CATALOG_CACHE_TIMEOUT)
+
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        patch_vary_headers(response, ['Authorization'])
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        if request.user.is_staff:
+            patch_cache_control(response, private=True)
+        return get_conditional_response(
+            request,
+            etag=entry['etag'],
+            last_modified=entry['last_modified'],
+            response=response,
+        )
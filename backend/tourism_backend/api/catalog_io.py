@@ -0,0 +1,281 @@
+import csv
+import json
+import math
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .cache import bump_generation
+from .models import Attraction, Category, Region
+from .search import update_attraction_vectors
+from . import vectors
+from .vectors import vector_index
+
+# Выгрузка и загрузка каталога достопримечательностей целиком (NDJSON или CSV).
+# Выгрузка читает БД через .iterator() (на PostgreSQL — серверный курсор) и отдает
+# строки по мере чтения, поэтому память не зависит от размера каталога.
+# Загрузка читает файл построчно, проверяет строки и пишет их пачками по IMPORT_CHUNK_SIZE:
+# одна пачка — один INSERT ... ON CONFLICT (id) DO UPDATE (bulk_create(update_conflicts=True)).
+# Регион и категория в файле — названия; они ищутся в словаре, загруженном один раз
+FIELDS = (
+    'id', 'name', 'region', 'category', 'description', 'latitude', 'longitude', 'status',
+    'entrance_fee', 'best_time', 'visitors_count', 'image',
+)
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_CHUNK_SIZE = 500
+# Сколько ошибок попадает в отчет (остальные только считаются)
+MAX_REPORTED_ERRORS = 100
+# Необязательные колонки: если колонки в строке нет, у существующей записи значение не меняется
+OPTIONAL_FIELDS = ('latitude', 'longitude', 'status', 'entrance_fee', 'best_time', 'visitors_count', 'image')
+STATUSES = {value for value, _ in Attraction.STATUS_CHOICES}
+
+
+def guess_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+# --- Выгрузка ---
+
+def export_rows(queryset):
+    # -> словари по возрастанию id; регион и категория — названиями
+    columns = (
+        'id', 'name', 'region__name', 'category__name', 'description', 'latitude', 'longitude', 'status',
+        'entrance_fee', 'best_time', 'visitors_count', 'image',
+    )
+    for values in queryset.order_by('id').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield dict(zip(FIELDS, values))
+
+
+class _Echo:
+    # csv.writer "пишет" сюда и сразу получает готовую строку
+    def write(self, value):
+        return value
+
+
+def _batched(lines, size=EXPORT_CHUNK_SIZE):
+    # Отдаем строки пачками: одна запись в сокет на пачку, а не на каждую строку
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in FIELDS])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def export_lines(queryset, file_format):
+    # Генератор для StreamingHttpResponse: запросы к БД идут по мере отдачи ответа
+    rows = export_rows(queryset)
+    return _batched(_csv_lines(rows) if file_format == 'csv' else _ndjson_lines(rows))
+
+
+# --- Загрузка ---
+
+def _decoded(lines):
+    for number, line in enumerate(lines, start=1):
+        try:
+            text = line.decode('utf-8')
+        except UnicodeDecodeError:
+            raise ValueError(f'Line {number}: file must be UTF-8')
+        yield text.lstrip('\ufeff') if number == 1 else text
+
+
+def read_rows(lines, file_format):
+    # lines — байтовые строки файла (загруженный файл или open(path, 'rb')).
+    # -> (номер строки, словарь); None вместо словаря — строку не разобрать
+    text = _decoded(lines)
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as error:
+            raise ValueError(f'Line {reader.line_num}: {error}')
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def _text(row, field, errors, required=False):
+    value = row.get(field)
+    if value is None:
+        value = ''
+    if not isinstance(value, str):
+        errors[field] = 'Must be a string'
+        return ''
+    value = value.strip()
+    max_length = Attraction._meta.get_field(field).max_length
+    if required and not value:
+        errors[field] = 'This field is required'
+    elif max_length and len(value) > max_length:
+        errors[field] = f'At most {max_length} characters'
+    return value
+
+
+def _number(row, field, errors, integer=False, low=None, high=None):
+    # Пустое значение (пустая ячейка CSV, null) -> None
+    value = row.get(field)
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = float(value)
+        if not math.isfinite(number) or (integer and not number.is_integer()):
+            raise ValueError
+    except (TypeError, ValueError):
+        errors[field] = 'Must be an integer' if integer else 'Must be a number'
+        return None
+    if (low is not None and number < low) or (high is not None and number > high):
+        errors[field] = f'Must be in [{low}, {high}]' if high is not None else f'Must be at least {low}'
+        return None
+    return int(number) if integer else number
+
+
+def _reference(row, field, names, model, errors, create_missing, dry_run):
+    name = _text(row, field, errors, required=True)
+    if field in errors:
+        return None
+    key = name.casefold()
+    if key not in names:
+        if not create_missing:
+            errors[field] = f'Unknown {field} "{name}"'
+            return None
+        # При пробном прогоне ничего не создаем: запоминаем, что название допустимо
+        names[key] = None if dry_run else model.objects.get_or_create(name=name)[0].pk
+    return names[key]
+
+
+def _clean(row, regions, categories, create_missing, dry_run):
+    # -> (значения для Attraction, ошибки {поле: текст})
+    if row is None:
+        return None, {'line': 'Not a JSON object'}
+    errors = {}
+    values = {'id': _number(row, 'id', errors, integer=True, low=1)}
+    values['name'] = _text(row, 'name', errors, required=True)
+    values['description'] = _text(row, 'description', errors, required=True)
+    values['region_id'] = _reference(row, 'region', regions, Region, errors, create_missing, dry_run)
+    values['category_id'] = _reference(row, 'category', categories, Category, errors, create_missing, dry_run)
+
+    present = {field for field in OPTIONAL_FIELDS if field in row}
+    if len(present & {'latitude', 'longitude'}) == 1:
+        errors['latitude'] = 'latitude and longitude must be given together'
+    if 'latitude' in present:
+        values['latitude'] = _number(row, 'latitude', errors, low=-90, high=90)
+    if 'longitude' in present:
+        values['longitude'] = _number(row, 'longitude', errors, low=-180, high=180)
+    if 'status' in present:
+        values['status'] = _text(row, 'status', errors)
+        if values['status'] not in STATUSES:
+            errors['status'] = f'Must be one of: {", ".join(sorted(STATUSES))}'
+    for field in ('entrance_fee', 'best_time', 'image'):
+        if field in present:
+            values[field] = _text(row, field, errors)
+    if 'visitors_count' in present:
+        values['visitors_count'] = _number(row, 'visitors_count', errors, integer=True, low=0) or 0
+    return values, errors
+
+
+def _save_chunk(chunk, report, dry_run):
+    # Строки без id сопоставляем с существующими записями по (регион, название) — один запрос
+    names = {values['name'] for values in chunk if values['id'] is None}
+    by_name = {}
+    if names:
+        rows = Attraction.objects.filter(name__in=names).values_list('pk', 'region_id', 'name')
+        by_name = {(region_id, name): pk for pk, region_id, name in rows}
+
+    # Одна запись может встретиться в файле дважды — берем последнюю строку
+    # (ON CONFLICT не может обновить одну строку дважды за один INSERT)
+    unique = {}
+    for values in chunk:
+        pk = values['id'] or by_name.get((values['region_id'], values['name']))
+        unique[pk or ('new', values['region_id'], values['name'])] = {**values, 'id': pk}
+
+    pks = [values['id'] for values in unique.values() if values['id']]
+    existing = set(Attraction.objects.filter(pk__in=pks).values_list('pk', flat=True)) if pks else set()
+    report['updated'] += len(existing)
+    report['created'] += len(unique) - len(existing)
+    if dry_run:
+        return
+
+    # Разные наборы колонок (в NDJSON строки могут отличаться) — отдельный INSERT на каждый
+    groups = {}
+    for values in unique.values():
+        groups.setdefault(frozenset(values), []).append(values)
+    saved = []
+    with transaction.atomic():
+        for columns, group in groups.items():
+            objects = []
+            for values in group:
+                attraction = Attraction(**values)
+                # bulk_create не вызывает save(), где считается geohash
+                attraction.geohash = attraction.compute_geohash()
+                objects.append(attraction)
+            # region_id -> region: bulk_create ждет имена полей модели
+            update_fields = [field.removesuffix('_id') for field in columns if field != 'id']
+            if 'latitude' in columns:
+                update_fields.append('geohash')
+            Attraction.objects.bulk_create(
+                objects, update_conflicts=True, unique_fields=['id'], update_fields=update_fields,
+            )
+            saved.extend(attraction.pk for attraction in objects)
+        # bulk_create не шлет post_save: обновляем то, что делают сигналы (api/signals.py)
+        update_attraction_vectors(Attraction.objects.filter(pk__in=saved))
+    vectors.schedule(vector_index.refresh_attractions, Attraction.objects.filter(pk__in=saved))
+
+
+def _reset_sequence():
+    # Строки с явным id не двигают последовательность PostgreSQL: без этого следующий
+    # INSERT без id получил бы уже занятый номер
+    statements = connection.ops.sequence_reset_sql(no_style(), [Attraction])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def import_rows(rows, create_missing=False, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    # rows — результат read_rows. Неверные строки пропускаются и попадают в отчет,
+    # каждая пачка записывается своей транзакцией.
+    # -> {'created': n, 'updated': n, 'invalid': n, 'errors': [{'line': n, 'errors': {...}}]}
+    regions = {name.casefold(): pk for pk, name in Region.objects.values_list('pk', 'name')}
+    categories = {name.casefold(): pk for pk, name in Category.objects.values_list('pk', 'name')}
+    report = {'created': 0, 'updated': 0, 'invalid': 0, 'errors': []}
+    chunk = []
+    for number, row in rows:
+        values, errors = _clean(row, regions, categories, create_missing, dry_run)
+        if errors:
+            report['invalid'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': number, 'errors': errors})
+            continue
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            _save_chunk(chunk, report, dry_run)
+            chunk = []
+    if chunk:
+        _save_chunk(chunk, report, dry_run)
+    if not dry_run and report['created'] + report['updated']:
+        _reset_sequence()
+        bump_generation()
+    return report
@@ -0,0 +1,170 @@
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+from .models import Conversation, ConversationTurn
+
+# Память диалога ИИ-гида с жестким бюджетом токенов на запрос.
+# В запрос к модели идут: инструкция + пересказ старых реплик + новые данные из базы
+# + последние реплики, которые влезают в бюджет + вопрос. Реплики, которые не влезли,
+# сжимаются в пересказ (summary) — поэтому цена запроса не растет с длиной диалога
+AI_PROMPT_TOKEN_BUDGET = getattr(settings, 'AI_PROMPT_TOKEN_BUDGET', 1500)
+# Сколько токенов бюджета зарезервировано под пересказ
+AI_SUMMARY_MAX_TOKENS = getattr(settings, 'AI_SUMMARY_MAX_TOKENS', 200)
+
+SUMMARY_INSTRUCTION = (
+    "Summarize this conversation between a tourist and a TourismKZ guide for the guide's memory. "
+    f"Keep places, dates, budget, group and preferences. At most {AI_SUMMARY_MAX_TOKENS // 2} words."
+)
+
+
+def count_tokens(text):
+    # Грубая оценка без токенизатора: ~3 символа на токен (для кириллицы это ближе к
+    # реальности, чем 4). Используется, когда сервер не прислал usage
+    return math.ceil(len(text) / 3) if text else 0
+
+
+def count_message_tokens(messages):
+    # +4 на служебные токены каждого сообщения (роль, разделители)
+    return sum(count_tokens(message['content']) + 4 for message in messages)
+
+
+def load(conversation_id, user):
+    # Неизвестный (или чужой) id — начинаем новый диалог. Новый диалог
+    # сохраняется в БД только вместе с первой репликой
+    user = user if user.is_authenticated else None
+    conversation = None
+    if conversation_id:
+        try:
+            conversation = Conversation.objects.filter(pk=conversation_id).first()
+        except ValidationError:
+            # Невалидный UUID
+            conversation = None
+    if conversation is None or (conversation.user_id and conversation.user_id != getattr(user, 'pk', None)):
+        conversation = Conversation(user=user)
+    return conversation
+
+
+def has_history(conversation):
+    return conversation.turns_count > 0
+
+
+def context_text(context):
+    # context — {'attraction:3': "- Kolsai Lakes: описание...\n"} -> текст для модели
+    if not context:
+        return ""
+    return "Found Attractions and Routes in DB:\n" + ''.join(context.values())
+
+
+def system_instruction(summary, context_data):
+    parts = ["You are a guide for TourismKZ. "]
+    if summary:
+        parts.append(f"Summary of the conversation so far: {summary}\n")
+    if context_data:
+        parts.append(f"Use this DB data to answer: {context_data}")
+    return ''.join(parts)
+
+
+def build_messages(conversation, context, user_query, summarize):
+    # summarize(previous_summary, turns) -> (summary, prompt_tokens, completion_tokens).
+    # Последние реплики берем с конца, пока хватает бюджета; остальные сворачиваем в пересказ.
+    # Данные из базы, которые пришли с оставшимися репликами, идут в запрос вместе с ними,
+    # поэтому повторно не описываются. Данные свернутых реплик ушли вместе с ними —
+    # если место снова нашлось поиском, его описание отправляется заново.
+    # -> (messages, новые данные из базы для record_turn)
+    fixed = (
+        count_tokens(system_instruction('', context_text(context))) + count_tokens(user_query)
+        + AI_SUMMARY_MAX_TOKENS + 8
+    )
+    history_budget = max(0, AI_PROMPT_TOKEN_BUDGET - fixed)
+
+    turns = list(conversation.turns.filter(summarized=False))
+    kept, used = [], 0
+    for turn in reversed(turns):
+        if used + turn.tokens > history_budget:
+            break
+        kept.append(turn)
+        used += turn.tokens
+    kept.reverse()
+    folded = turns[:len(turns) - len(kept)]
+
+    if folded:
+        summary, prompt_tokens, completion_tokens = summarize(conversation.summary, folded)
+        conversation.summary = summary
+        with transaction.atomic():
+            ConversationTurn.objects.filter(pk__in=[turn.pk for turn in folded]).update(summarized=True)
+            Conversation.objects.filter(pk=conversation.pk).update(
+                summary=summary,
+                prompt_tokens=F('prompt_tokens') + prompt_tokens,
+                completion_tokens=F('completion_tokens') + completion_tokens,
+            )
+
+    replayed = {}
+    for turn in kept:
+        replayed.update(turn.context)
+    new_context = {key: line for key, line in context.items() if key not in replayed}
+
+    messages = [{
+        "role": "system",
+        "content": system_instruction(conversation.summary, context_text({**replayed, **new_context})),
+    }]
+    for turn in kept:
+        messages.append({"role": "user", "content": turn.question})
+        messages.append({"role": "assistant", "content": turn.reply})
+    messages.append({"role": "user", "content": user_query})
+    return messages, new_context
+
+
+def summary_messages(previous_summary, turns):
+    lines = [f"Previous summary: {previous_summary}"] if previous_summary else []
+    for turn in turns:
+        lines.append(f"Tourist: {turn.question}")
+        lines.append(f"Guide: {turn.reply}")
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTION},
+        {"role": "user", "content": '\n'.join(lines)},
+    ]
+
+
+def fallback_summary(previous_summary, turns):
+    # Если модель недоступна — пересказ из самих вопросов, обрезанный до бюджета
+    questions = '; '.join(turn.question for turn in turns)
+    summary = f"{previous_summary}; {questions}" if previous_summary else questions
+    return summary[-AI_SUMMARY_MAX_TOKENS * 3:]
+
+
+def record_turn(conversation, user_query, reply, context, messages, usage=None):
+    # context — данные из базы, впервые отправленные с этим вопросом (см. build_messages).
+    # usage — объект usage из ответа OpenAI; без него считаем по оценке
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt_tokens, completion_tokens = count_message_tokens(messages), count_tokens(reply)
+
+    with transaction.atomic():
+        if conversation._state.adding:
+            conversation.save()
+        else:
+            conversation = Conversation.objects.select_for_update().get(pk=conversation.pk)
+        ConversationTurn.objects.create(
+            conversation=conversation, question=user_query, reply=reply, context=context,
+            tokens=count_tokens(user_query) + count_tokens(reply) + count_tokens(''.join(context.values())) + 8,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        )
+        conversation.prompt_tokens += prompt_tokens
+        conversation.completion_tokens += completion_tokens
+        conversation.turns_count += 1
+        conversation.save(update_fields=[
+            'prompt_tokens', 'completion_tokens', 'turns_count', 'updated_at',
+        ])
+
+    return {
+        'conversation': str(conversation.pk),
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'conversation_tokens': conversation.total_tokens,
+        'turns': conversation.turns_count,
+    }
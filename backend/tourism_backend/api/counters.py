@@ -0,0 +1,137 @@
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from .models import Attraction
+
+# Просмотры копятся в памяти процесса и сбрасываются в БД пачкой раз в
+# FLUSH_INTERVAL секунд (или когда набралось MAX_PENDING разных достопримечательностей).
+# Кроме самих просмотров, буфер сбрасывает фоновый поток (проверка раз в FLUSH_TICK секунд),
+# поэтому и в простаивающем процессе просмотр попадает в БД не позже чем через
+# FLUSH_INTERVAL + FLUSH_TICK секунд. Столько же теряется при падении процесса (SIGKILL)
+FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 10)
+FLUSH_TICK = 1
+# False — без фонового потока: буфер сбрасывают только новые просмотры и выход процесса (тесты)
+FLUSH_IN_BACKGROUND = getattr(settings, 'VIEW_COUNTER_FLUSH_IN_BACKGROUND', True)
+MAX_PENDING = getattr(settings, 'VIEW_COUNTER_MAX_PENDING', 1000)
+# Один и тот же посетитель считается повторно не чаще, чем раз в VISITOR_WINDOW секунд
+VISITOR_WINDOW = getattr(settings, 'VIEW_COUNTER_VISITOR_WINDOW', 60 * 60 * 24)
+
+_lock = threading.Lock()
+_views = Counter()
+_visitors = Counter()
+_last_flush = time.monotonic()
+_flusher = None
+
+logger = logging.getLogger(__name__)
+
+
+def visitor_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    raw = f"{request.META.get('REMOTE_ADDR', '')}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return 'anon:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def record_view(attraction_id, visitor):
+    # cache.add атомарен: True только для первого просмотра посетителя в окне
+    is_new_visitor = cache.add(f'visitor:{attraction_id}:{visitor}', 1, VISITOR_WINDOW)
+    with _lock:
+        _start_flusher()
+        _views[attraction_id] += 1
+        if is_new_visitor:
+            _visitors[attraction_id] += 1
+        # По таймеру буфер сбрасывает фоновый поток; в потоке запроса — только
+        # переполненный буфер (или по таймеру, если фонового потока нет)
+        should_flush = (
+            len(_views) >= MAX_PENDING
+            or not FLUSH_IN_BACKGROUND and time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        )
+    if should_flush:
+        try:
+            flush()
+        except Exception:
+            # Просмотры уже вернулись в буфер — ошибка БД не должна ронять сам просмотр
+            logger.exception('View counter flush failed')
+
+
+def pending_views():
+    with _lock:
+        return sum(_views.values())
+
+
+def flush():
+    global _views, _visitors, _last_flush
+    # Забираем накопленное под блокировкой, а пишем в БД уже без нее
+    with _lock:
+        views, visitors = _views, _visitors
+        _views, _visitors = Counter(), Counter()
+        _last_flush = time.monotonic()
+    if not views:
+        return 0
+
+    # Группируем достопримечательности с одинаковым приростом: один UPDATE ... WHERE id IN (...)
+    # на каждую группу, вместо отдельного UPDATE (и блокировки строки) на каждый просмотр
+    groups = defaultdict(list)
+    for attraction_id, count in views.items():
+        groups[(count, visitors.get(attraction_id, 0))].append(attraction_id)
+    try:
+        # Несколько UPDATE — одной транзакцией: при ошибке не записано ничего
+        with transaction.atomic() if len(groups) > 1 else nullcontext():
+            for (view_count, visitor_count), ids in groups.items():
+                changes = {'page_views': F('page_views') + view_count}
+                if visitor_count:
+                    changes['visitors_count'] = F('visitors_count') + visitor_count
+                Attraction.objects.filter(pk__in=ids).update(**changes)
+    except Exception:
+        # Ничего не записано — возвращаем просмотры в буфер до следующего сброса
+        with _lock:
+            _views.update(views)
+            _visitors.update(visitors)
+        raise
+    return sum(views.values())
+
+
+def _flush_periodically():
+    while FLUSH_IN_BACKGROUND:
+        time.sleep(FLUSH_TICK)
+        with _lock:
+            due = _views and time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        if not due:
+            continue
+        try:
+            flush()
+        except Exception:
+            logger.exception('View counter flush failed')
+        finally:
+            # Поток живет весь процесс — не держим устаревшее соединение с БД
+            close_old_connections()
+
+
+def _start_flusher():
+    # Вызывается под _lock при первом просмотре. После fork (gunicorn --preload) поток
+    # родителя в дочернем процессе не работает — запускаем свой
+    global _flusher
+    if FLUSH_IN_BACKGROUND and (_flusher is None or not _flusher.is_alive()):
+        _flusher = threading.Thread(target=_flush_periodically, name='view-counter-flush', daemon=True)
+        _flusher.start()
+
+
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        # БД может быть уже недоступна при остановке процесса
+        pass
+
+
+atexit.register(_flush_on_exit)
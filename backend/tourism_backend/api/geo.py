@@ -0,0 +1,173 @@
+import math
+
+import numpy as np
+from django.db.models import Q
+
+# Поиск "рядом со мной" без PostGIS.
+# У каждой достопримечательности есть geohash (Attraction.geohash): строка, у которой
+# общий префикс означает общую ячейку сетки, а соседние ячейки чаще всего идут подряд
+# в сортировке. Поэтому область на карте — это несколько диапазонов строк, которые
+# B-tree индекс по geohash (частичный, только активные) читает без полного прохода по таблице.
+# Запрос: ячейки, покрывающие bounding box круга -> кандидаты из БД (только id и
+# координаты) -> точное расстояние numpy по всем кандидатам сразу -> сортировка
+GEOHASH_PRECISION = 8  # ~38 x 19 м
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+# Больше ячеек — точнее префильтр (соседние ячейки склеиваются в один диапазон)
+MAX_COVER_CELLS = 32
+# Больше диапазонов — меньше лишних строк, но длиннее SQL (каждый — отдельный SELECT в UNION ALL)
+MAX_RANGES = 4
+# Радиусы до этого значения ищутся сразу целиком
+MIN_STEP_KM = 5
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, value, bits, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Биты по очереди: долгота, широта, долгота...
+        span, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (span[0] + span[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            span[0] = middle
+        else:
+            value *= 2
+            span[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            value, bits = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    # -> (высота, ширина) ячейки в градусах
+    bits = precision * 5
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # -> (min_lat, max_lat, min_lon, max_lon), все точки круга внутри
+    angular = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angular)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        # Круг накрывает полюс — по долготе берем все
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+    delta_lon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(latitude))))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        # Переход через 180-й меридиан не разбиваем на два прямоугольника
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def covering_cells(box, max_cells=MAX_COVER_CELLS):
+    # Самые мелкие ячейки, которых нужно не больше max_cells, чтобы накрыть box
+    min_lat, max_lat, min_lon, max_lon = box
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        columns = math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+    cells = set()
+    first_row, first_column = math.floor((min_lat + 90) / height), math.floor((min_lon + 180) / width)
+    for row in range(first_row, first_row + rows):
+        for column in range(first_column, first_column + columns):
+            # Центр ячейки — однозначно внутри нее
+            center_lat = min(89.999999, (row + 0.5) * height - 90)
+            center_lon = min(179.999999, (column + 0.5) * width - 180)
+            cells.add(encode(center_lat, center_lon, precision))
+    return sorted(cells)
+
+
+def _to_int(cell):
+    value = 0
+    for char in cell:
+        value = value * 32 + BASE32.index(char)
+    return value
+
+
+def _to_cell(value, precision):
+    chars = []
+    for _ in range(precision):
+        value, digit = divmod(value, 32)
+        chars.append(BASE32[digit])
+    return ''.join(reversed(chars))
+
+
+def cell_ranges(cells, max_ranges=MAX_RANGES):
+    # -> [(от, до)] строковые границы: geohash >= от AND geohash < до (до=None — без верхней).
+    # Ячейки, идущие подряд, склеиваются в один диапазон; если диапазонов больше
+    # max_ranges, склеиваем ближайшие через промежуток (лишние строки отсечет bounding box)
+    ranges = []
+    for cell in cells:
+        value = _to_int(cell)
+        if ranges and ranges[-1][1] == value:
+            ranges[-1][1] = value + 1
+        else:
+            ranges.append([value, value + 1])
+    while len(ranges) > max_ranges:
+        i = min(range(len(ranges) - 1), key=lambda i: ranges[i + 1][0] - ranges[i][1])
+        ranges[i:i + 2] = [[ranges[i][0], ranges[i + 1][1]]]
+    precision = len(cells[0]) if cells else 0
+    return [
+        (_to_cell(start, precision), _to_cell(end, precision) if end < 32 ** precision else None)
+        for start, end in ranges
+    ]
+
+
+def cells_queryset(queryset, cells, field='geohash'):
+    # Диапазон на подзапрос, склеенные UNION ALL: так индекс используется и в SQLite,
+    # который не умеет OR из нескольких диапазонов по одному индексу
+    parts = []
+    for start, end in cell_ranges(cells):
+        bounds = {f'{field}__gte': start}
+        if end is not None:
+            bounds[f'{field}__lt'] = end
+        parts.append(queryset.filter(**bounds))
+    return parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    # Расстояние от точки до массива точек, векторно
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def within(queryset, latitude, longitude, radius_km):
+    # -> (ids, distances) всех точек в радиусе, без сортировки
+    box = bounding_box(latitude, longitude, radius_km)
+    min_lat, max_lat, min_lon, max_lon = box
+    candidates = queryset.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+    rows = list(cells_queryset(candidates.values_list('id', 'latitude', 'longitude'), covering_cells(box)))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    rows = np.array(rows, dtype=np.float64)
+    distances = haversine_km(latitude, longitude, rows[:, 1], rows[:, 2])
+    inside = distances <= radius_km
+    return rows[inside, 0].astype(np.int64), distances[inside]
+
+
+def nearby(queryset, latitude, longitude, radius_km, limit):
+    # -> [(id, расстояние в км)], ближайшие сначала.
+    # Большой радиус проверяем по шагам: 1/16, 1/4, целиком. Если limit мест нашлось
+    # в малом круге, дальние точки не нужны (в плотных районах это в разы меньше строк)
+    search_km = max(radius_km / 16, MIN_STEP_KM)
+    while True:
+        search_km = min(search_km, radius_km)
+        ids, distances = within(queryset, latitude, longitude, search_km)
+        if len(ids) >= limit or search_km >= radius_km:
+            break
+        search_km *= 4
+    if len(ids) > limit:
+        # Частичная сортировка: полностью сортируем только limit ближайших
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+        ids, distances = ids[nearest], distances[nearest]
+    order = np.argsort(distances, kind='stable')
+    return [(int(ids[i]), float(distances[i])) for i in order]
@@ -0,0 +1,99 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+# Заголовок Idempotency-Key для брони и оплаты: клиент (мобильный, на плохой сети)
+# повторяет запрос с тем же ключом, а сервер отдает сохраненный ответ вместо новой брони
+# или повторного платежа.
+# Ключ занимается INSERT'ом в той же транзакции, что и сам запрос, и ответ сохраняется
+# перед COMMIT. Параллельный дубль ждет на уникальном индексе (user, key), пока первый
+# запрос не закончится, и получает его ответ. Ошибка (исключение, 5xx) откатывает все
+# вместе с ключом — такой запрос можно повторить.
+# Ключи живут IDEMPOTENCY_KEY_TTL_HOURS, потом удаляются командой expire_idempotency_keys
+IDEMPOTENCY_KEY_TTL_HOURS = getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24)
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DELETE_BATCH_SIZE = 1000
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _cutoff():
+    return timezone.now() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def _claim(user, key, request_fingerprint):
+    # -> (True, новая запись) или (False, сохраненная запись с этим ключом)
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return True, IdempotencyKey.objects.create(user=user, key=key, fingerprint=request_fingerprint)
+        except IntegrityError:
+            pass
+        existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if existing is None:
+            # Запись удалили между INSERT и SELECT (откат первого запроса, очистка) — еще раз
+            continue
+        if existing.created_at >= _cutoff():
+            return False, existing
+        # Просроченный ключ, который еще не удалила команда, — считаем новым
+        existing.delete()
+    return True, IdempotencyKey.objects.create(user=user, key=key, fingerprint=request_fingerprint)
+
+
+def idempotent(handler):
+    # Декоратор метода ViewSet: без заголовка запрос выполняется как обычно
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        request_fingerprint = fingerprint(request)
+        with transaction.atomic():
+            claimed, record = _claim(request.user, key, request_fingerprint)
+            if not claimed:
+                if record.fingerprint != request_fingerprint:
+                    return Response({'error': f'{HEADER} was already used with a different request'},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                # Повтор: БД не трогаем, отдаем тот же ответ
+                response = Response(record.response, status=record.status_code)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                transaction.set_rollback(True)
+                return response
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=['status_code', 'response'])
+        return response
+
+    return wrapper
+
+
+def delete_expired():
+    # Удаляет ключи старше TTL пачками (короткие транзакции). -> число удаленных
+    expired = IdempotencyKey.objects.filter(created_at__lt=_cutoff())
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:DELETE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+# Уменьшенные копии загруженных фото (достопримечательности, аватары).
+# После сохранения объекта копии строятся в фоновом потоке (не в запросе загрузки)
+# и записываются в JSON-поле модели: {'source': имя оригинала, 'thumb': {...}, ...}.
+# Имя файла содержит хэш его содержимого, поэтому файл никогда не меняется по тому же
+# адресу — его можно кэшировать "навсегда" (Cache-Control: immutable, см. urls.py и README)
+IMAGE_VARIANTS = {'thumb': 160, 'card': 480, 'full': 1280}  # ширина, px (без увеличения)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'variants'
+# False — строить копии сразу в save() (тесты, команда build_image_variants)
+IMAGE_VARIANTS_ASYNC = getattr(settings, 'IMAGE_VARIANTS_ASYNC', True)
+IMAGE_VARIANTS_WORKERS = getattr(settings, 'IMAGE_VARIANTS_WORKERS', 2)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _open_rgb(field_file):
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        image.load()
+    finally:
+        field_file.close()
+    # Фото с телефона повернуты через EXIF — применяем поворот к пикселям
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def build_variants(field_file, folder):
+    # -> {'source': ..., 'thumb': {'width', 'height', 'webp', 'jpeg'}, ...} — имена в storage
+    storage = field_file.storage
+    original = _open_rgb(field_file)
+    variants = {'source': field_file.name}
+    entry = None
+    for variant, width in IMAGE_VARIANTS.items():
+        if entry and entry['width'] == original.width:
+            # Оригинал уже этого размера: большие варианты совпадают с предыдущим
+            variants[variant] = entry
+            continue
+        image = original.copy()
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for extension, (image_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            content = buffer.getvalue()
+            digest = hashlib.sha256(content).hexdigest()[:16]
+            name = f'{VARIANTS_DIR}/{folder}/{variant}-{digest}.{extension}'
+            if not storage.exists(name):
+                storage.save(name, ContentFile(content))
+            entry[extension] = name
+        variants[variant] = entry
+    return variants
+
+
+def variant_names(variants):
+    return {
+        entry[extension]
+        for variant, entry in (variants or {}).items() if variant != 'source'
+        for extension in FORMATS
+    }
+
+
+def process(model, pk, field_name, variants_field, force=False):
+    # Строит копии для текущего файла объекта и удаляет копии прежнего
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    field_file = getattr(instance, field_name)
+    old = getattr(instance, variants_field) or {}
+    if field_file and old.get('source') == field_file.name and not force:
+        return
+    new = build_variants(field_file, f'{model._meta.model_name}/{pk}') if field_file else {}
+    storage = field_file.storage
+    # update(), а не save(): не запускать сигналы и этот обработчик снова.
+    # Записываем, только если фото не заменили, пока строились копии
+    if not model.objects.filter(pk=pk, **{field_name: field_file.name or ''}).update(**{variants_field: new}):
+        # Устаревшая задача: удаляем только что построенные копии, кроме тех, на которые
+        # ссылается запись (копии нового фото строит и старые удаляет его собственная задача)
+        current = model.objects.filter(pk=pk).values_list(variants_field, flat=True).first()
+        for name in variant_names(new) - variant_names(current) - variant_names(old):
+            storage.delete(name)
+        return
+    for name in variant_names(old) - variant_names(new):
+        storage.delete(name)
+    if model._meta.model_name == 'attraction':
+        from .cache import bump_generation
+        bump_generation()
+
+
+def _run(model, pk, field_name, variants_field):
+    try:
+        process(model, pk, field_name, variants_field)
+    except Exception:
+        logger.exception('Image variants failed for %s %s', model._meta.label, pk)
+    finally:
+        # Поток пула держит свое соединение с БД — закрываем, если оно устарело
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_VARIANTS_WORKERS, thread_name_prefix='image-variants')
+        return _executor
+
+
+def schedule(instance, field_name, variants_field):
+    # Вызывается из post_save: ничего не делает, если копии уже от этого файла
+    field_file = getattr(instance, field_name)
+    current = getattr(instance, variants_field) or {}
+    if (field_file.name or None) == current.get('source'):
+        return
+    arguments = (type(instance), instance.pk, field_name, variants_field)
+    if IMAGE_VARIANTS_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_run, *arguments))
+    else:
+        process(*arguments)
+
+
+def srcset(field_file, variants, request=None):
+    # -> {'thumb': {'width', 'height', 'webp': url, 'jpeg': url}, ...,
+    #     'srcset': {'webp': 'url 160w, url 480w, ...', 'jpeg': ...}}
+    # или None, пока копии текущего файла не готовы (клиент берет оригинал)
+    if not field_file or not variants or variants.get('source') != field_file.name:
+        return None
+    result, sets, widths = {}, {extension: [] for extension in FORMATS}, set()
+    for variant in IMAGE_VARIANTS:
+        entry = variants.get(variant)
+        if not entry:
+            continue
+        urls = {}
+        for extension in FORMATS:
+            url = field_file.storage.url(entry[extension])
+            urls[extension] = request.build_absolute_uri(url) if request else url
+            if entry['width'] not in widths:
+                sets[extension].append(f"{urls[extension]} {entry['width']}w")
+        widths.add(entry['width'])
+        result[variant] = {'width': entry['width'], 'height': entry['height'], **urls}
+    result['srcset'] = {extension: ', '.join(items) for extension, items in sets.items()}
+    return result
+
+
+def preferred_url(field_file, variants, variant='card', extension='webp'):
+    # URL копии, если она готова, иначе оригинала ('' без картинки)
+    if not field_file:
+        return ''
+    entry = (variants or {}).get(variant)
+    if entry and variants.get('source') == field_file.name:
+        return field_file.storage.url(entry[extension])
+    return field_file.url
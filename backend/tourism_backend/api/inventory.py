@@ -0,0 +1,103 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Booking, Departure
+
+# Места на выезд маршрута (Departure: маршрут + дата).
+# Бронь занимает места одним условным UPDATE:
+#   UPDATE departure SET seats_available = seats_available - n WHERE id = ... AND seats_available >= n
+# Проверка и списание — одна операция в БД, поэтому параллельные брони не продадут больше
+# мест, чем есть, без чтения остатка в Python. Строку выезда UPDATE блокирует до конца
+# транзакции, поэтому он выполняется последним — перед самым COMMIT.
+# Неоплаченная бронь держит места BOOKING_HOLD_MINUTES, потом истекает и возвращает их
+BOOKING_HOLD_MINUTES = getattr(settings, 'BOOKING_HOLD_MINUTES', 15)
+EXPIRE_BATCH_SIZE = 500
+# Брони в этих статусах занимают места
+HOLDING_STATUSES = ('pending', 'paid')
+
+
+class SoldOut(Exception):
+    def __init__(self, seats_available):
+        super().__init__(f'Only {seats_available} seats left')
+        self.seats_available = seats_available
+
+
+def departure_id(route_id, date):
+    # -> id выезда или None, если места на эту дату не ограничены
+    return Departure.objects.filter(route_id=route_id, date=date).values_list('pk', flat=True).first()
+
+
+def hold_until():
+    return timezone.now() + timedelta(minutes=BOOKING_HOLD_MINUTES)
+
+
+def _take(departure, seats):
+    return Departure.objects.filter(pk=departure, seats_available__gte=seats).update(
+        seats_available=F('seats_available') - seats
+    )
+
+
+def _give_back(departure, seats):
+    Departure.objects.filter(pk=departure).update(seats_available=F('seats_available') + seats)
+
+
+def take_seats(departure, seats):
+    # Вызывать последним в транзакции, которая создает бронь: SoldOut откатывает ее целиком.
+    # Мест не хватило — сначала возвращаем места истекших броней этого выезда и пробуем еще раз
+    if _take(departure, seats):
+        return
+    if release_expired(departure) and _take(departure, seats):
+        return
+    raise SoldOut(Departure.objects.filter(pk=departure).values_list('seats_available', flat=True).first() or 0)
+
+
+def release_expired(departure=None):
+    # Истекшие неоплаченные брони -> 'expired', их места возвращаются выезду.
+    # -> число возвращенных мест
+    expired = Booking.objects.filter(status='pending', expires_at__lt=timezone.now())
+    if departure is not None:
+        expired = expired.filter(departure_id=departure)
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Брони, которые сейчас оплачивают или истекает другой процесс, пропускаем (PostgreSQL)
+            rows = list(
+                expired.select_for_update(skip_locked=True)
+                .values_list('pk', 'departure_id', 'people_count')[:EXPIRE_BATCH_SIZE]
+            )
+            if not rows:
+                return released
+            Booking.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(status='expired')
+            seats = defaultdict(int)
+            for _, booking_departure, people in rows:
+                if booking_departure is not None:
+                    seats[booking_departure] += people
+            for booking_departure, count in seats.items():
+                _give_back(booking_departure, count)
+            released += sum(seats.values())
+        if len(rows) < EXPIRE_BATCH_SIZE:
+            return released
+
+
+def pay(booking):
+    # pending -> paid одним условным UPDATE: истекшую бронь оплатить нельзя,
+    # а оплаченную release_expired уже не тронет. -> True, если статус сменился
+    return bool(
+        Booking.objects.filter(pk=booking.pk, status='pending')
+        .exclude(expires_at__lt=timezone.now())
+        .update(status='paid')
+    )
+
+
+def cancel(booking):
+    # Места возвращаются, только если этот вызов сам сменил статус — не дважды
+    if not Booking.objects.filter(pk=booking.pk, status__in=HOLDING_STATUSES).update(status='cancelled'):
+        return False
+    if booking.departure_id is not None:
+        _give_back(booking.departure_id, booking.people_count)
+    return True
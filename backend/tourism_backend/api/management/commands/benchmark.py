@@ -0,0 +1,68 @@
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Measures p50/p95 latency, SQL query count and response size of API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', help='Endpoint names to measure (default: all)')
+        parser.add_argument('--output', help='Write results as JSON to this file ("-" for stdout)')
+        parser.add_argument('--baseline', default=str(benchmarks.BASELINE_PATH))
+        parser.add_argument('--check', action='store_true', help='Fail if results regress against the baseline')
+        parser.add_argument('--no-latency', action='store_true', help='With --check, compare query counts only')
+        parser.add_argument('--latency-tolerance', type=float, default=1.5)
+        parser.add_argument('--update-baseline', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(options['iterations'], options['warmup'], options['only'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        self.stdout.write(f"{'endpoint':32} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'bytes':>9}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:32} {row['p50_ms']:>8} {row['p95_ms']:>8} {row['queries']:>8} {row['bytes']:>9}"
+            )
+
+        if options['output']:
+            report = json.dumps({
+                'meta': {
+                    'timestamp': datetime.now(timezone.utc).isoformat(),
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'iterations': options['iterations'],
+                },
+                'results': results,
+            }, indent=2)
+            if options['output'] == '-':
+                sys.stdout.write(report + '\n')
+            else:
+                with open(options['output'], 'w') as file:
+                    file.write(report + '\n')
+
+        if options['update_baseline']:
+            baseline = benchmarks.load_baseline(options['baseline'])
+            baseline.update(results)
+            benchmarks.save_baseline(baseline, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline updated: {options['baseline']}"))
+            return
+
+        if options['check']:
+            regressions = benchmarks.compare(
+                results, benchmarks.load_baseline(options['baseline']),
+                check_latency=not options['no_latency'], latency_tolerance=options['latency_tolerance'],
+            )
+            if regressions:
+                raise CommandError('Regressions:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api import images
+from api.models import Attraction, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Builds thumb/card/full WebP and JPEG variants for attraction photos and avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that already exist')
+
+    def handle(self, *args, **options):
+        # Для фото, загруженных до появления копий, и после смены настроек размеров/качества
+        for model, field_name, variants_field in (
+            (Attraction, 'image', 'image_variants'),
+            (UserProfile, 'avatar', 'avatar_variants'),
+        ):
+            pks = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            built = failed = 0
+            for pk in pks.values_list('pk', flat=True).iterator():
+                try:
+                    images.process(model, pk, field_name, variants_field, force=options['force'])
+                    built += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {pk}: {error}')
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: {built} processed, {failed} failed'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Expires unpaid bookings past their hold time and returns their seats (run from cron every minute)'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Returned {released} seats'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.idempotency import delete_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL_HOURS (run from cron)'
+
+    def handle(self, *args, **options):
+        deleted = delete_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
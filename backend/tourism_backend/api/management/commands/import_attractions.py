@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import catalog_io
+
+
+class Command(BaseCommand):
+    help = 'Imports attractions from an NDJSON or CSV file (the format of /api/attractions/export/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--type', choices=list(catalog_io.FORMATS), help='Default: by file extension')
+        parser.add_argument('--create-missing', action='store_true', help='Create unknown regions and categories')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the file')
+        parser.add_argument('--chunk-size', type=int, default=catalog_io.IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options['type'] or catalog_io.guess_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as file:
+                report = catalog_io.import_rows(
+                    catalog_io.read_rows(file, file_format),
+                    create_missing=options['create_missing'],
+                    dry_run=options['dry_run'],
+                    chunk_size=options['chunk_size'],
+                )
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        for item in report['errors']:
+            errors = '; '.join(f'{field}: {message}' for field, message in item['errors'].items())
+            self.stderr.write(f"line {item['line']}: {errors}")
+        summary = f"created {report['created']}, updated {report['updated']}, invalid {report['invalid']}"
+        summary = f'Dry run, nothing saved: would be {summary}' if options['dry_run'] else summary.capitalize()
+        self.stdout.write(self.style.WARNING(summary) if report['invalid'] else self.style.SUCCESS(summary))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_generation
+from api.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recalculates denormalized rating aggregates on attractions from approved reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding rating aggregates...')
+        updated = rebuild_ratings(batch_size=options['batch_size'])
+        if updated:
+            # bulk_update не шлет сигналы, сбрасываем кэш каталога сами
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} attractions'))
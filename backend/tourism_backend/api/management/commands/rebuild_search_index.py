@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Attraction, Route
+from api.search import is_postgres, update_attraction_vectors, update_route_vectors
+
+
+class Command(BaseCommand):
+    help = 'Recalculates full-text search vectors for attractions and routes (PostgreSQL only)'
+
+    def handle(self, *args, **options):
+        if not is_postgres():
+            self.stdout.write(self.style.WARNING('Full-text search requires PostgreSQL, nothing to do'))
+            return
+        update_attraction_vectors(Attraction.objects.all())
+        update_route_vectors(Route.objects.all())
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
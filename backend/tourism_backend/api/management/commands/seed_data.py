@@ -0,0 +1,310 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.cache import bump_generation
+from api.models import (
+    Attraction, Booking, Category, Region, Review, Route, RouteStop, UserProfile,
+)
+from api.ratings import rebuild_ratings
+from api.search import update_attraction_vectors, update_route_vectors
+
+# Генератор синтетических данных для нагрузочных проверок:
+#   python manage.py seed_data --reviews 1000000 --batch-size 10000
+# Каждая строка i строится из своего генератора random.Random("<seed>:<тип>:<i>"),
+# поэтому результат не зависит от размера пачки и от того, с какого места продолжили.
+# Повторный запуск досоздает только недостающие строки (их считаем по префиксу).
+# Избранное и остановки маршрутов определяются парой (пользователь, место) и (маршрут, день):
+# досоздаются только пары, которых еще нет, поэтому запуск с другими объемами не дублирует
+# избранное и не переносит остановки на чужие маршруты.
+# Даты отзывов и броней отсчитываются от --anchor-date, а не от сегодняшнего дня:
+# два запуска с одним --seed дают одинаковые строки в любой день
+
+REGIONS = ['Almaty Region', 'Astana', 'Central Kazakhstan', 'West Kazakhstan', 'East Kazakhstan',
+           'Mangystau', 'Turkestan Region', 'Abai Region']
+CATEGORIES = ['Natural Wonder', 'Lake', 'City', 'Landscape', 'Cultural', 'Mountains', 'National Park']
+ADJECTIVES = ['Blue', 'Golden', 'Silent', 'Red', 'Ancient', 'Hidden', 'Great', 'Singing', 'White', 'Wild']
+NOUNS = ['Canyon', 'Lake', 'Gorge', 'Valley', 'Mausoleum', 'Dunes', 'Peak', 'Plateau', 'Waterfall', 'Steppe']
+THEMES = ['Nomad Trail', 'Silk Road', 'Mountain Escape', 'Lakes Tour', 'Steppe Adventure', 'City Weekend']
+WORDS = ('beautiful view trail river mountain steppe guide camp sunrise history nomad yurt '
+         'horse road village lake canyon rock forest snow museum bazaar local food family').split()
+DIFFICULTIES = ['Easy', 'Moderate', 'Hard']
+# Координаты внутри Казахстана
+LATITUDE_RANGE = (40.6, 55.4)
+LONGITUDE_RANGE = (46.5, 87.3)
+ANCHOR_DATE = date(2026, 1, 1)
+
+
+@contextmanager
+def manual_timestamps(*fields):
+    # auto_now_add перезаписывает created_at при bulk_create — временно отключаем,
+    # чтобы даты отзывов и броней были разбросаны по времени, как в реальной базе
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generates deterministic synthetic data (users, attractions, reviews, favorites, routes, bookings)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--anchor-date', type=date.fromisoformat, default=ANCHOR_DATE,
+                            help='YYYY-MM-DD; generated dates lie around it (default: %(default)s)')
+        parser.add_argument('--prefix', default='seed', help='Marks generated rows; re-runs only add missing ones')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--attractions', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=100000)
+        parser.add_argument('--favorites', type=int, default=20000)
+        parser.add_argument('--routes', type=int, default=200)
+        parser.add_argument('--stops-per-route', type=int, default=5)
+        parser.add_argument('--bookings', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.seed = options['seed']
+        self.anchor_date = options['anchor_date']
+        self.anchor = timezone.make_aware(datetime.combine(self.anchor_date, datetime.min.time()))
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        if options['favorites'] > options['users'] * options['attractions']:
+            raise CommandError('--favorites cannot exceed users * attractions')
+
+        started = time.perf_counter()
+        self.total = 0
+        self.regions = [Region.objects.get_or_create(name=name)[0].pk for name in REGIONS]
+        self.categories = [Category.objects.get_or_create(name=name)[0].pk for name in CATEGORIES]
+
+        self.seed_users(options['users'])
+        self.seed_attractions(options['attractions'])
+        self.seed_reviews(options['reviews'])
+        self.seed_favorites(options['favorites'])
+        self.seed_routes(options['routes'])
+        self.seed_stops(options['stops_per_route'])
+        self.seed_bookings(options['bookings'])
+        self.refresh_denormalized()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {self.total} rows in {elapsed:.1f}s ({self.total / elapsed:,.0f} rows/s overall)'
+        ))
+
+    # --- Общая часть ---
+
+    def rng(self, kind, index):
+        return random.Random(f'{self.seed}:{kind}:{index}')
+
+    def create(self, label, model, existing, target, build, ignore_conflicts=False):
+        # Досоздает строки existing..target-1 пачками, каждая пачка — в своей транзакции
+        if existing >= target:
+            self.stdout.write(f'{label}: {existing} present, nothing to add')
+            return
+        started = time.perf_counter()
+        for start in range(existing, target, self.batch_size):
+            batch = [build(index) for index in range(start, min(start + self.batch_size, target))]
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size, ignore_conflicts=ignore_conflicts)
+        created = target - existing
+        elapsed = time.perf_counter() - started
+        self.total += created
+        self.stdout.write(f'{label}: +{created} in {elapsed:.1f}s ({created / elapsed:,.0f} rows/s)')
+
+    def text(self, rng, words):
+        return ' '.join(rng.choices(WORDS, k=words)).capitalize() + '.'
+
+    def past_datetime(self, rng, days=730):
+        return self.anchor - timedelta(seconds=rng.randrange(days * 24 * 3600))
+
+    # --- Сущности ---
+
+    def seed_users(self, target):
+        users = self.seed_users_qs = User.objects.filter(username__startswith=f'{self.prefix}_user_')
+        # Один хэш на всех: make_password для каждого пользователя занял бы минуты
+        password = make_password('seed12345')
+
+        def build(index):
+            return User(username=f'{self.prefix}_user_{index:07d}', email=f'{self.prefix}{index}@example.com',
+                        password=password)
+
+        self.create('Users', User, users.count(), target, build)
+        self.user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+        # Профили — для пользователей, у которых их еще нет
+        with_profile = set(UserProfile.objects.filter(user__in=users).values_list('user_id', flat=True))
+        missing = [(index, pk) for index, pk in enumerate(self.user_ids) if pk not in with_profile]
+        countries = ['Kazakhstan', 'Germany', 'USA', 'Korea', 'Turkey', 'China', 'France']
+        for start in range(0, len(missing), self.batch_size):
+            with transaction.atomic():
+                UserProfile.objects.bulk_create([
+                    UserProfile(user_id=pk, country=self.rng('profile', index).choice(countries))
+                    for index, pk in missing[start:start + self.batch_size]
+                ])
+        self.total += len(missing)
+
+    def seed_attractions(self, target):
+        attractions = self.seed_attractions_qs = Attraction.objects.filter(name__endswith=f'({self.prefix})')
+
+        def build(index):
+            rng = self.rng('attraction', index)
+            attraction = Attraction(
+                name=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index} ({self.prefix})',
+                region_id=rng.choice(self.regions),
+                category_id=rng.choice(self.categories),
+                description=self.text(rng, rng.randint(20, 80)),
+                latitude=round(rng.uniform(*LATITUDE_RANGE), 6),
+                longitude=round(rng.uniform(*LONGITUDE_RANGE), 6),
+                visitors_count=rng.randint(0, 50000),
+                status='active' if rng.random() < 0.9 else 'draft',
+                entrance_fee=f'{rng.randrange(0, 5000, 100)} KZT',
+                best_time=rng.choice(['Apr - Oct', 'May - Sep', 'All year', 'Jun - Aug']),
+            )
+            # bulk_create не вызывает save()
+            attraction.geohash = attraction.compute_geohash()
+            return attraction
+
+        self.create('Attractions', Attraction, attractions.count(), target, build)
+        self.attraction_ids = list(attractions.order_by('id').values_list('id', flat=True))
+
+    def seed_reviews(self, target):
+        if not (self.user_ids and self.attraction_ids):
+            return
+        existing = Review.objects.filter(author__in=self.seed_users_qs).count()
+
+        def build(index):
+            rng = self.rng('review', index)
+            return Review(
+                author_id=self.user_ids[index % len(self.user_ids)],
+                attraction_id=rng.choice(self.attraction_ids),
+                # Оценки смещены к 4-5, как в реальных отзывах
+                rating=rng.choices([1, 2, 3, 4, 5], weights=[5, 5, 15, 35, 40])[0],
+                text=self.text(rng, rng.randint(5, 40)),
+                status=rng.choices(['approved', 'pending', 'rejected'], weights=[85, 10, 5])[0],
+                created_at=self.past_datetime(rng),
+            )
+
+        with manual_timestamps(Review._meta.get_field('created_at')):
+            self.create('Reviews', Review, existing, target, build)
+
+    def seed_favorites(self, target):
+        if not (self.user_ids and self.attraction_ids):
+            return
+        through = Attraction.favorited_by.through
+        present = set(through.objects.filter(user__in=self.seed_users_qs).values_list('user_id', 'attraction_id'))
+        users, attractions = len(self.user_ids), len(self.attraction_ids)
+
+        def pairs():
+            # k-е избранное пользователя u — достопримечательность (u*31 + k) % N:
+            # перебор всех индексов дает каждую пару ровно один раз. Пары, которые уже есть
+            # (в том числе от запуска с другими объемами), пропускаем
+            for index in range(users * attractions):
+                user, k = index % users, index // users
+                pair = (self.user_ids[user], self.attraction_ids[(user * 31 + k) % attractions])
+                if pair not in present:
+                    yield pair
+
+        existing = len(present)
+        missing = list(islice(pairs(), max(0, target - existing)))
+
+        def build(index):
+            user_id, attraction_id = missing[index - existing]
+            return through(user_id=user_id, attraction_id=attraction_id)
+
+        # ignore_conflicts — на случай параллельного запуска
+        self.create('Favorites', through, existing, target, build, ignore_conflicts=True)
+
+    def seed_routes(self, target):
+        routes = self.seed_routes_qs = Route.objects.filter(title__endswith=f'({self.prefix})')
+
+        def build(index):
+            rng = self.rng('route', index)
+            days = rng.randint(1, 10)
+            return Route(
+                title=f'{rng.choice(REGIONS)} {rng.choice(THEMES)} {index} ({self.prefix})',
+                description=self.text(rng, rng.randint(20, 60)),
+                duration_days=days,
+                budget_range=f'${days * 80}-{days * 150}',
+                difficulty=rng.choice(DIFFICULTIES),
+                distance_km=rng.randint(20, 2000),
+            )
+
+        self.create('Routes', Route, routes.count(), target, build)
+        self.route_ids = list(routes.order_by('id').values_list('id', flat=True))
+
+    def seed_stops(self, per_route):
+        if not self.route_ids:
+            return
+        stops = RouteStop.objects.filter(route__in=self.seed_routes_qs)
+        present = set(stops.values_list('route_id', 'day_number'))
+        # Недостающие дни 1..per_route каждого маршрута
+        missing = [
+            (position, day)
+            for position, route_id in enumerate(self.route_ids)
+            for day in range(1, per_route + 1)
+            if (route_id, day) not in present
+        ]
+        existing = stops.count()
+
+        def build(index):
+            position, day = missing[index - existing]
+            rng = self.rng('stop', f'{position}:{day}')
+            return RouteStop(
+                route_id=self.route_ids[position],
+                day_number=day,
+                title=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                description=self.text(rng, rng.randint(10, 30)),
+                duration_label=rng.choice(['Full Day', 'Half Day', '2-3 hours']),
+                attraction_id=rng.choice(self.attraction_ids) if self.attraction_ids else None,
+            )
+
+        self.create('Route stops', RouteStop, existing, existing + len(missing), build)
+
+    def seed_bookings(self, target):
+        if not (self.user_ids and self.route_ids):
+            return
+        existing = Booking.objects.filter(user__in=self.seed_users_qs).count()
+
+        def build(index):
+            rng = self.rng('booking', index)
+            people = rng.randint(1, 6)
+            return Booking(
+                user_id=self.user_ids[index % len(self.user_ids)],
+                route_id=rng.choice(self.route_ids),
+                date=self.anchor_date + timedelta(days=rng.randint(-365, 365)),
+                people_count=people,
+                total_price=100 * people,
+                status=rng.choices(['paid', 'pending', 'cancelled'], weights=[60, 30, 10])[0],
+                created_at=self.past_datetime(rng, days=365),
+            )
+
+        with manual_timestamps(Booking._meta.get_field('created_at')):
+            self.create('Bookings', Booking, existing, target, build)
+
+    def refresh_denormalized(self):
+        # bulk_create не шлет сигналы: пересчитываем рейтинги, счетчики избранного,
+        # поисковые векторы и сбрасываем кэш каталога
+        started = time.perf_counter()
+        rebuild_ratings(batch_size=self.batch_size)
+        through = Attraction.favorited_by.through
+        favorites = (
+            through.objects.filter(attraction_id=OuterRef('pk'))
+            .order_by().values('attraction_id').annotate(total=Count('pk')).values('total')
+        )
+        self.seed_attractions_qs.update(favorites_count=Coalesce(Subquery(favorites), 0))
+        update_attraction_vectors(self.seed_attractions_qs)
+        update_route_vectors(self.seed_routes_qs)
+        bump_generation()
+        self.stdout.write(f'Aggregates refreshed in {time.perf_counter() - started:.1f}s')
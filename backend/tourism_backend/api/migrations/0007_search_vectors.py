@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:58
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# GIN индексы и заполнение tsvector нужны только на PostgreSQL,
+# на SQLite (локальные тесты) эти шаги пропускаются
+
+INDEXES_SQL = [
+    'CREATE INDEX IF NOT EXISTS api_attraction_search_gin ON api_attraction USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS api_route_search_gin ON api_route USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS api_attraction_name_trgm ON api_attraction USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS api_route_title_trgm ON api_route USING gin (title gin_trgm_ops)',
+]
+
+DROP_INDEXES_SQL = [
+    'DROP INDEX IF EXISTS api_attraction_search_gin',
+    'DROP INDEX IF EXISTS api_route_search_gin',
+    'DROP INDEX IF EXISTS api_attraction_name_trgm',
+    'DROP INDEX IF EXISTS api_route_title_trgm',
+]
+
+BACKFILL_SQL = [
+    """
+    UPDATE api_attraction a SET search_vector =
+        setweight(to_tsvector(%(config)s, coalesce(a.name, '')), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce(r.name, '') || ' ' || coalesce(c.name, '')), 'B')
+        || setweight(to_tsvector(%(config)s, coalesce(a.description, '')), 'C')
+    FROM api_region r, api_category c
+    WHERE r.id = a.region_id AND c.id = a.category_id
+    """,
+    """
+    UPDATE api_route rt SET search_vector =
+        setweight(to_tsvector(%(config)s, coalesce(rt.title, '')), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce(
+            (SELECT string_agg(s.title, ' ') FROM api_routestop s WHERE s.route_id = rt.id), ''
+        )), 'B')
+        || setweight(to_tsvector(%(config)s, coalesce(rt.description, '')), 'C')
+    """,
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    config = getattr(settings, 'SEARCH_CONFIG', 'simple')
+    for sql in INDEXES_SQL:
+        schema_editor.execute(sql)
+    for sql in BACKFILL_SQL:
+        schema_editor.execute(sql, {'config': config})
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in DROP_INDEXES_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_attraction_rating_aggregates'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='attraction',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_favorites_count(apps, schema_editor):
+    Attraction = apps.get_model('api', 'Attraction')
+    Favorite = Attraction._meta.get_field('favorited_by').remote_field.through
+    rows = Favorite.objects.values('attraction_id').annotate(total=Count('id'))
+    for row in rows:
+        Attraction.objects.filter(pk=row['attraction_id']).update(favorites_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_attraction_page_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attraction',
+            name='favorites_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_favorites_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+from api import geo
+
+
+def backfill_geohash(apps, schema_editor):
+    Attraction = apps.get_model('api', 'Attraction')
+    rows = Attraction.objects.filter(latitude__isnull=False, longitude__isnull=False).only('latitude', 'longitude')
+    batch = []
+    for attraction in rows.iterator(chunk_size=2000):
+        attraction.geohash = geo.encode(attraction.latitude, attraction.longitude)
+        batch.append(attraction)
+        if len(batch) == 2000:
+            Attraction.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Attraction.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_access_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attraction',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='attraction',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['geohash'], name='attraction_active_geohash_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_attraction_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routestop',
+            name='attraction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='route_stops', to='api.attraction'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='conversation',
+            name='context_keys',
+        ),
+        migrations.AddField(
+            model_name='conversationturn',
+            name='context',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
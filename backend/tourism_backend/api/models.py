@@ -1,9 +1,17 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+
+from . import geo
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    # Уменьшенные копии аватара (api/images.py)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(blank=True)
     country = models.CharField(max_length=100, blank=True)
 
@@ -34,26 +42,77 @@ class Attraction(models.Model):
     description = models.TextField()
     # Изменено на URLField для работы скрипта populate_db
     image = models.ImageField(upload_to='attractions/', null=True, blank=True)
+    # Уменьшенные копии фото: thumb/card/full в WebP и JPEG (api/images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    # Ячейка сетки для /attractions/nearby/ (api/geo.py), считается в save() из координат
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     visitors_count = models.IntegerField(default=0)
+    # Счетчики обновляются пачками из api/counters.py
+    page_views = models.IntegerField(default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     
     entrance_fee = models.CharField(max_length=100, blank=True)
     best_time = models.CharField(max_length=100, blank=True)
     
     favorited_by = models.ManyToManyField(User, related_name='favorites', blank=True)
+    # Денормализованное число добавлений в избранное (toggle_favorite + сигнал m2m_changed)
+    favorites_count = models.IntegerField(default=0)
+
+    # Денормализованные агрегаты по одобренным отзывам.
+    # Обновляются сигналами в api/signals.py, пересчитываются командой rebuild_ratings
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+
+    RATING_FIELDS = ('rating_sum', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+    # Взвешенный tsvector для полнотекстового поиска (api/search.py).
+    # GIN индексы создаются миграцией только на PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Публичный список: WHERE status='active' ORDER BY id DESC (курсорная пагинация)
+            models.Index(fields=['status', '-id'], name='attraction_status_id_idx'),
+            # Популярные места в статистике админки: ORDER BY visitors_count DESC LIMIT 5
+            models.Index(fields=['-visitors_count'], name='attraction_visitors_idx'),
+            # "Рядом со мной": WHERE status='active' AND geohash >= ... AND geohash < ...
+            # Частичный: с ведущей колонкой status планировщик брал бы его и для списка каталога
+            models.Index(fields=['geohash'], condition=models.Q(status='active'), name='attraction_active_geohash_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
+    def compute_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            return ''
+        return geo.encode(self.latitude, self.longitude)
+
     @property
     def average_rating(self):
-        reviews = self.reviews.filter(status='approved')
-        if not reviews.exists():
+        # Больше никаких запросов: считаем по сохраненным колонкам
+        if not self.rating_count:
             return 0
-        return round(sum(r.rating for r in reviews) / reviews.count(), 1)
+        return round(self.rating_sum / self.rating_count, 1)
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}') for star in range(1, 6)}
 
 class Review(models.Model):
     STATUS_CHOICES = (
@@ -71,6 +130,22 @@ class Review(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     rejection_reason = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Лента отзывов: ORDER BY created_at DESC, id DESC (курсорная пагинация)
+            models.Index(fields=['-created_at', '-id'], name='review_created_id_idx'),
+            # Отзывы места: WHERE attraction_id=... AND status='approved' ORDER BY created_at DESC, id DESC
+            models.Index(fields=['attraction', 'status', '-created_at', '-id'], name='review_attr_status_created_idx'),
+            # Лента для гостей — только одобренные (их большинство, но строки отклоненных
+            # и ожидающих не лежат в индексе)
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(status='approved'),
+                         name='review_approved_created_idx'),
+            # Отзывы автора (вторая ветка "одобренные ИЛИ мои")
+            models.Index(fields=['author', '-created_at', '-id'], name='review_author_created_idx'),
+            # Очередь модерации и счетчик pending_reviews: маленький частичный индекс
+            models.Index(fields=['created_at'], condition=models.Q(status='pending'), name='review_pending_idx'),
+        ]
+
     def __str__(self):
         return f"{self.author.username} - {self.attraction.name}"
 
@@ -85,6 +160,9 @@ class Route(models.Model):
     # Изменено на URLField
     image = models.URLField(max_length=500, blank=True)
 
+    # Взвешенный tsvector для полнотекстового поиска (api/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     def __str__(self):
         return self.title
 
@@ -96,17 +174,45 @@ class RouteStop(models.Model):
     # Изменено на URLField
     image = models.URLField(max_length=500, blank=True)
     duration_label = models.CharField(max_length=50, default="Full Day") 
+    # Место остановки: его координаты использует оптимизатор порядка (api/route_optimizer.py)
+    attraction = models.ForeignKey(Attraction, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='route_stops')
 
     class Meta:
         ordering = ['day_number']
 
 # ... в конце файла api/models.py
 
+class Departure(models.Model):
+    # Выезд маршрута в конкретную дату с ограниченным числом мест (api/inventory.py).
+    # Если для маршрута и даты выезда нет, места не ограничены
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='departures')
+    date = models.DateField()
+    capacity = models.PositiveIntegerField()
+    # Меняется только условным UPDATE в api/inventory.py
+    seats_available = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['route', 'date'], name='departure_route_date_uniq'),
+            # Последняя защита от перепродажи: БД не даст уйти в минус
+            models.CheckConstraint(condition=models.Q(seats_available__gte=0), name='departure_seats_non_negative'),
+        ]
+
+    def __str__(self):
+        return f"{self.route.title} {self.date} ({self.seats_available}/{self.capacity})"
+
+    def save(self, *args, **kwargs):
+        if self.seats_available is None:
+            self.seats_available = self.capacity
+        super().save(*args, **kwargs)
+
 class Booking(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending Payment'),
         ('paid', 'Paid'),
         ('cancelled', 'Cancelled'),
+        ('expired', 'Expired'),
     )
 
     # user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='booking', null=True, blank=True) 
@@ -120,6 +226,84 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Выезд, на котором бронь держит места (None — места не ограничены)
+    departure = models.ForeignKey(Departure, on_delete=models.SET_NULL, null=True, blank=True, related_name='bookings')
+    # До какого времени неоплаченная бронь держит места
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # "Мои брони": WHERE user_id=... ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='booking_user_created_idx'),
+            # Истечение броней: WHERE status='pending' AND expires_at < now
+            models.Index(fields=['expires_at'], condition=models.Q(status='pending'), name='booking_pending_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.route.title} ({self.status})"
+
+class IdempotencyKey(models.Model):
+    # Ответ на запрос с заголовком Idempotency-Key (api/idempotency.py): повтор запроса
+    # с тем же ключом получает сохраненный ответ и не выполняется снова
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # sha256 метода, пути и тела запроса: тот же ключ с другим запросом — ошибка клиента
+    fingerprint = models.CharField(max_length=64)
+    # Пусты только внутри транзакции, которая выполняет запрос
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            # Удаление старых ключей: WHERE created_at < ...
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.route.title} ({self.status})"
\ No newline at end of file
+        return f"{self.user_id}:{self.key}"
+
+class Conversation(models.Model):
+    # Диалог с ИИ-гидом (api/conversations.py). id — UUID: по нему гость продолжает
+    # диалог без логина, и чужой диалог не подобрать перебором
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ai_conversations', null=True, blank=True)
+    # Сжатый пересказ старых реплик, которые уже не помещаются в бюджет токенов
+    summary = models.TextField(blank=True)
+    # Расход токенов за весь диалог (включая пересказы)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    turns_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def __str__(self):
+        return str(self.id)
+
+
+class ConversationTurn(models.Model):
+    # Одна пара "вопрос — ответ"
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='turns')
+    question = models.TextField()
+    reply = models.TextField()
+    # Оценка размера пары в токенах: сколько она займет в истории
+    tokens = models.PositiveIntegerField(default=0)
+    # Данные из базы, впервые отправленные модели с этим вопросом: {'attraction:3': строка контекста}.
+    # Пока пара идет в историю, они повторяются в запросе вместе с ней; пересказанная пара их уносит
+    context = models.JSONField(default=dict, blank=True)
+    # Фактический расход запроса, в котором был получен ответ
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    # True — пара уже вошла в summary и в историю больше не отправляется
+    summarized = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
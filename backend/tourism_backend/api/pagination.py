@@ -0,0 +1,77 @@
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class StandardPagination(PageNumberPagination):
+    # Клиент может попросить размер страницы сам (?page_size=50), но не больше max_page_size
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPagination(CursorPagination):
+    # Пагинация по курсору: без COUNT(*) и OFFSET, время ответа не зависит от глубины.
+    # Порядок берется из view.cursor_ordering, он должен совпадать с индексом в models.py
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class CursorOrPageNumberPagination(BasePagination):
+    # По умолчанию — курсор (бесконечная лента). Постраничный режим с count остается
+    # для админки: он включается параметром ?page=. Поиск тоже идет постранично,
+    # потому что сортировка по релевантности не ложится на курсор
+    def __init__(self):
+        self.cursor_paginator = KeysetPagination()
+        self.page_paginator = StandardPagination()
+        self.paginator = self.cursor_paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if params.get(self.page_paginator.page_query_param) or params.get('search'):
+            self.paginator = self.page_paginator
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.cursor_paginator.get_schema_operation_parameters(view)
+            + self.page_paginator.get_schema_operation_parameters(view)
+        )
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+
+class SublistCursorPagination(KeysetPagination):
+    # Курсор для вложенного списка внутри одного ответа (например, /profiles/me/).
+    # У каждого списка свои параметры: ?<prefix>_cursor= и ?<prefix>_page_size=,
+    # поэтому списки листаются независимо друг от друга
+    max_page_size = 100
+
+    def __init__(self, prefix, ordering, page_size=10):
+        self.cursor_query_param = f'{prefix}_cursor'
+        self.page_size_query_param = f'{prefix}_page_size'
+        self.ordering = ordering
+        self.page_size = page_size
+
+    def paginate(self, queryset, request, serialize, count=None):
+        # serialize(page) -> список для поля results
+        page = self.paginate_queryset(queryset, request)
+        return {
+            'count': count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': serialize(page),
+        }
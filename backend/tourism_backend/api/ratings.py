@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Attraction, Review
+
+
+def apply_review(attraction_id, rating, sign):
+    # Инкрементально добавляем (sign=1) или убираем (sign=-1) один одобренный отзыв.
+    # Атомарный UPDATE через F(), без чтения строки в Python
+    Attraction.objects.filter(pk=attraction_id).update(**{
+        'rating_sum': F('rating_sum') + sign * rating,
+        'rating_count': F('rating_count') + sign,
+        f'rating_{rating}': F(f'rating_{rating}') + sign,
+    })
+
+
+def rebuild_ratings(batch_size=500):
+    # Полный пересчет агрегатов одним GROUP BY запросом по отзывам
+    stats = {
+        row['attraction_id']: row
+        for row in Review.objects.filter(status='approved')
+        .values('attraction_id')
+        .annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **{f'rating_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+        )
+    }
+
+    updated = []
+    for attraction in Attraction.objects.only('id', *Attraction.RATING_FIELDS).iterator(chunk_size=batch_size):
+        row = stats.get(attraction.id, {})
+        changed = False
+        for field in Attraction.RATING_FIELDS:
+            value = row.get(field) or 0
+            if getattr(attraction, field) != value:
+                setattr(attraction, field, value)
+                changed = True
+        if changed:
+            updated.append(attraction)
+
+    with transaction.atomic():
+        Attraction.objects.bulk_update(updated, Attraction.RATING_FIELDS, batch_size=batch_size)
+    return len(updated)
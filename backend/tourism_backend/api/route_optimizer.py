@@ -0,0 +1,80 @@
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM
+
+# Порядок остановок маршрута, при котором дорога короче: жадный "ближайший сосед",
+# затем 2-opt (разворот участков пути, пока это сокращает длину).
+# Путь открытый: первая остановка остается первой, вернуться в начало не нужно.
+# Выигрыш 2-opt для позиции i считается сразу для всех j одной операцией numpy,
+# поэтому 200-300 остановок укладываются в десятки миллисекунд
+
+# Улучшения короче этого (км) не считаем — защита от бесконечного цикла из-за округления
+MIN_GAIN_KM = 1e-6
+
+
+def distance_matrix(latitudes, longitudes):
+    # -> (n, n) расстояния по формуле гаверсинусов, км
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def path_length(dist, order):
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def nearest_neighbor(dist, start=0):
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[order[-1]])
+        following = int(np.argmin(row))
+        order.append(following)
+        visited[following] = True
+    return np.array(order)
+
+
+def two_opt(dist, order, max_passes=100):
+    # Проход: для каждой позиции i считаем выигрыш разворота order[i..j] сразу для всех j
+    # (ребра (a, b) и (c, e) меняются на (a, c) и (b, e)) и применяем лучший.
+    # Проходы повторяются, пока есть выигрыш. Фиктивная вершина с нулевыми расстояниями
+    # в конце пути делает концевой участок таким же случаем, как остальные
+    n = len(order)
+    if n < 4:
+        return np.array(order)
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = dist
+    path = np.append(order, n)
+    for _ in range(max_passes):
+        improved = False
+        # i >= 1 — первая остановка не двигается
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            c, e = path[i + 1:n], path[i + 2:n + 1]
+            delta = padded[a, c] + padded[b, e] - padded[a, b] - padded[c, e]
+            best = int(np.argmin(delta))
+            if delta[best] < -MIN_GAIN_KM:
+                j = i + 1 + best
+                path[i:j + 1] = path[i:j + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return path[:n]
+
+
+def optimize(latitudes, longitudes):
+    # -> (порядок индексов, новая длина, текущая длина в км). Точки даны в текущем
+    # порядке маршрута; если он уже короче найденного, он и остается
+    dist = distance_matrix(latitudes, longitudes)
+    current = np.arange(len(dist))
+    order = two_opt(dist, nearest_neighbor(dist, start=0))
+    current_km, optimized_km = path_length(dist, current), path_length(dist, order)
+    if current_km <= optimized_km:
+        return current, current_km, current_km
+    return order, optimized_km, current_km
@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, ExpressionWrapper, F, IntegerField, Q, Value, When
+from rest_framework import filters
+
+from .models import Attraction, Route, RouteStop
+
+# Конфигурация словаря Postgres. 'simple' не применяет стемминг, поэтому одинаково
+# работает для казахских, русских и английских названий
+SEARCH_CONFIG = getattr(settings, 'SEARCH_CONFIG', 'simple')
+
+
+def is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+# --- Обновление tsvector колонок ---
+
+def attraction_vector(region_name, category_name):
+    # Веса: название (A) > регион/категория (B) > описание (C)
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Value(region_name), Value(category_name), weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def route_vector(stop_titles):
+    # Веса: название маршрута (A) > названия остановок (B) > описание (C)
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Value(stop_titles), weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_attraction_vectors(queryset):
+    if not is_postgres():
+        return
+    # Один UPDATE на каждую пару регион/категория, а не на каждую строку
+    pairs = queryset.values_list('region_id', 'category_id', 'region__name', 'category__name').distinct()
+    for region_id, category_id, region_name, category_name in pairs:
+        Attraction.objects.filter(
+            pk__in=queryset.values('pk'), region_id=region_id, category_id=category_id
+        ).update(search_vector=attraction_vector(region_name, category_name))
+
+
+def update_route_vectors(queryset):
+    if not is_postgres():
+        return
+    for route in queryset.prefetch_related('stops').only('id'):
+        stop_titles = ' '.join(stop.title for stop in route.stops.all())
+        Route.objects.filter(pk=route.pk).update(search_vector=route_vector(stop_titles))
+
+
+# --- Поиск ---
+
+def _fallback_search(queryset, query, weighted_lookups):
+    # Запасной вариант для SQLite (локальные тесты): каждое слово должно встретиться
+    # хотя бы в одном поле, ранг — сумма весов полей, где слово нашлось
+    condition = Q()
+    rank = Value(0)
+    for term in query.split():
+        term_condition = Q()
+        for lookup, weight in weighted_lookups:
+            match = lookup(term)
+            term_condition |= match
+            rank = rank + Case(When(match, then=Value(weight)), default=Value(0))
+        condition &= term_condition
+    return queryset.filter(condition).annotate(
+        rank=ExpressionWrapper(rank, output_field=IntegerField())
+    ).order_by('-rank', '-id')
+
+
+def _contains(field):
+    return lambda term: Q(**{f'{field}__icontains': term})
+
+
+def _full_text_search(queryset, query, trigram_field):
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    ranked = queryset.filter(search_vector=search_query).annotate(
+        rank=SearchRank(F('search_vector'), search_query)
+    )
+    if ranked.exists():
+        return ranked.order_by('-rank', '-id')
+    # Ничего не нашли — скорее всего опечатка, пробуем триграммы по названию.
+    # Оператор % (trigram_similar) использует GIN gin_trgm_ops индекс, порог — pg_trgm.similarity_threshold
+    return queryset.filter(**{f'{trigram_field}__trigram_similar': query}).annotate(
+        rank=TrigramSimilarity(trigram_field, query)
+    ).order_by('-rank', '-id')
+
+
+def search_attractions(queryset, query):
+    query = query.strip()
+    if not query:
+        return queryset
+    if not is_postgres():
+        return _fallback_search(queryset, query, [
+            (_contains('name'), 4),
+            (_contains('region__name'), 2),
+            (_contains('category__name'), 2),
+            (_contains('description'), 1),
+        ])
+    return _full_text_search(queryset, query, 'name')
+
+
+def search_routes(queryset, query):
+    query = query.strip()
+    if not query:
+        return queryset
+    if not is_postgres():
+        return _fallback_search(queryset, query, [
+            (_contains('title'), 4),
+            # Подзапрос вместо JOIN, чтобы маршрут не дублировался по числу остановок
+            (lambda term: Q(pk__in=RouteStop.objects.filter(title__icontains=term).values('route_id')), 2),
+            (_contains('description'), 1),
+        ])
+    return _full_text_search(queryset, query, 'title')
+
+
+SEARCHERS = {
+    Attraction: search_attractions,
+    Route: search_routes,
+}
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    # Замена filters.SearchFilter: ?search= идет через полнотекстовый поиск с ранжированием
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        search = SEARCHERS.get(queryset.model)
+        if not query.strip() or search is None:
+            return queryset
+        return search(queryset, query)
@@ -1,21 +1,32 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
+from .cache import bump_generation
+from .search import update_route_vectors
+from .signals import route_stops_sync
+from .timing import TimedSerializerMixin
+from . import images, vectors
+from .vectors import vector_index
 from .models import Attraction, Region, Category, Review, Route, RouteStop, UserProfile
-from .models import Booking 
+from .models import Booking, Departure
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'is_staff']
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    avatar_images = serializers.SerializerMethodField()
     
     class Meta:
         model = UserProfile
-        fields = ['user', 'avatar', 'bio', 'country']
+        fields = ['user', 'avatar', 'avatar_images', 'bio', 'country']
 
-class ReviewSerializer(serializers.ModelSerializer):
+    def get_avatar_images(self, obj):
+        return images.srcset(obj.avatar, obj.avatar_variants, self.context.get('request'))
+
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author_name = serializers.ReadOnlyField(source='author.username')
     attraction_name = serializers.ReadOnlyField(source='attraction.name')
 
@@ -24,25 +35,67 @@ class ReviewSerializer(serializers.ModelSerializer):
         fields = ['id', 'author_name', 'attraction', 'attraction_name', 'rating', 'text', 'created_at', 'status', 'rejection_reason']
         read_only_fields = ['status', 'rejection_reason', 'author', 'created_at']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class RegionSerializer(serializers.ModelSerializer):
+class RegionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Region
         fields = '__all__'
 
-class AttractionSerializer(serializers.ModelSerializer):
+class AttractionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.ReadOnlyField(source='category.name')
     region_name = serializers.ReadOnlyField(source='region.name')
     rating = serializers.ReadOnlyField(source='average_rating')
-    reviews_count = serializers.IntegerField(source='reviews.count', read_only=True)
+    rating_histogram = serializers.ReadOnlyField()
+    reviews_count = serializers.SerializerMethodField()
+    # Копии фото по размерам и srcset; None, пока копии не готовы (тогда — image)
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Attraction
-        fields = '__all__'
+        # favorited_by не отдаем: это список всех пользователей, добавивших место в избранное.
+        # Вместо него — favorites_count и /attractions/favorite_status/ для текущего пользователя
+        exclude = ['search_vector', 'favorited_by', 'image_variants']
+        # Агрегаты рейтинга, избранного и счетчик просмотров считает сервер, клиент их не присылает
+        read_only_fields = Attraction.RATING_FIELDS + ('page_views', 'favorites_count')
+
+    def get_images(self, obj):
+        return images.srcset(obj.image, obj.image_variants, self.context.get('request'))
+
+    def get_reviews_count(self, obj):
+        # В списке значение приходит из annotate() в get_queryset, без запроса на каждую строку.
+        # Запасной вариант — для только что созданных/обновленных объектов
+        if hasattr(obj, 'reviews_count'):
+            return obj.reviews_count
+        return obj.reviews.count()
+
+class FavoriteCardSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Компактная карточка для списка избранного в профиле: только то, что рисует AttractionCard.
+    # region/category должны прийти через select_related
+    region_name = serializers.ReadOnlyField(source='region.name')
+    category_name = serializers.ReadOnlyField(source='category.name')
+    rating = serializers.ReadOnlyField(source='average_rating')
+    images = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attraction
+        fields = ['id', 'name', 'image', 'images', 'region_name', 'category_name', 'rating']
+
+    def get_images(self, obj):
+        return images.srcset(obj.image, obj.image_variants, self.context.get('request'))
+
+class NearbyAttractionSerializer(FavoriteCardSerializer):
+    # Карточка + координаты и расстояние (атрибут distance_km ставит /attractions/nearby/)
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta(FavoriteCardSerializer.Meta):
+        fields = FavoriteCardSerializer.Meta.fields + ['latitude', 'longitude', 'distance_km']
+
+    def get_distance_km(self, obj):
+        return round(obj.distance_km, 2)
 
 class RouteStopSerializer(serializers.ModelSerializer):
     # id нужен, чтобы при обновлении отличать новые остановки от старых (опционально)
@@ -50,39 +103,113 @@ class RouteStopSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RouteStop
-        fields = ['id', 'day_number', 'title', 'description', 'image', 'duration_label']
+        fields = ['id', 'day_number', 'title', 'description', 'image', 'duration_label', 'attraction']
 
-class RouteSerializer(serializers.ModelSerializer):
+class RouteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     stops = RouteStopSerializer(many=True)
 
     def create(self, validated_data):
         # Извлекаем данные остановок
         stops_data = validated_data.pop('stops')
-        # Создаем сам маршрут
-        route = Route.objects.create(**validated_data)
-        # Создаем остановки и привязываем к маршруту
-        for stop_data in stops_data:
-            RouteStop.objects.create(route=route, **stop_data)
+        with transaction.atomic():
+            # Создаем сам маршрут
+            route = Route.objects.create(**validated_data)
+            # Все остановки — одним INSERT
+            RouteStop.objects.bulk_create([
+                RouteStop(route=route, **self._stop_fields(stop_data)) for stop_data in stops_data
+            ])
+            self._stops_changed(route)
         return route
 
     def update(self, instance, validated_data):
         # Извлекаем данные остановок, если они есть
         stops_data = validated_data.pop('stops', None)
-        
-        # Обновляем поля самого маршрута
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
 
-        if stops_data is not None:
-            instance.stops.all().delete()
-            for stop_data in stops_data:
-                RouteStop.objects.create(route=instance, **stop_data)
+        with transaction.atomic():
+            # Обновляем поля самого маршрута
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+
+            if stops_data is not None:
+                self._sync_stops(instance, stops_data)
 
         return instance
+
+    def _sync_stops(self, route, stops_data):
+        # Вместо "удалить все и создать заново" считаем разницу:
+        # остановки с известным id обновляем (только если что-то поменялось),
+        # без id (или с чужим id) — создаем, отсутствующие в запросе — удаляем
+        existing = {stop.id: stop for stop in RouteStop.objects.filter(route=route)}
+        kept_ids = set()
+        to_create, to_update, changed_fields = [], [], set()
+
+        for stop_data in stops_data:
+            stop_id = stop_data.get('id')
+            fields = self._stop_fields(stop_data)
+            stop = existing.get(stop_id)
+            if stop is None or stop_id in kept_ids:
+                to_create.append(RouteStop(route=route, **fields))
+                continue
+            kept_ids.add(stop_id)
+            changed = {name for name, value in fields.items() if self._stop_value(stop, name) != self._field_value(name, value)}
+            if changed:
+                for name in changed:
+                    setattr(stop, name, fields[name])
+                to_update.append(stop)
+                changed_fields |= changed
+
+        removed_ids = set(existing) - kept_ids
+        if removed_ids:
+            # QuerySet.delete шлет post_delete на каждую остановку — пусть сигналы
+            # не дублируют единое обновление из _stops_changed
+            with route_stops_sync(route.pk):
+                RouteStop.objects.filter(pk__in=removed_ids).delete()
+        if to_update:
+            RouteStop.objects.bulk_update(to_update, sorted(changed_fields))
+        if to_create:
+            RouteStop.objects.bulk_create(to_create)
+        if removed_ids or to_update or to_create:
+            self._stops_changed(route)
+
+    @staticmethod
+    def _stop_fields(stop_data):
+        return {name: value for name, value in stop_data.items() if name != 'id'}
+
+    @staticmethod
+    def _stop_value(stop, name):
+        # Для внешних ключей сравниваем attraction_id, а не stop.attraction:
+        # иначе каждая остановка лениво догружает свою достопримечательность
+        return getattr(stop, RouteStop._meta.get_field(name).attname)
+
+    @staticmethod
+    def _field_value(name, value):
+        if RouteStop._meta.get_field(name).is_relation and value is not None:
+            return value.pk
+        return value
+
+    @staticmethod
+    def _stops_changed(route):
+        # bulk_create/bulk_update не шлют post_save, поэтому поисковый вектор,
+        # эмбеддинг маршрута и поколение кэша каталога обновляем сами
+        update_route_vectors(Route.objects.filter(pk=route.pk))
+        vectors.schedule(vector_index.refresh_routes, Route.objects.filter(pk=route.pk))
+        bump_generation()
+
     class Meta:
         model = Route
-        fields = '__all__'
+        exclude = ['search_vector']
+
+class RouteListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Облегченный вариант для каталога маршрутов: без вложенных остановок с описаниями.
+    # stops_count, days и first_image считаются одним агрегирующим запросом (annotate_route_list)
+    stops_count = serializers.IntegerField(read_only=True)
+    days = serializers.IntegerField(read_only=True)
+    first_image = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Route
+        exclude = ['search_vector']
 
 # ... (предыдущие импорты)
 
@@ -107,7 +234,7 @@ class RegisterSerializer(serializers.ModelSerializer):
 
 
 # Пример на бэкенде (Python/Django)
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Берем название маршрута через связь route
     route_title = serializers.CharField(source='route.title', read_only=True)
     # Если нужно изображение, можно добавить так:
@@ -124,6 +251,15 @@ class BookingSerializer(serializers.ModelSerializer):
             'people_count', 
             'total_price', 
             'status', 
-            'created_at'
+            'created_at',
+            'expires_at',
         ]
-        read_only_fields = ['user', 'status', 'total_price', 'created_at', 'route_title']
\ No newline at end of file
+        read_only_fields = ['user', 'status', 'total_price', 'created_at', 'route_title', 'expires_at']
+        # Отрицательное число людей вернуло бы места выезду
+        extra_kwargs = {'people_count': {'min_value': 1}}
+
+
+class DepartureSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Departure
+        fields = ['id', 'date', 'capacity', 'seats_available']
@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_generation
+from . import images, vectors
+from .models import Attraction, Category, Region, Review, Route, RouteStop, UserProfile
+from .ratings import apply_review
+from .search import update_attraction_vectors, update_route_vectors
+from .vectors import vector_index
+
+# Маршруты, остановки которых сейчас синхронизирует RouteSerializer: он сам один раз
+# обновит поисковый вектор, эмбеддинг и поколение кэша, поэтому построчные сигналы
+# остановок этих маршрутов пропускаем
+_syncing_routes = ContextVar('syncing_routes', default=frozenset())
+
+
+@contextmanager
+def route_stops_sync(route_id):
+    token = _syncing_routes.set(_syncing_routes.get() | {route_id})
+    try:
+        yield
+    finally:
+        _syncing_routes.reset(token)
+
+
+def _stop_synced(instance):
+    return instance.route_id in _syncing_routes.get()
+
+
+def _rating_state(review):
+    # Вклад отзыва в агрегаты: только одобренные отзывы влияют на рейтинг
+    if review.status != 'approved':
+        return None
+    return (review.attraction_id, review.rating)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_state(sender, instance, **kwargs):
+    # Запоминаем, каким отзыв был до сохранения (модерация, правка в админке)
+    instance._previous_rating_state = None
+    if instance.pk:
+        old = Review.objects.filter(pk=instance.pk).values('attraction_id', 'rating', 'status').first()
+        if old and old['status'] == 'approved':
+            instance._previous_rating_state = (old['attraction_id'], old['rating'])
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_rating_state', None)
+    current = _rating_state(instance)
+    if previous == current:
+        return
+    if previous:
+        apply_review(*previous, sign=-1)
+    if current:
+        apply_review(*current, sign=1)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    current = _rating_state(instance)
+    if current:
+        apply_review(*current, sign=-1)
+
+
+# --- Полнотекстовый поиск: держим tsvector колонки актуальными ---
+
+@receiver(post_save, sender=Attraction)
+def update_attraction_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_attraction_vectors(Attraction.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_save, sender=Category)
+def update_search_vectors_on_rename(sender, instance, created, raw=False, **kwargs):
+    # Название региона/категории входит в вектор всех связанных достопримечательностей
+    if not created and not raw:
+        update_attraction_vectors(instance.attractions.all())
+
+
+@receiver(post_save, sender=Route)
+def update_route_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_route_vectors(Route.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=RouteStop)
+def update_route_search_vector_on_stop_change(sender, instance, raw=False, **kwargs):
+    if not raw and not _stop_synced(instance):
+        update_route_vectors(Route.objects.filter(pk=instance.route_id))
+
+
+# --- Векторный индекс ИИ-гида (api/vectors.py) ---
+
+@receiver(post_save, sender=Attraction)
+def update_attraction_embedding(sender, instance, raw=False, **kwargs):
+    if not raw:
+        vectors.schedule(vector_index.refresh_attractions, Attraction.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_save, sender=Category)
+def update_embeddings_on_rename(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        vectors.schedule(vector_index.refresh_attractions, instance.attractions.all())
+
+
+@receiver(post_save, sender=Route)
+def update_route_embedding(sender, instance, raw=False, **kwargs):
+    if not raw:
+        vectors.schedule(vector_index.refresh_routes, Route.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=RouteStop)
+def update_route_embedding_on_stop_change(sender, instance, raw=False, **kwargs):
+    if not raw and not _stop_synced(instance):
+        vectors.schedule(vector_index.refresh_routes, Route.objects.filter(pk=instance.route_id))
+
+
+@receiver(post_delete, sender=Attraction)
+def remove_attraction_embedding(sender, instance, **kwargs):
+    vectors.schedule(vector_index.remove, [('attraction', instance.pk)])
+
+
+@receiver(post_delete, sender=Route)
+def remove_route_embedding(sender, instance, **kwargs):
+    vectors.schedule(vector_index.remove, [('route', instance.pk)])
+
+
+# --- Уменьшенные копии фото (api/images.py): строятся после коммита в фоне ---
+
+@receiver(post_save, sender=Attraction)
+def build_attraction_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance, 'image', 'image_variants')
+
+
+@receiver(post_save, sender=UserProfile)
+def build_avatar_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance, 'avatar', 'avatar_variants')
+
+
+# --- Кэш каталога: любое изменение увеличивает поколение (api/cache.py) ---
+
+@receiver(post_save, sender=Attraction)
+@receiver(post_delete, sender=Attraction)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=RouteStop)
+@receiver(post_delete, sender=RouteStop)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    if sender is RouteStop and _stop_synced(instance):
+        return
+    bump_generation()
+
+
+@receiver(m2m_changed, sender=Attraction.favorited_by.through)
+def update_favorites_count(sender, instance, action, reverse, pk_set, **kwargs):
+    # toggle_favorite обновляет favorites_count сам. Здесь — остальные пути
+    # (админка, attraction.favorited_by.add(), user.favorites.clear() ...)
+    if action == 'pre_clear':
+        # После очистки уже не узнать, какие места затронуты — запоминаем заранее
+        if reverse:
+            instance._cleared_attraction_ids = list(instance.favorites.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        attraction_ids = [instance.pk]
+    elif action == 'post_clear':
+        attraction_ids = getattr(instance, '_cleared_attraction_ids', [])
+    else:
+        attraction_ids = list(pk_set or [])
+    if not attraction_ids:
+        return
+
+    favorites = (
+        sender.objects.filter(attraction_id=OuterRef('pk'))
+        .order_by().values('attraction_id').annotate(total=Count('pk')).values('total')
+    )
+    Attraction.objects.filter(pk__in=attraction_ids).update(
+        favorites_count=Coalesce(Subquery(favorites), 0)
+    )
+    bump_generation()
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_catalog_cache_on_review(sender, instance, **kwargs):
+    # Рейтинг в каталоге зависит только от одобренных отзывов
+    if instance.status == 'approved' or getattr(instance, '_previous_rating_state', None):
+        bump_generation()
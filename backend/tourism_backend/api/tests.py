@@ -1,3 +1,2069 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from tourism_backend.urls import serve_immutable
+
+from . import (
+    ai, benchmarks, catalog_io, conversations, counters, geo, idempotency, images, inventory, route_optimizer, timing,
+    vectors,
+)
+from .ai_cache import ReplyCache, cache_key, normalize_query, reply_cache
+from .ai_upstream import UpstreamBusy, UpstreamGate
+from .models import (
+    Attraction, Booking, Category, Conversation, Departure, IdempotencyKey, Region, Review, Route, RouteStop,
+    UserProfile,
+)
+from .vectors import vector_index
+
+# Фоновый сброс счетчиков просмотров писал бы в БД тестов из другого потока посреди
+# чужих транзакций. Сам поток проверяет ViewCounterFlushThreadTests
+counters.FLUSH_IN_BACKGROUND = False
+# Индекс ИИ-гида обновляем сразу в сигнале: в TestCase транзакция не фиксируется
+# и on_commit не сработал бы. Отложенное обновление проверяет VectorIndexTests
+vectors.INDEX_ASYNC = False
+
+
+class AttractionListQueryCountTests(TestCase):
+    # Число SQL-запросов списка не должно расти вместе с размером страницы
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        author = User.objects.create_user(username='reviewer', password='pass12345')
+        attractions = Attraction.objects.bulk_create([
+            Attraction(name=f'Attraction {i}', region=region, category=category,
+                       description='Description', status='active')
+            for i in range(1000)
+        ])
+        Review.objects.bulk_create([
+            Review(author=author, attraction=attraction, rating=5, text='Great', status='approved')
+            for attraction in attractions[:50]
+        ])
+        cls.author = author
+        cls.attraction = attractions[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_list_query_count_is_constant(self):
+        for page_size in (10, 100, 1000):
+            with self.subTest(page_size=page_size):
+                # Курсорная пагинация: один запрос за страницей, без COUNT(*)
+                with self.assertNumQueries(1):
+                    response = self.client.get('/api/attractions/', {'page_size': page_size})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_page_number_query_count_is_constant(self):
+        for page_size in (10, 100, 1000):
+            with self.subTest(page_size=page_size):
+                # Постраничный режим (админка): COUNT(*) + запрос за страницей
+                with self.assertNumQueries(2):
+                    response = self.client.get('/api/attractions/', {'page': 1, 'page_size': page_size})
+                self.assertEqual(response.json()['count'], 1000)
+                self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_cursor_walks_whole_catalog(self):
+        seen = []
+        url, params = '/api/attractions/', {'page_size': 300}
+        while url:
+            page = self.client.get(url, params).json()
+            self.assertNotIn('count', page)
+            seen.extend(row['id'] for row in page['results'])
+            url, params = page['next'], None
+        self.assertEqual(len(seen), 1000)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_list_uses_annotated_values(self):
+        response = self.client.get('/api/attractions/', {'page_size': 1000})
+        rows = {row['id']: row for row in response.json()['results']}
+        row = rows[self.attraction.id]
+        self.assertEqual(row['reviews_count'], 1)
+        self.assertEqual(row['region_name'], 'Almaty Region')
+        self.assertEqual(row['category_name'], 'Lake')
+        self.assertNotIn('favorited_by', row)
+
+    def test_list_counts_reviews_without_group_by(self):
+        # Подзапрос считает отзывы только для строк страницы, а не GROUP BY по всему каталогу
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get('/api/attractions/', {'page_size': 10})
+        sql = captured[0]['sql']
+        self.assertNotIn('GROUP BY "api_attraction"', sql)
+        self.assertNotIn('search_vector', sql.split(' FROM ')[0])
+
+    def test_detail_uses_annotated_values(self):
+        response = self.client.get(f'/api/attractions/{self.attraction.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['reviews_count'], 1)
+
+
+class RatingAggregateTests(TestCase):
+    # Денормализованные агрегаты рейтинга (api/ratings.py, сигналы в api/signals.py)
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.kolsai = Attraction.objects.create(name='Kolsai Lakes', region=region, category=category,
+                                               description='Lakes', status='active')
+        cls.charyn = Attraction.objects.create(name='Charyn Canyon', region=region, category=category,
+                                               description='Canyon', status='active')
+        cls.author = User.objects.create_user(username='author', password='pass12345')
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def aggregates(self, attraction):
+        attraction.refresh_from_db()
+        return {field: getattr(attraction, field) for field in Attraction.RATING_FIELDS}
+
+    def expected(self, *ratings):
+        counts = Counter(ratings)
+        return {'rating_sum': sum(ratings), 'rating_count': len(ratings),
+                **{f'rating_{star}': counts[star] for star in range(1, 6)}}
+
+    def create_review(self, rating, attraction=None):
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/reviews/', {
+            'attraction': (attraction or self.kolsai).pk, 'rating': rating, 'text': 'Nice',
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def moderate(self, review_id, status):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(f'/api/reviews/{review_id}/moderate/', {'status': status})
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_review_counts_only_after_approval(self):
+        review_id = self.create_review(4)
+        self.assertEqual(self.aggregates(self.kolsai), self.expected())
+        self.moderate(review_id, 'approved')
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(4))
+
+    def test_approve_reject_reapprove(self):
+        first, second = self.create_review(5), self.create_review(2)
+        self.moderate(first, 'approved')
+        self.moderate(second, 'approved')
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(5, 2))
+        self.moderate(first, 'rejected')
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(2))
+        # Повторное отклонение ничего не вычитает второй раз
+        self.moderate(first, 'rejected')
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(2))
+        self.moderate(first, 'approved')
+        self.moderate(first, 'approved')
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(5, 2))
+
+    def test_edit_moves_rating_between_stars_and_attractions(self):
+        review_id = self.create_review(3)
+        self.moderate(review_id, 'approved')
+        self.client.force_authenticate(self.admin)
+        self.client.patch(f'/api/reviews/{review_id}/', {'rating': 1})
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(1))
+        self.client.patch(f'/api/reviews/{review_id}/', {'attraction': self.charyn.pk})
+        self.assertEqual(self.aggregates(self.kolsai), self.expected())
+        self.assertEqual(self.aggregates(self.charyn), self.expected(1))
+
+    def test_delete_removes_only_approved_reviews(self):
+        approved, pending = self.create_review(5), self.create_review(1)
+        self.moderate(approved, 'approved')
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.delete(f'/api/reviews/{pending}/').status_code, 204)
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(5))
+        self.assertEqual(self.client.delete(f'/api/reviews/{approved}/').status_code, 204)
+        self.assertEqual(self.aggregates(self.kolsai), self.expected())
+
+    def test_histogram_and_average_in_api(self):
+        for rating in (5, 5, 4, 1):
+            self.moderate(self.create_review(rating), 'approved')
+        data = self.client.get(f'/api/attractions/{self.kolsai.pk}/').json()
+        self.assertEqual(data['rating'], 3.8)
+        self.assertEqual(data['rating_histogram'], {'1': 1, '2': 0, '3': 0, '4': 1, '5': 2})
+        self.assertEqual(data['rating_count'], 4)
+
+    def test_rebuild_ratings_command(self):
+        Review.objects.bulk_create([
+            Review(author=self.author, attraction=self.kolsai, rating=rating, text='x', status=status)
+            for rating, status in ((5, 'approved'), (3, 'approved'), (1, 'rejected'), (2, 'pending'))
+        ])
+        # bulk_create не шлет сигналы; вдобавок портим агрегаты второго места
+        Attraction.objects.filter(pk=self.charyn.pk).update(rating_sum=40, rating_count=9, rating_5=9)
+        out = StringIO()
+        call_command('rebuild_ratings', stdout=out)
+        self.assertIn('Updated 2 attractions', out.getvalue())
+        self.assertEqual(self.aggregates(self.kolsai), self.expected(5, 3))
+        self.assertEqual(self.aggregates(self.charyn), self.expected())
+        out = StringIO()
+        call_command('rebuild_ratings', stdout=out)
+        self.assertIn('Updated 0 attractions', out.getvalue())
+
+
+class SearchTests(TestCase):
+    # На SQLite работает запасной вариант поиска, но ранжирование должно сохраняться
+
+    @classmethod
+    def setUpTestData(cls):
+        almaty = Region.objects.create(name='Almaty Region')
+        mangystau = Region.objects.create(name='Mangystau')
+        lake = Category.objects.create(name='Lake')
+        canyon = Category.objects.create(name='Canyon')
+        cls.kolsai = Attraction.objects.create(
+            name='Kolsai Lakes', region=almaty, category=lake,
+            description='Three mountain lakes', status='active')
+        cls.charyn = Attraction.objects.create(
+            name='Charyn Canyon', region=almaty, category=canyon,
+            description='Red rocks, drive past Kolsai on the way', status='active')
+        Attraction.objects.create(
+            name='Bozzhira', region=mangystau, category=canyon,
+            description='White chalk mountains', status='draft')
+        route = Route.objects.create(
+            title='Almaty to Kolsai', description='Lakes tour', duration_days=3,
+            budget_range='$200', difficulty='Moderate')
+        RouteStop.objects.create(route=route, day_number=1, title='Charyn Canyon', description='Day one')
+        cls.route = route
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_name_match_ranks_above_description_match(self):
+        response = self.client.get('/api/attractions/', {'search': 'kolsai'})
+        ids = [row['id'] for row in response.json()['results']]
+        self.assertEqual(ids, [self.kolsai.id, self.charyn.id])
+
+    def test_search_all_words(self):
+        response = self.client.get('/api/attractions/', {'search': 'almaty canyon'})
+        ids = [row['id'] for row in response.json()['results']]
+        self.assertEqual(ids, [self.charyn.id])
+
+    def test_search_endpoint_covers_routes(self):
+        response = self.client.get('/api/search/', {'q': 'charyn'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['attractions']], [self.charyn.id])
+        self.assertEqual([row['id'] for row in response.json()['routes']], [self.route.id])
+
+    def test_search_endpoint_hides_drafts(self):
+        response = self.client.get('/api/search/', {'q': 'bozzhira'})
+        self.assertEqual(response.json()['attractions'], [])
+
+
+class CatalogCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(name='Almaty Region')
+        cls.category = Category.objects.create(name='Lake')
+        cls.attraction = Attraction.objects.create(
+            name='Kolsai Lakes', region=cls.region, category=cls.category,
+            description='Three lakes', status='active')
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        cls.author = User.objects.create_user(username='author', password='pass12345')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_repeated_read_is_served_from_cache(self):
+        first = self.client.get('/api/attractions/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/attractions/')
+        self.assertEqual(first.content, second.content)
+
+    def test_conditional_get_returns_not_modified(self):
+        first = self.client.get('/api/regions/')
+        response = self.client.get('/api/regions/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/regions/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_save_invalidates_cached_response(self):
+        self.client.get(f'/api/attractions/{self.attraction.id}/')
+        self.attraction.name = 'Kolsai'
+        self.attraction.save()
+        response = self.client.get(f'/api/attractions/{self.attraction.id}/')
+        self.assertEqual(response.json()['name'], 'Kolsai')
+
+    def test_approved_review_invalidates_rating(self):
+        review = Review.objects.create(author=self.author, attraction=self.attraction, rating=4, text='Nice')
+        self.assertEqual(self.client.get(f'/api/attractions/{self.attraction.id}/').json()['rating'], 0)
+        review.status = 'approved'
+        review.save()
+        self.assertEqual(self.client.get(f'/api/attractions/{self.attraction.id}/').json()['rating'], 4.0)
+
+    def test_staff_and_public_are_cached_separately(self):
+        Attraction.objects.create(name='Draft', region=self.region, category=self.category,
+                                  description='Hidden', status='draft')
+        public = self.client.get('/api/attractions/').json()['results']
+        self.client.force_authenticate(self.admin)
+        staff = self.client.get('/api/attractions/').json()['results']
+        self.assertEqual(len(public), 1)
+        self.assertEqual(len(staff), 2)
+
+
+class ViewCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.attraction = Attraction.objects.create(
+            name='Kolsai Lakes', region=region, category=category,
+            description='Three lakes', status='active')
+
+    def setUp(self):
+        cache.clear()
+        counters.flush()
+        self.client = APIClient()
+
+    def test_views_are_buffered_and_flushed_in_batch(self):
+        for _ in range(5):
+            self.client.get(f'/api/attractions/{self.attraction.id}/')
+        self.client.get(f'/api/attractions/{self.attraction.id}/', REMOTE_ADDR='10.0.0.2')
+
+        self.attraction.refresh_from_db()
+        self.assertEqual(self.attraction.page_views, 0)
+        self.assertEqual(counters.pending_views(), 6)
+
+        with self.assertNumQueries(2):
+            # Одна группа "6 просмотров / 2 посетителя" — один UPDATE
+            counters.flush()
+            self.attraction.refresh_from_db()
+        self.assertEqual(self.attraction.page_views, 6)
+        self.assertEqual(self.attraction.visitors_count, 2)
+
+    def test_failed_flush_does_not_break_the_view(self):
+        self.attraction.refresh_from_db()
+        before = self.attraction.page_views
+        with mock.patch.object(counters, 'MAX_PENDING', 1), \
+                mock.patch.object(Attraction.objects, 'filter', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('api.counters', 'ERROR'):
+            counters.record_view(self.attraction.id, 'user:1')
+        # Просмотр не потерян — уйдет со следующим сбросом
+        self.assertEqual(counters.pending_views(), 1)
+        counters.flush()
+        self.attraction.refresh_from_db()
+        self.assertEqual(self.attraction.page_views, before + 1)
+
+    def test_missing_attraction_is_not_counted(self):
+        self.client.get('/api/attractions/999999/')
+        self.assertEqual(counters.pending_views(), 0)
+
+
+class ViewCounterFlushThreadTests(TransactionTestCase):
+    # Поток пишет в БД своим соединением — нужна настоящая фиксация, а не транзакция теста
+
+    def test_idle_process_flushes_on_timer(self):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        attraction = Attraction.objects.create(name='Kolsai Lakes', region=region, category=category,
+                                               description='Three lakes', status='active')
+        counters.flush()
+        with mock.patch.multiple(counters, FLUSH_IN_BACKGROUND=True, FLUSH_INTERVAL=0.2, FLUSH_TICK=0.05):
+            # Сам просмотр буфер не сбрасывает: интервал с прошлого сброса еще не прошел
+            counters.record_view(attraction.id, 'user:1')
+            self.assertEqual(counters.pending_views(), 1)
+            # Новых просмотров нет, но буфер все равно уходит в БД
+            # Ждем саму запись в БД: буфер пустеет раньше, чем UPDATE фиксируется
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                attraction.refresh_from_db()
+                if attraction.page_views:
+                    break
+                time.sleep(0.05)
+        self.assertEqual(counters.pending_views(), 0)
+        self.assertEqual(attraction.page_views, 1)
+
+
+class FavoriteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.attractions = [
+            Attraction.objects.create(name=f'Place {i}', region=region, category=category,
+                                      description='Description', status='active')
+            for i in range(3)
+        ]
+        cls.user = User.objects.create_user(username='traveler', password='pass12345')
+        cls.other = User.objects.create_user(username='other', password='pass12345')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_toggle_updates_favorites_count(self):
+        attraction = self.attractions[0]
+        attraction.favorited_by.add(self.other)
+        url = f'/api/attractions/{attraction.id}/toggle_favorite/'
+
+        self.assertEqual(self.client.post(url).json(), {'status': 'added'})
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.favorites_count, 2)
+
+        self.assertEqual(self.client.post(url).json(), {'status': 'removed'})
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.favorites_count, 1)
+        self.assertFalse(attraction.favorited_by.filter(pk=self.user.pk).exists())
+
+    def test_toggle_invalidates_cached_catalog(self):
+        attraction = self.attractions[0]
+        detail = f'/api/attractions/{attraction.id}/'
+        self.assertEqual(self.client.get(detail).json()['favorites_count'], 0)
+
+        self.client.post(f'/api/attractions/{attraction.id}/toggle_favorite/')
+        self.assertEqual(self.client.get(detail).json()['favorites_count'], 1)
+
+        self.client.post(f'/api/attractions/{attraction.id}/toggle_favorite/')
+        self.assertEqual(self.client.get(detail).json()['favorites_count'], 0)
+
+    def test_favorite_status_in_one_query(self):
+        self.user.favorites.add(self.attractions[0], self.attractions[2])
+        ids = ','.join(str(a.id) for a in self.attractions)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/attractions/favorite_status/', {'ids': ids})
+        self.assertEqual(response.json(), {'favorited': [self.attractions[0].id, self.attractions[2].id]})
+
+    def test_clear_recounts_favorites(self):
+        self.user.favorites.add(*self.attractions)
+        self.user.favorites.clear()
+        self.assertEqual(
+            list(Attraction.objects.values_list('favorites_count', flat=True)), [0, 0, 0]
+        )
+
+
+class ProfileMeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.user = User.objects.create_user(username='traveler', password='pass12345')
+        UserProfile.objects.create(user=cls.user)
+        route = Route.objects.create(title='Tour', description='Tour', duration_days=3,
+                                     budget_range='$200', difficulty='Easy')
+        cls.attractions = Attraction.objects.bulk_create([
+            Attraction(name=f'Place {i}', region=region, category=category,
+                       description='Description', status='active')
+            for i in range(30)
+        ])
+        cls.user.favorites.add(*cls.attractions)
+        Booking.objects.bulk_create([
+            Booking(user=cls.user, route=route, date='2026-06-01', total_price=100)
+            for _ in range(30)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_is_fixed(self):
+        for page_size in (5, 30):
+            with self.subTest(page_size=page_size):
+                # профиль + COUNT и страница избранного + COUNT и страница бронирований
+                with self.assertNumQueries(5):
+                    response = self.client.get('/api/profiles/me/', {
+                        'favorites_page_size': page_size, 'bookings_page_size': page_size,
+                    })
+                data = response.json()
+                self.assertEqual(len(data['favorites']['results']), page_size)
+                self.assertEqual(len(data['bookings']['results']), page_size)
+
+    def test_sublists_page_independently(self):
+        data = self.client.get('/api/profiles/me/').json()
+        self.assertEqual(data['favorites']['count'], 30)
+        self.assertEqual(set(data['favorites']['results'][0]),
+                         {'id', 'name', 'image', 'images', 'region_name', 'category_name', 'rating'})
+
+        next_page = self.client.get(data['favorites']['next']).json()
+        first_ids = {item['id'] for item in data['favorites']['results']}
+        next_ids = {item['id'] for item in next_page['favorites']['results']}
+        self.assertFalse(first_ids & next_ids)
+        # Курсор избранного не сдвигает бронирования
+        self.assertEqual(next_page['bookings']['results'], data['bookings']['results'])
+
+
+class RouteStopSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _stop(self, day, title, **extra):
+        return {'day_number': day, 'title': title, 'description': f'{title} description', **extra}
+
+    def test_create_inserts_stops_in_bulk(self):
+        payload = {
+            'title': 'Two weeks', 'description': 'Long tour', 'duration_days': 14,
+            'budget_range': '$1000', 'difficulty': 'Hard',
+            'stops': [self._stop(day, f'Day {day}') for day in range(1, 15)],
+        }
+        response = self.client.post('/api/routes/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RouteStop.objects.filter(route_id=response.json()['id']).count(), 14)
+
+    def test_update_touches_only_changed_stops(self):
+        route = Route.objects.create(title='Tour', description='Tour', duration_days=3,
+                                     budget_range='$200', difficulty='Easy')
+        first, second, third = RouteStop.objects.bulk_create([
+            RouteStop(route=route, day_number=day, title=f'Day {day}', description='Text')
+            for day in (1, 2, 3)
+        ])
+        stops = [
+            {'id': first.id, 'day_number': 1, 'title': 'Day 1', 'description': 'Text'},
+            {'id': second.id, 'day_number': 2, 'title': 'Day 2 (edited)', 'description': 'Text'},
+            self._stop(4, 'Day 4'),
+        ]
+        response = self.client.patch(f'/api/routes/{route.id}/', {'stops': stops}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        current = {stop.id: stop.title for stop in RouteStop.objects.filter(route=route)}
+        # Неизмененная и отредактированная остановки сохранили id, третья удалена, четвертая создана
+        self.assertEqual(current[first.id], 'Day 1')
+        self.assertEqual(current[second.id], 'Day 2 (edited)')
+        self.assertNotIn(third.id, current)
+        self.assertEqual(sorted(current.values()), ['Day 1', 'Day 2 (edited)', 'Day 4'])
+
+    def _route_with_stops(self, count):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        route = Route.objects.create(title='Tour', description='Tour', duration_days=count,
+                                     budget_range='$200', difficulty='Easy')
+        stops = RouteStop.objects.bulk_create([
+            RouteStop(route=route, day_number=day, title=f'Day {day}', description='Text',
+                      attraction=Attraction.objects.create(name=f'Place {day}', region=region,
+                                                           category=category, description='Place'))
+            for day in range(1, count + 1)
+        ])
+        return route, stops
+
+    def _payload(self, stops):
+        return [{'id': stop.id, 'day_number': stop.day_number, 'title': stop.title,
+                 'description': stop.description, 'attraction': stop.attraction_id} for stop in stops]
+
+    def test_update_compares_attraction_ids_without_loading_them(self):
+        route, stops = self._route_with_stops(5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/routes/{route.id}/', {'stops': self._payload(stops)},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        # Достопримечательности читает только валидация входных id (по одной на остановку) —
+        # сравнение с существующими остановками обходится attraction_id
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('UPDATE "api_routestop"', 'INSERT'))]
+        self.assertEqual(writes, [])
+        attraction_reads = [q for q in queries.captured_queries
+                            if q['sql'].startswith('SELECT') and 'FROM "api_attraction"' in q['sql']
+                            and '"api_attraction"."id" =' in q['sql']]
+        self.assertLessEqual(len(attraction_reads), len(stops) + 1)
+
+    def test_removed_stops_refresh_route_once(self):
+        route, stops = self._route_with_stops(4)
+        with mock.patch('api.signals.update_route_vectors') as signal_vectors, \
+                mock.patch('api.signals.vector_index') as signal_index, \
+                mock.patch('api.serializers.update_route_vectors') as vectors_refresh, \
+                mock.patch.object(vector_index, 'refresh_routes') as index_refresh:
+            response = self.client.patch(f'/api/routes/{route.id}/', {'stops': self._payload(stops[:1])},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RouteStop.objects.filter(route=route).count(), 1)
+        # Сигналы срабатывают только на сохранение самого маршрута, не на каждую удаленную остановку
+        self.assertEqual(signal_vectors.call_count, 1)
+        self.assertEqual(signal_index.refresh_routes.call_count, 1)
+        vectors_refresh.assert_called_once()
+        index_refresh.assert_called_once()
+
+
+class RouteListBenchmarkTests(TestCase):
+    # Размер ответа и число запросов списка маршрутов не должны зависеть от числа остановок
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def _seed(self, stops_per_route):
+        Route.objects.all().delete()
+        routes = Route.objects.bulk_create([
+            Route(title=f'Route {i}', description='Tour', duration_days=stops_per_route,
+                  budget_range='$500', difficulty='Moderate')
+            for i in range(10)
+        ])
+        RouteStop.objects.bulk_create([
+            RouteStop(route=route, day_number=day, title=f'Day {day}',
+                      description='Long stop description. ' * 50,
+                      image=f'https://example.com/{route.id}/{day}.jpg')
+            for route in routes for day in range(1, stops_per_route + 1)
+        ])
+        cache.clear()
+
+    def _measure(self, stops_per_route):
+        self._seed(stops_per_route)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/routes/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), len(response.content), response.json()['results']
+
+    def test_list_does_not_scale_with_stops(self):
+        few_queries, few_bytes, _ = self._measure(1)
+        many_queries, many_bytes, results = self._measure(14)
+
+        self.assertEqual(few_queries, many_queries)
+        # Отличаются только цифры в stops_count/days/first_image
+        self.assertLess(many_bytes - few_bytes, 100)
+        self.assertNotIn('stops', results[0])
+        self.assertEqual(results[0]['stops_count'], 14)
+        self.assertEqual(results[0]['days'], 14)
+        self.assertTrue(results[0]['first_image'].endswith('/1.jpg'))
+
+    def test_detail_prefetches_stops(self):
+        self._seed(14)
+        route = Route.objects.first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/routes/{route.id}/')
+        self.assertEqual(len(response.json()['stops']), 14)
+        # Маршрут + одна выборка всех остановок
+        self.assertEqual(len(queries), 2)
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    # Локальная заглушка OpenAI-совместимого API: отдает ответ потоком по частям
+    chunks = ['Kolsai ', 'is ', 'beautiful.']
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+        time.sleep(self.server.delay)
+        if self.server.rate_limit_next:
+            # Имитация лимита OpenAI
+            self.server.rate_limit_next -= 1
+            payload = json.dumps({'error': {'message': 'Rate limit', 'type': 'rate_limit'}}).encode()
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        self.send_response(200)
+        if body.get('stream'):
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for text in self.chunks:
+                chunk = {
+                    'id': 'stub', 'object': 'chat.completion.chunk', 'created': 0, 'model': body['model'],
+                    'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}],
+                }
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                self.wfile.flush()
+            self.wfile.write(b'data: [DONE]\n\n')
+        else:
+            payload = json.dumps({
+                'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ''.join(self.chunks)}}],
+            }).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubOpenAIMixin:
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = ThreadingHTTPServer(('127.0.0.1', 0), StubOpenAIHandler)
+        cls.stub.requests = []
+        cls.stub.delay = 0
+        cls.stub.rate_limit_next = 0
+        threading.Thread(target=cls.stub.serve_forever, daemon=True).start()
+        cls.stub_settings = override_settings(
+            OPENAI_API_KEY='test', OPENAI_BASE_URL=f'http://127.0.0.1:{cls.stub.server_port}/v1',
+        )
+        cls.stub_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub_settings.disable()
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+
+def parse_sse(content):
+    events = []
+    for block in content.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+class AIStreamTests(StubOpenAIMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.kolsai = Attraction.objects.create(name='Kolsai Lakes', region=region, category=category,
+                                               description='Three lakes', status='active')
+
+    def setUp(self):
+        reply_cache.clear()
+        vector_index.clear()
+
+    async def test_recommendations_then_streamed_tokens(self):
+        response = await self.async_client.post(
+            '/api/ai/ask/stream/', {'message': 'kolsai'}, content_type='application/json',
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = parse_sse(content)
+
+        self.assertEqual(events[0][0], 'recommendations')
+        self.assertEqual([item['id'] for item in events[0][1]], [self.kolsai.id])
+        self.assertEqual([data['text'] for name, data in events if name == 'token'],
+                         ['Kolsai ', 'is ', 'beautiful.'])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertIn('Kolsai Lakes', self.stub.requests[-1]['messages'][0]['content'])
+
+    def test_sync_ask_uses_same_context(self):
+        response = APIClient().post('/api/ai/ask/', {'message': 'kolsai'}, format='json')
+        self.assertEqual(response.json()['reply'], 'Kolsai is beautiful.')
+        self.assertEqual(response.json()['recommendations'][0]['id'], self.kolsai.id)
+
+    def test_sync_ask_logs_upstream_error(self):
+        with mock.patch.object(ai, 'complete_with_usage', side_effect=RuntimeError('connection reset')), \
+                self.assertLogs('api.views', 'ERROR') as logs:
+            response = APIClient().post('/api/ai/ask/', {'message': 'kolsai'}, format='json')
+        self.assertEqual(response.json()['reply'], ai.AI_ERROR_REPLY)
+        self.assertIn('connection reset', logs.output[0])
+
+
+class AIReplyCacheTests(StubOpenAIMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.kolsai = Attraction.objects.create(name='Kolsai Lakes', region=region, category=category,
+                                               description='Three lakes', status='active')
+
+    def setUp(self):
+        reply_cache.clear()
+        vector_index.clear()
+        self.stub.requests.clear()
+
+    def test_normalized_query(self):
+        self.assertEqual(normalize_query('Where to go in Kolsai?'), normalize_query('kolsai, where to go'))
+        self.assertNotEqual(normalize_query('flights from Almaty to Astana'),
+                            normalize_query('flights from Astana to Almaty'))
+        self.assertNotEqual(normalize_query('lake'), normalize_query('lake lake'))
+        self.assertNotEqual(cache_key('kolsai', 'context A'), cache_key('kolsai', 'context B'))
+
+    def test_similar_question_served_from_cache(self):
+        client = APIClient()
+        first = client.post('/api/ai/ask/', {'message': 'Kolsai'}, format='json').json()
+        second = client.post('/api/ai/ask/', {'message': '  KOLSAI '}, format='json').json()
+        self.assertEqual(first['reply'], second['reply'])
+        self.assertEqual(len(self.stub.requests), 1)
+
+        admin = User.objects.create_superuser(username='admin', password='pass12345')
+        client.force_authenticate(admin)
+        stats = client.get('/api/admin/stats/').json()['ai_cache']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    async def test_stream_uses_cache(self):
+        for _ in range(2):
+            response = await self.async_client.post('/api/ai/ask/stream/', {'message': 'kolsai'},
+                                                    content_type='application/json')
+            content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        tokens = [data['text'] for name, data in parse_sse(content) if name == 'token']
+        self.assertEqual(tokens, ['Kolsai is beautiful.'])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_changed_context_misses(self):
+        client = APIClient()
+        client.post('/api/ai/ask/', {'message': 'kolsai'}, format='json')
+        self.kolsai.description = 'Three mountain lakes'
+        self.kolsai.save()
+        client.post('/api/ai/ask/', {'message': 'kolsai'}, format='json')
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_lru_and_ttl(self):
+        lru = ReplyCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+        expired = ReplyCache(max_entries=2, ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+
+class VectorIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(name='Almaty Region')
+        cls.lake = Category.objects.create(name='Lake')
+        cls.canyon = Category.objects.create(name='Canyon')
+        cls.kolsai = Attraction.objects.create(name='Kolsai Lakes', region=cls.region, category=cls.lake,
+                                               description='Three mountain lakes in the Tien Shan', status='active')
+        cls.charyn = Attraction.objects.create(name='Charyn Canyon', region=cls.region, category=cls.canyon,
+                                               description='Red rock canyon and the Valley of Castles', status='active')
+        Attraction.objects.create(name='Hidden Lake', region=cls.region, category=cls.lake,
+                                  description='Draft', status='draft')
+        cls.route = Route.objects.create(title='Silk Road Heritage', description='Ancient cities of the south',
+                                         duration_days=5, budget_range='$500', difficulty='Easy')
+        RouteStop.objects.create(route=cls.route, day_number=1, title='Turkestan',
+                                 description='Mausoleum of Khoja Ahmed Yasawi')
+
+    def setUp(self):
+        vector_index.clear()
+
+    def test_sentence_question_finds_attraction(self):
+        hits = vector_index.search('Where can I see mountain lakes near Almaty?', k=1)
+        self.assertEqual(hits[0][:2], ('attraction', self.kolsai.id))
+        # Черновики в индекс не попадают
+        self.assertEqual(len(vector_index), 3)
+
+    def test_routes_are_indexed(self):
+        hits = vector_index.search('tour to the mausoleum in Turkestan', k=1)
+        self.assertEqual(hits[0][:2], ('route', self.route.id))
+
+    def test_incremental_updates(self):
+        vector_index.search('lakes')
+        built_at = vector_index._built_at
+
+        aksu = Attraction.objects.create(name='Aksu Gorge', region=self.region, category=self.canyon,
+                                         description='Deep gorge with a river', status='active')
+        self.assertEqual(vector_index.search('aksu gorge', k=1)[0][:2], ('attraction', aksu.id))
+
+        self.charyn.status = 'draft'
+        self.charyn.save()
+        self.kolsai.delete()
+        keys = {hit[:2] for hit in vector_index.search('canyon lakes', k=10, min_score=-1)}
+        self.assertNotIn(('attraction', self.charyn.id), keys)
+        self.assertNotIn(('attraction', self.kolsai.id), keys)
+        self.assertEqual(len(vector_index), 2)
+        self.assertEqual(vector_index._built_at, built_at)
+
+    def test_signal_updates_wait_for_commit(self):
+        vector_index.search('lakes')
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda fn, *args: fn(*args)
+        with mock.patch.object(vectors, 'INDEX_ASYNC', True), \
+                mock.patch.object(vectors, '_get_executor', return_value=executor), \
+                mock.patch.object(vectors, 'close_old_connections'):
+            with self.captureOnCommitCallbacks(execute=True):
+                aksu = Attraction.objects.create(name='Aksu Gorge', region=self.region, category=self.canyon,
+                                                 description='Deep gorge with a river', status='active')
+                # Внутри транзакции эмбеддинг не считается
+                self.assertEqual(len(vector_index), 3)
+        self.assertEqual(vector_index.search('aksu gorge', k=1)[0][:2], ('attraction', aksu.id))
+
+    def test_build_keeps_updates_made_during_embed(self):
+        vector_index.build()
+        Attraction.objects.filter(pk=self.kolsai.pk).update(description='Aksu river gorge')
+        aksu = Attraction.objects.create(name='Aksu Gorge', region=self.region, category=self.canyon,
+                                         description='Deep gorge with a river', status='active')
+        embedder = vector_index.embedder
+        embed = embedder.embed
+
+        def embed_during_updates(texts):
+            # Пока перестройка считает векторы, другие запросы удаляют документы из индекса
+            vector_index.remove([('attraction', self.charyn.pk), ('attraction', aksu.pk)])
+            return embed(texts)
+
+        with mock.patch.object(embedder, 'embed', side_effect=embed_during_updates):
+            vector_index.build()
+        keys = {hit[:2] for hit in vector_index.search('gorge canyon lakes', k=10, min_score=-1)}
+        self.assertNotIn(('attraction', self.charyn.pk), keys)
+        self.assertNotIn(('attraction', aksu.pk), keys)
+        self.assertIn(('attraction', self.kolsai.pk), keys)
+
+    def test_rebuild_embeds_only_changed_documents(self):
+        vector_index.build()
+        embedder = vector_index.embedder
+        with mock.patch.object(embedder, 'embed', wraps=embedder.embed) as embed:
+            self.assertEqual(vector_index.build(), 0)
+            # update() не шлет сигналов — изменение из "другого процесса"
+            Attraction.objects.filter(pk=self.kolsai.pk).update(description='Aksu river gorge')
+            self.assertEqual(vector_index.build(), 1)
+        self.assertEqual([len(call.args[0]) for call in embed.call_args_list], [0, 1])
+        self.assertEqual(vector_index.search('aksu river gorge', k=1)[0][:2], ('attraction', self.kolsai.id))
+
+    def test_stale_index_is_rebuilt_in_background(self):
+        vector_index.search('lakes')
+        vector_index._built_at -= vectors.INDEX_MAX_AGE + 1
+        started, release = threading.Event(), threading.Event()
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+
+        with mock.patch.object(vector_index, 'build', side_effect=slow_build), \
+                mock.patch.object(vectors, 'connection'):
+            # Поиск не ждет перестройку, второй поток не запускается
+            self.assertEqual(vector_index.search('kolsai lakes', k=1)[0][:2], ('attraction', self.kolsai.id))
+            self.assertTrue(started.wait(5))
+            vector_index.search('lakes')
+            release.set()
+        for thread in threading.enumerate():
+            if thread.name == 'vector-index':
+                thread.join(5)
+        self.assertFalse(vector_index._rebuilding)
+
+    def test_openai_embeddings_are_batched(self):
+        response = lambda batch: mock.Mock(data=[mock.Mock(embedding=[1.0, 0.0]) for _ in batch])
+        client = mock.Mock()
+        client.embeddings.create.side_effect = lambda model, input: response(input)
+        with mock.patch('api.ai.get_client', return_value=client), \
+                mock.patch.object(vectors, 'EMBEDDING_BATCH_SIZE', 2):
+            matrix = vectors.OpenAIEmbedder().embed(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(matrix.shape, (5, 2))
+        self.assertEqual([len(call.kwargs['input']) for call in client.embeddings.create.call_args_list], [2, 2, 1])
+
+    def test_find_context_includes_routes(self):
+        from .ai import find_context
+        recommendations, context_data = find_context('Turkestan mausoleum and Charyn canyon', lambda url: url)
+        self.assertEqual({item['type'] for item in recommendations}, {'attraction', 'route'})
+        self.assertIn('Silk Road Heritage', context_data)
+        # Индекс уже построен: только выборка найденных объектов по id
+        with CaptureQueriesContext(connection) as queries:
+            find_context('Turkestan mausoleum and Charyn canyon', lambda url: url)
+        self.assertEqual(len(queries), 2)
+
+
+class AIUpstreamGateTests(StubOpenAIMixin, TestCase):
+
+    def setUp(self):
+        reply_cache.clear()
+        self.stub.requests.clear()
+        self.gate = UpstreamGate(limit=2, timeout=2, backoff_base=0.05, backoff_max=1)
+        patcher = mock.patch.object(ai, 'gate', self.gate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_questions_share_one_call(self):
+        self.stub.delay = 0.3
+        self.addCleanup(setattr, self.stub, 'delay', 0)
+        barrier = threading.Barrier(5)
+        replies = []
+
+        def ask():
+            barrier.wait()
+            replies.append(ai.answer('kolsai', 'context'))
+
+        threads = [threading.Thread(target=ask) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(replies, ['Kolsai is beautiful.'] * 5)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.gate.stats()['coalesced'], 4)
+
+    def test_concurrency_cap(self):
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        threads = [threading.Thread(target=self.gate.call, args=(work,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = self.gate.stats()
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(stats['calls'], 6)
+        self.assertGreater(stats['queued_calls'], 0)
+        self.assertGreater(stats['max_wait_ms'], 0)
+        self.assertEqual((stats['active'], stats['queue_depth']), (0, 0))
+
+    def test_queue_deadline(self):
+        gate = UpstreamGate(limit=1, timeout=0.05)
+        deadline = time.monotonic() + 1
+        gate.acquire(deadline)
+        with self.assertRaises(UpstreamBusy):
+            gate.call(lambda: None)
+        gate.release()
+        self.assertEqual(gate.call(lambda: 'ok'), 'ok')
+        self.assertEqual(gate.stats()['timeouts'], 1)
+
+    def test_async_waiters_get_released_slot(self):
+        gate = UpstreamGate(limit=1, timeout=1)
+
+        async def scenario():
+            gate.acquire(time.monotonic() + 1)
+            waiter = asyncio.create_task(gate.acquire_async(time.monotonic() + 1))
+            await asyncio.sleep(0.01)
+            self.assertEqual(gate.stats()['queue_depth'], 1)
+            gate.release()
+            await waiter
+            self.assertEqual(gate.stats()['active'], 1)
+            with self.assertRaises(UpstreamBusy):
+                await gate.acquire_async(time.monotonic() + 0.05)
+            gate.release()
+
+        asyncio.run(scenario())
+        self.assertEqual((gate.stats()['active'], gate.stats()['queue_depth']), (0, 0))
+
+    def test_rate_limit_backs_off_and_retries(self):
+        self.stub.rate_limit_next = 1
+        self.assertEqual(ai.answer('kolsai', 'context'), 'Kolsai is beautiful.')
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.gate.stats()['rate_limited'], 1)
+
+    def test_busy_view_returns_503(self):
+        gate = UpstreamGate(limit=1, timeout=0.05)
+        gate.acquire(time.monotonic() + 1)
+        with mock.patch.object(ai, 'gate', gate):
+            response = APIClient().post('/api/ai/ask/', {'message': 'kolsai'}, format='json')
+        gate.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['reply'], ai.AI_BUSY_REPLY)
+        self.assertIn('Retry-After', response)
+
+
+class ConversationTests(StubOpenAIMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.kolsai = Attraction.objects.create(name='Kolsai Lakes', region=region, category=category,
+                                               description='Three alpine lakes in the Tien Shan', status='active')
+
+    def setUp(self):
+        reply_cache.clear()
+        vector_index.clear()
+        self.stub.requests.clear()
+        patcher = mock.patch.object(conversations, 'AI_PROMPT_TOKEN_BUDGET', 500)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, message, conversation=None):
+        payload = {'message': message}
+        if conversation:
+            payload['conversation'] = conversation
+        return APIClient().post('/api/ai/ask/', payload, format='json').json()
+
+    def test_prompt_stays_within_budget(self):
+        conversation_id = None
+        prompt_sizes = []
+        for i in range(10):
+            data = self.ask(f'kolsai lakes trip question number {i} ' * 4, conversation_id)
+            conversation_id = data['conversation']
+            request = [r for r in self.stub.requests if r['messages'][0]['content'] != conversations.SUMMARY_INSTRUCTION][-1]
+            prompt_sizes.append(conversations.count_message_tokens(request['messages']))
+
+        self.assertTrue(all(size <= 500 for size in prompt_sizes))
+        conversation = Conversation.objects.get(pk=conversation_id)
+        self.assertEqual(conversation.turns_count, 10)
+        # Старые реплики свернуты в пересказ моделью
+        self.assertEqual(conversation.summary, 'Kolsai is beautiful.')
+        self.assertTrue(conversation.turns.filter(summarized=True).exists())
+        self.assertEqual(
+            conversation.prompt_tokens + conversation.completion_tokens, data['usage']['conversation_tokens']
+        )
+        summary_requests = [r for r in self.stub.requests if r['messages'][0]['content'] == conversations.SUMMARY_INSTRUCTION]
+        self.assertTrue(summary_requests)
+
+    def test_follow_up_sees_history_and_replays_its_context(self):
+        first = self.ask('kolsai lakes')
+        self.assertIn('Three alpine lakes', self.stub.requests[-1]['messages'][0]['content'])
+        second = self.ask('kolsai lakes in winter', first['conversation'])
+        self.assertEqual(second['conversation'], first['conversation'])
+
+        messages = self.stub.requests[-1]['messages']
+        self.assertEqual([m['role'] for m in messages], ['system', 'user', 'assistant', 'user'])
+        # Описание пришло с первой репликой и повторяется вместе с ней — один раз, не дважды
+        self.assertEqual(messages[0]['content'].count('Three alpine lakes'), 1)
+        turns = Conversation.objects.get(pk=first['conversation']).turns.all()
+        self.assertEqual(list(turns[0].context), [f'attraction:{self.kolsai.id}'])
+        self.assertEqual(turns[1].context, {})
+        # Карточки фронтенд получает как обычно
+        self.assertEqual(second['recommendations'][0]['id'], self.kolsai.id)
+
+    def test_context_of_summarized_turns_is_sent_again(self):
+        conversation_id = None
+        for i in range(8):
+            data = self.ask(f'kolsai lakes trip question number {i} ' * 4, conversation_id)
+            conversation_id = data['conversation']
+            request = [r for r in self.stub.requests if r['messages'][0]['content'] != conversations.SUMMARY_INSTRUCTION][-1]
+            # Модель видит описание места на каждом шаге, даже когда реплика, с которой
+            # оно пришло впервые, уже свернута в пересказ
+            self.assertEqual(request['messages'][0]['content'].count('Three alpine lakes'), 1)
+        conversation = Conversation.objects.get(pk=conversation_id)
+        self.assertTrue(conversation.turns.filter(summarized=True).exists())
+        self.assertGreater(conversation.turns.exclude(context={}).count(), 1)
+
+    def test_foreign_conversation_is_not_continued(self):
+        owner = User.objects.create_user(username='owner', password='pass12345')
+        conversation = Conversation.objects.create(user=owner, turns_count=1)
+        data = self.ask('kolsai', str(conversation.pk))
+        self.assertNotEqual(data['conversation'], str(conversation.pk))
+        self.assertNotEqual(self.ask('kolsai', 'not-a-uuid')['conversation'], None)
+
+    async def test_stream_continues_conversation(self):
+        async def stream(payload):
+            response = await self.async_client.post('/api/ai/ask/stream/', payload, content_type='application/json')
+            content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+            return dict(parse_sse(content))
+
+        first = await stream({'message': 'kolsai'})
+        conversation_id = first['usage']['conversation']
+        second = await stream({'message': 'and in winter?', 'conversation': conversation_id})
+        self.assertEqual(second['usage']['conversation'], conversation_id)
+        self.assertEqual(second['usage']['turns'], 2)
+        self.assertEqual(self.stub.requests[-1]['messages'][1]['content'], 'kolsai')
+
+
+    async def test_stream_accepts_post_only(self):
+        response = await self.async_client.get('/api/ai/ask/stream/', {'message': 'kolsai'})
+        self.assertEqual(response.status_code, 405)
+
+    def test_stream_user_comes_from_jwt_not_session(self):
+        owner = User.objects.create_user(username='owner', password='pass12345')
+        request = RequestFactory().post('/api/ai/ask/stream/')
+        request.user = owner
+        self.assertFalse(ai._request_user(request).is_authenticated)
+
+        token = AccessToken.for_user(owner)
+        request = RequestFactory().post('/api/ai/ask/stream/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(ai._request_user(request), owner)
+
+
+class SeedDataCommandTests(TestCase):
+    volumes = dict(users=6, attractions=10, reviews=50, favorites=20, routes=3, stops_per_route=2,
+                   bookings=12, batch_size=7)
+
+    def seed(self, **overrides):
+        out = StringIO()
+        call_command('seed_data', stdout=out, **{**self.volumes, **overrides})
+        return out.getvalue()
+
+    def snapshot(self):
+        return sorted(Review.objects.values_list('author__username', 'attraction__name', 'rating', 'status'))
+
+    def test_volumes_and_idempotent_rerun(self):
+        self.assertIn('rows/s', self.seed())
+        counts = (User.objects.count(), Attraction.objects.count(), Review.objects.count(),
+                  Attraction.favorited_by.through.objects.count(), Route.objects.count(),
+                  RouteStop.objects.count(), Booking.objects.count(), UserProfile.objects.count())
+        self.assertEqual(counts, (6, 10, 50, 20, 3, 6, 12, 6))
+
+        # Повторный запуск ничего не дублирует, а больший объем досоздает недостающее
+        first = self.snapshot()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+        self.seed(reviews=60)
+        self.assertEqual(Review.objects.count(), 60)
+
+        # Денормализованные поля пересчитаны, хотя bulk_create не шлет сигналы
+        approved = Review.objects.filter(status='approved').count()
+        self.assertEqual(sum(Attraction.objects.values_list('rating_count', flat=True)), approved)
+        self.assertEqual(sum(Attraction.objects.values_list('favorites_count', flat=True)), 20)
+
+    def test_rerun_with_other_volumes(self):
+        self.seed()
+        # Больше пользователей и мест: прежнее сопоставление индексов дало бы те же пары
+        # (пользователь, место) еще раз, а остановки — сдвинуло бы на другие маршруты
+        self.seed(users=9, attractions=13, favorites=40, routes=4, stops_per_route=3)
+        through = Attraction.favorited_by.through
+        self.assertEqual(through.objects.count(), 40)
+        stops = list(RouteStop.objects.values_list('route_id', 'day_number'))
+        self.assertEqual(len(stops), 12)
+        self.assertEqual(len(set(stops)), 12)
+        self.assertEqual({day for _, day in stops}, {1, 2, 3})
+        # Меньшие объемы ничего не добавляют
+        self.assertIn('Route stops: 12 present, nothing to add', self.seed(stops_per_route=2))
+
+    def test_dates_do_not_depend_on_the_current_day(self):
+        def dates():
+            return (sorted(Review.objects.values_list('created_at', flat=True)),
+                    sorted(Booking.objects.values_list('date', 'created_at')))
+
+        self.seed()
+        first = dates()
+        Review.objects.all().delete()
+        Booking.objects.all().delete()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=3)):
+            self.seed()
+        self.assertEqual(dates(), first)
+        self.assertTrue(all(booking_date.year in (2025, 2026) for booking_date, _ in first[1]))
+
+    def test_same_rows_for_any_batch_size(self):
+        self.seed()
+        first = self.snapshot()
+        Review.objects.all().delete()
+        self.seed(batch_size=4)
+        self.assertEqual(self.snapshot(), first)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkRegressionTests(TestCase):
+    # Число SQL-запросов каждого эндпоинта не должно превышать api/benchmark_baseline.json.
+    # Время здесь не сравнивается (зависит от машины) — для этого "manage.py benchmark --check"
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', users=20, attractions=30, reviews=300, favorites=60, routes=5,
+                     stops_per_route=3, bookings=40, stdout=StringIO())
+
+    def setUp(self):
+        # В тестах индекс ИИ-гида обновляется прямо в сигнале (vectors.INDEX_ASYNC), а в
+        # замере — после COMMIT, которого нет. Пустой индекс не обновляется вовсе
+        vector_index.clear()
+
+    def test_query_counts_within_baseline(self):
+        results = benchmarks.run(iterations=2, warmup=1)
+        self.assertEqual(set(results), {endpoint[0] for endpoint in benchmarks.ENDPOINTS})
+        regressions = benchmarks.compare(results, benchmarks.load_baseline(), check_latency=False)
+        self.assertEqual(regressions, [])
+
+    def test_run_leaves_database_unchanged(self):
+        def snapshot():
+            return (User.objects.count(), Booking.objects.count(), Attraction.favorited_by.through.objects.count())
+
+        before = snapshot()
+        benchmarks.run(iterations=1, warmup=0, names=['bookings-create', 'auth-register', 'attractions-toggle-favorite'])
+        self.assertEqual(snapshot(), before)
+
+    def test_compare_reports_regressions(self):
+        baseline = {'reviews-list': {'queries': 1, 'p95_ms': 10}}
+        results = {'reviews-list': {'queries': 21, 'p95_ms': 40}, 'new-endpoint': {'queries': 1, 'p95_ms': 1}}
+        regressions = benchmarks.compare(results, baseline)
+        self.assertEqual(len(regressions), 3)
+
+
+class RequestTimingTests(StubOpenAIMixin, TestCase):
+    # Server-Timing для персонала и лог медленных запросов с повторяющимися SQL
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.author = User.objects.create_user(username='reviewer', password='pass12345')
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        attractions = Attraction.objects.bulk_create([
+            Attraction(name=f'Attraction {i}', region=region, category=category, status='active')
+            for i in range(5)
+        ])
+        Review.objects.bulk_create([
+            Review(author=cls.author, attraction=attraction, rating=5, text='Great', status='approved')
+            for attraction in attractions
+        ])
+
+    def setUp(self):
+        cache.clear()
+        reply_cache.clear()
+        vector_index.clear()
+        self.client = APIClient()
+
+    def server_timing(self, response):
+        # 'db;dur=1.2;desc="3 queries", ...' -> {'db': (1.2, '3 queries'), ...}
+        metrics = {}
+        for part in response['Server-Timing'].split(', '):
+            name, *params = part.split(';')
+            values = dict(param.split('=', 1) for param in params)
+            metrics[name] = (float(values['dur']), values.get('desc', '').strip('"'))
+        return metrics
+
+    def test_staff_gets_server_timing(self):
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/reviews/')
+        self.assertEqual(response.status_code, 200)
+        metrics = self.server_timing(response)
+        self.assertEqual(set(metrics), {'db', 'serialize', 'external', 'total'})
+        self.assertEqual(metrics['db'][1], f'{len(captured)} queries')
+        self.assertGreater(metrics['serialize'][0], 0)
+        self.assertEqual(metrics['external'][0], 0)
+        self.assertGreaterEqual(metrics['total'][0], metrics['db'][0] + metrics['serialize'][0])
+
+    def test_other_users_get_no_header(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/reviews/'))
+        self.client.force_authenticate(self.author)
+        self.assertNotIn('Server-Timing', self.client.get('/api/reviews/'))
+
+    def test_slow_request_logs_duplicated_sql(self):
+        # Ленивый доступ к автору в цикле — тот же SQL N раз (N+1)
+        def serialize_slowly(serializer, instance):
+            return {'id': instance.pk, 'author': User.objects.get(pk=instance.author_id).username}
+
+        with mock.patch.object(timing, 'SLOW_REQUEST_MS', 0), \
+                mock.patch.object(timing, 'SQL_SAMPLE_RATE', 1), \
+                mock.patch('rest_framework.serializers.ModelSerializer.to_representation', serialize_slowly), \
+                self.assertLogs('api.timing', 'WARNING') as logs:
+            self.client.get('/api/reviews/')
+        message = logs.output[0]
+        self.assertIn('Slow request GET /api/reviews/ -> 200', message)
+        self.assertIn('5x', message)
+        self.assertIn('auth_user', message)
+
+    def test_unsampled_request_keeps_counters_only(self):
+        self.client.force_authenticate(self.admin)
+        with mock.patch.object(timing, 'SLOW_REQUEST_MS', 0), mock.patch.object(timing, 'SQL_SAMPLE_RATE', 0), \
+                self.assertLogs('api.timing', 'WARNING') as logs:
+            response = self.client.get('/api/reviews/')
+        self.assertIn('queries', response['Server-Timing'])
+        self.assertEqual(len(logs.output[0].splitlines()), 1)
+
+    def test_openai_call_counted_as_external(self):
+        self.client.force_authenticate(self.admin)
+        self.stub.delay = 0.05
+        self.addCleanup(setattr, self.stub, 'delay', 0)
+        response = self.client.post('/api/ai/ask/', {'message': 'lake'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(self.server_timing(response)['external'][0], 50)
+
+    def test_span_outside_request_is_noop(self):
+        with timing.span('external'):
+            Review.objects.count()
+        self.assertIsNone(timing._current.get())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryPlanTests(TestCase):
+    # Основные списки на большой базе должны читать индекс, а не всю таблицу.
+    # EXPLAIN выполняется для того SQL, который реально отправил эндпоинт
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', users=50, attractions=300, reviews=20000, favorites=100, routes=10,
+                     stops_per_route=2, bookings=3000, batch_size=5000, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.filter(username__startswith='seed_user_').order_by('id').first()
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        cls.attraction = Attraction.objects.filter(status='active').order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def plans(self, path):
+        # -> [(sql, план)] для всех SQL-запросов эндпоинта
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        plans = []
+        for query in captured:
+            with connection.cursor() as cursor:
+                cursor.execute(prefix + query['sql'])
+                plans.append((query['sql'], '\n'.join(str(row) for row in cursor.fetchall())))
+        return plans
+
+    def assertUsesIndex(self, path, table, index):
+        plans = [plan for sql, plan in self.plans(path) if f'FROM "{table}"' in sql]
+        self.assertTrue(plans, f'{path}: no query on {table}')
+        self.assertTrue(any(index in plan for plan in plans), f'{path}: {index} not used:\n' + '\n'.join(plans))
+
+    def test_public_review_feed(self):
+        self.assertUsesIndex('/api/reviews/', 'api_review', 'review_approved_created_idx')
+
+    def test_reviews_of_attraction(self):
+        self.assertUsesIndex(f'/api/reviews/?attraction={self.attraction.id}', 'api_review',
+                             'review_attr_status_created_idx')
+
+    def test_attraction_list(self):
+        self.assertUsesIndex('/api/attractions/', 'api_attraction', 'attraction_status_id_idx')
+
+    def test_my_bookings(self):
+        self.client.force_authenticate(self.user)
+        self.assertUsesIndex('/api/bookings/', 'api_booking', 'booking_user_created_idx')
+
+    def test_admin_stats(self):
+        self.client.force_authenticate(self.admin)
+        self.assertUsesIndex('/api/admin/stats/', 'api_review', 'review_pending_idx')
+        self.assertUsesIndex('/api/admin/stats/', 'api_attraction', 'attraction_visitors_idx')
+
+
+class NearbyAttractionsTests(TestCase):
+    # /attractions/nearby/: результат совпадает с полным перебором по формуле гаверсинусов
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        rng = random.Random(7)
+        attractions = []
+        for i in range(3000):
+            # Облако точек вокруг Алматы плюс разброс по всему Казахстану
+            if i % 3:
+                lat, lon = 43.24 + rng.uniform(-0.5, 0.5), 76.89 + rng.uniform(-0.7, 0.7)
+            else:
+                lat, lon = rng.uniform(40.6, 55.4), rng.uniform(46.5, 87.3)
+            attraction = Attraction(name=f'Place {i}', region=region, category=category, latitude=lat,
+                                    longitude=lon, status='draft' if i % 10 == 0 else 'active')
+            attraction.geohash = attraction.compute_geohash()
+            attractions.append(attraction)
+        Attraction.objects.bulk_create(attractions)
+        cls.active = [a for a in attractions if a.status == 'active']
+
+    def brute_force(self, lat, lon, radius_km):
+        lats = [a.latitude for a in self.active]
+        lons = [a.longitude for a in self.active]
+        distances = geo.haversine_km(lat, lon, lats, lons)
+        return sorted((d, a.name) for a, d in zip(self.active, distances) if d <= radius_km)
+
+    def test_matches_brute_force(self):
+        client = APIClient()
+        for lat, lon, radius, limit in ((43.24, 76.89, 5, 100), (43.24, 76.89, 30, 50), (47.0, 67.0, 300, 100)):
+            with self.subTest(radius=radius):
+                # Кандидаты (до трех расширений круга) + карточки одним запросом
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get('/api/attractions/nearby/',
+                                          {'lat': lat, 'lon': lon, 'radius_km': radius, 'limit': limit})
+                self.assertLessEqual(len(captured), 4)
+                results = response.json()['results']
+                expected = self.brute_force(lat, lon, radius)[:limit]
+                self.assertTrue(expected)
+                self.assertEqual([item['name'] for item in results], [name for _, name in expected])
+                self.assertEqual([item['distance_km'] for item in results], [round(d, 2) for d, _ in expected])
+
+    def test_geohash_follows_coordinates(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        attraction = Attraction.objects.get(name='Place 1')
+        attraction.latitude, attraction.longitude = 51.1282, 71.4306
+        attraction.save(update_fields=['latitude', 'longitude'])
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.geohash, geo.encode(51.1282, 71.4306))
+
+    def test_cell_ranges_merge_neighbours(self):
+        self.assertEqual(geo.cell_ranges(['u4p', 'u4q', 'u4r', 'u4x']), [('u4p', 'u4s'), ('u4x', 'u4y')])
+        self.assertEqual(geo.cell_ranges(['z']), [('z', None)])
+        self.assertEqual(geo.cell_ranges(['0', '2', '5', '9'], max_ranges=2), [('0', '6'), ('9', 'b')])
+
+    def test_invalid_params(self):
+        client = APIClient()
+        for params in ({}, {'lat': 'x', 'lon': 1}, {'lat': 100, 'lon': 1}, {'lat': 1, 'lon': 1, 'radius_km': 0},
+                       {'lat': 1, 'lon': 1, 'radius_km': 5000}, {'lat': 1, 'lon': 1, 'limit': 1000}):
+            with self.subTest(params=params):
+                self.assertEqual(client.get('/api/attractions/nearby/', params).status_code, 400)
+
+
+class RouteOptimizerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Almaty Region')
+        category = Category.objects.create(name='Lake')
+        cls.admin = User.objects.create_user(username='admin', password='pass12345', is_staff=True)
+        # Точки на одной линии, а остановки перемешаны: A(0) C(2) B(1) D(3)
+        cls.places = Attraction.objects.bulk_create([
+            Attraction(name=f'Place {i}', region=region, category=category, latitude=43.0, longitude=76.0 + i,
+                       status='active')
+            for i in range(4)
+        ])
+        cls.route = Route.objects.create(title='Zigzag', description='Route', duration_days=5,
+                                         budget_range='$', difficulty='Easy', distance_km=1)
+        order = [0, 2, 1, 3]
+        cls.stops = RouteStop.objects.bulk_create([
+            RouteStop(route=cls.route, day_number=day, title=f'Stop {i}', description='Stop',
+                      attraction=cls.places[i])
+            for day, i in enumerate(order, start=1)
+        ])
+        # Остановка без места остается на своем месте (день 5)
+        cls.unlinked = RouteStop.objects.create(route=cls.route, day_number=5, title='Free day', description='Rest')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_preview_does_not_change_route(self):
+        response = self.client.post(f'/api/routes/{self.route.id}/optimize/', {}, format='json')
+        data = response.json()
+        self.assertEqual([stop['title'] for stop in data['stops']],
+                         ['Stop 0', 'Stop 1', 'Stop 2', 'Stop 3', 'Free day'])
+        self.assertLess(data['distance_km'], data['current_distance_km'])
+        self.assertFalse(data['applied'])
+        self.assertEqual(RouteStop.objects.get(title='Stop 1').day_number, 3)
+
+    def test_apply_reorders_days_and_distance(self):
+        response = self.client.post(f'/api/routes/{self.route.id}/optimize/', {'apply': True}, format='json')
+        self.assertTrue(response.json()['applied'])
+        days = dict(RouteStop.objects.filter(route=self.route).values_list('title', 'day_number'))
+        self.assertEqual(days, {'Stop 0': 1, 'Stop 1': 2, 'Stop 2': 3, 'Stop 3': 4, 'Free day': 5})
+        self.route.refresh_from_db()
+        # Три градуса долготы на широте 43° — около 243 км
+        self.assertEqual(self.route.distance_km, round(response.json()['distance_km']))
+        self.assertAlmostEqual(self.route.distance_km, 243, delta=2)
+
+    def test_requires_admin_and_coordinates(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(f'/api/routes/{self.route.id}/optimize/').status_code, 401)
+        self.client.force_authenticate(self.admin)
+        RouteStop.objects.filter(route=self.route).update(attraction=None)
+        self.assertEqual(self.client.post(f'/api/routes/{self.route.id}/optimize/').status_code, 400)
+
+    def test_large_route_is_fast_and_shorter(self):
+        rng = random.Random(3)
+        latitudes = [rng.uniform(40.6, 55.4) for _ in range(300)]
+        longitudes = [rng.uniform(46.5, 87.3) for _ in range(300)]
+        started = time.perf_counter()
+        order, distance_km, current_km = route_optimizer.optimize(latitudes, longitudes)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(sorted(order), list(range(300)))
+        self.assertEqual(order[0], 0)
+        dist = route_optimizer.distance_matrix(latitudes, longitudes)
+        self.assertLessEqual(distance_km, route_optimizer.path_length(dist, route_optimizer.nearest_neighbor(dist)))
+        self.assertLess(distance_km, current_km / 5)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='tourism-media-'))
+class ImageVariantsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(name='Almaty Region')
+        cls.category = Category.objects.create(name='Lake')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(images, 'IMAGE_VARIANTS_ASYNC', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def photo(self, width=2000, height=1000, name='photo.png'):
+        buffer = BytesIO()
+        Image.new('RGBA', (width, height), (30, 120, 200, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create(self, **kwargs):
+        return Attraction.objects.create(name='Kolsai Lakes', region=self.region, category=self.category,
+                                         description='Lakes', status='active', **kwargs)
+
+    def test_variants_built_and_exposed(self):
+        attraction = self.create(image=self.photo())
+        attraction.refresh_from_db()
+        variants = attraction.image_variants
+        self.assertEqual(variants['source'], attraction.image.name)
+        self.assertEqual([variants[name]['width'] for name in ('thumb', 'card', 'full')], [160, 480, 1280])
+        self.assertEqual(variants['card']['height'], 240)
+        for name in ('thumb', 'card', 'full'):
+            for extension, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with attraction.image.storage.open(variants[name][extension]) as file:
+                    self.assertEqual(Image.open(file).format, image_format)
+
+        data = APIClient().get(f'/api/attractions/{attraction.id}/').json()['images']
+        self.assertTrue(data['card']['webp'].startswith('http://testserver/media/variants/attraction/'))
+        self.assertEqual(data['srcset']['jpeg'].count('w, '), 2)
+        self.assertIn(' 160w', data['srcset']['webp'])
+
+    def test_replaced_photo_removes_old_variants(self):
+        attraction = self.create(image=self.photo())
+        attraction.refresh_from_db()
+        old = images.variant_names(attraction.image_variants)
+        attraction.image = self.photo(800, 800, name='other.png')
+        attraction.save()
+        attraction.refresh_from_db()
+        storage = attraction.image.storage
+        self.assertFalse(any(storage.exists(name) for name in old))
+        # Меньше 1280 px — full в размер оригинала, без растягивания
+        self.assertEqual(attraction.image_variants['full']['width'], 800)
+
+        attraction.image = self.photo(300, 200, name='small.png')
+        attraction.save()
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.image_variants['full'], attraction.image_variants['card'])
+        srcset = images.srcset(attraction.image, attraction.image_variants)['srcset']['webp']
+        self.assertEqual(len(srcset.split(', ')), 2)
+
+    def test_stale_job_keeps_newer_variants(self):
+        attraction = self.create(image=self.photo())
+        attraction.refresh_from_db()
+        kept = attraction.image_variants
+        build_variants, built = images.build_variants, {}
+
+        def replaced_during_build(field_file, folder):
+            # Пока задача строит копии, фото заменяют — ее результат устарел
+            built.update(build_variants(field_file, folder))
+            Attraction.objects.filter(pk=attraction.pk).update(image='attractions/newer.jpg')
+            return built
+
+        with mock.patch.object(images, 'build_variants', side_effect=replaced_during_build):
+            images.process(Attraction, attraction.pk, 'image', 'image_variants', force=True)
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.image_variants, kept)
+        storage = attraction.image.storage
+        self.assertTrue(all(storage.exists(name) for name in images.variant_names(kept)))
+
+        # Другое фото: копии устаревшей задачи удаляются, записанные в строку остаются
+        Attraction.objects.filter(pk=attraction.pk).update(image=self.create(image=self.photo(640, 480)).image.name)
+        with mock.patch.object(images, 'build_variants', side_effect=replaced_during_build):
+            images.process(Attraction, attraction.pk, 'image', 'image_variants')
+        attraction.refresh_from_db()
+        self.assertEqual(attraction.image_variants, kept)
+        stale = images.variant_names(built) - images.variant_names(kept)
+        self.assertTrue(stale)
+        self.assertFalse(any(storage.exists(name) for name in stale))
+        self.assertTrue(all(storage.exists(name) for name in images.variant_names(kept)))
+
+    def test_pending_variants_fall_back_to_original(self):
+        attraction = self.create()
+        Attraction.objects.filter(pk=attraction.pk).update(image='attractions/raw.jpg')
+        attraction.refresh_from_db()
+        self.assertIsNone(images.srcset(attraction.image, attraction.image_variants))
+        self.assertEqual(images.preferred_url(attraction.image, attraction.image_variants), '/media/attractions/raw.jpg')
+
+    def test_async_build_runs_after_commit(self):
+        with mock.patch.object(images, 'IMAGE_VARIANTS_ASYNC', True), \
+                mock.patch.object(images, '_get_executor') as executor:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                self.create(image=self.photo())
+            executor.assert_not_called()
+            for callback in callbacks:
+                callback()
+        executor.return_value.submit.assert_called_once()
+
+    def test_immutable_cache_headers_for_variants(self):
+        attraction = self.create(image=self.photo())
+        attraction.refresh_from_db()
+        name = attraction.image_variants['thumb']['webp']
+        request = RequestFactory().get(f'/media/{name}')
+        response = serve_immutable(request, name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+
+class CatalogImportExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.region = Region.objects.create(name='Almaty Region')
+        cls.category = Category.objects.create(name='Lake')
+        Attraction.objects.bulk_create([
+            Attraction(name=f'Place {i}', region=cls.region, category=cls.category, description='Text',
+                       latitude=43.0 + i / 100, longitude=77.0, status='active' if i % 2 else 'draft')
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/api/attractions/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def upload(self, content, name='attractions.ndjson', **data):
+        file = SimpleUploadedFile(name, content.encode())
+        return self.client.post('/api/attractions/import/', {'file': file, **data}, format='multipart')
+
+    def test_export_ndjson_and_csv(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+        self.assertEqual(rows[0]['region'], 'Almaty Region')
+        self.assertEqual(set(rows[0]), set(catalog_io.FIELDS))
+
+        lines = self.export(type='csv', status='active').splitlines()
+        self.assertEqual(lines[0], ','.join(catalog_io.FIELDS))
+        self.assertEqual(len(lines), 1 + 12)
+
+    def test_export_requires_admin(self):
+        self.client.force_authenticate(User.objects.create_user('user', password='x'))
+        self.assertEqual(self.client.get('/api/attractions/export/').status_code, 403)
+
+    def test_export_then_import_is_idempotent(self):
+        for file_format in ('ndjson', 'csv'):
+            with self.subTest(file_format=file_format):
+                content = self.export(type=file_format)
+                response = self.upload(content, name=f'attractions.{file_format}')
+                self.assertEqual(response.json(), {'created': 0, 'updated': 25, 'invalid': 0, 'errors': []})
+        self.assertEqual(Attraction.objects.count(), 25)
+
+    def test_import_creates_updates_and_reports_errors(self):
+        place = Attraction.objects.get(name='Place 3')
+        rows = [
+            {'id': place.pk, 'name': 'Renamed', 'region': 'almaty region', 'category': 'Lake',
+             'description': 'New', 'latitude': 44.5, 'longitude': 78.1},
+            # Без id — сопоставляется по названию и региону
+            {'name': 'Place 4', 'region': 'Almaty Region', 'category': 'Lake', 'description': 'Updated'},
+            {'name': 'Kolsai', 'region': 'Almaty Region', 'category': 'Lake', 'description': 'Lakes',
+             'status': 'active', 'visitors_count': 10},
+            {'name': 'Bad', 'region': 'Mars', 'category': 'Lake', 'description': 'x', 'latitude': 100, 'longitude': 0},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        report = self.upload(content).json()
+        self.assertEqual((report['created'], report['updated'], report['invalid']), (1, 2, 2))
+        self.assertEqual(report['errors'][0]['line'], 4)
+        self.assertEqual(set(report['errors'][0]['errors']), {'region', 'latitude'})
+        self.assertEqual(report['errors'][1]['line'], 5)
+
+        place.refresh_from_db()
+        self.assertEqual((place.name, place.description), ('Renamed', 'New'))
+        # bulk_create не вызывает save(): geohash считает сам импорт
+        self.assertEqual(place.geohash, geo.encode(44.5, 78.1))
+        self.assertEqual(Attraction.objects.get(name='Place 4').description, 'Updated')
+        # Колонок, которых нет в строке, импорт не трогает
+        self.assertEqual(Attraction.objects.get(name='Place 4').latitude, 43.04)
+        self.assertEqual(Attraction.objects.get(name='Kolsai').visitors_count, 10)
+
+    def test_dry_run_and_create_missing(self):
+        content = json.dumps({'name': 'Bayterek', 'region': 'Astana', 'category': 'City', 'description': 'Tower'})
+        self.assertEqual(self.upload(content, dry_run='true').json()['invalid'], 1)
+        report = self.upload(content, dry_run='true', create_missing='true').json()
+        self.assertEqual((report['created'], report['invalid']), (1, 0))
+        self.assertFalse(Region.objects.filter(name='Astana').exists())
+        self.assertFalse(Attraction.objects.filter(name='Bayterek').exists())
+
+        self.upload(content, create_missing='true')
+        attraction = Attraction.objects.get(name='Bayterek')
+        self.assertEqual((attraction.region.name, attraction.category.name, attraction.status), ('Astana', 'City', 'draft'))
+
+    def test_import_queries_do_not_grow_with_rows(self):
+        def queries(count):
+            rows = [
+                json.dumps({'name': f'New {count}-{i}', 'region': 'Almaty Region', 'category': 'Lake',
+                            'description': 'x', 'latitude': 43.0, 'longitude': 77.0})
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as captured:
+                catalog_io.import_rows(catalog_io.read_rows([line.encode() for line in rows], 'ndjson'))
+            # INSERT SQLite делит на части по лимиту параметров; остальные запросы — по одному на пачку
+            return len([query for query in captured if not query['sql'].startswith('INSERT')])
+
+        self.assertEqual(queries(5), queries(400))
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('name,region,category,description,status\nCharyn,Almaty Region,Lake,Canyon,active\n')
+        self.addCleanup(os.remove, file.name)
+        output = StringIO()
+        call_command('import_attractions', file.name, stdout=output)
+        self.assertIn('Created 1, updated 0, invalid 0', output.getvalue())
+        self.assertEqual(Attraction.objects.get(name='Charyn').status, 'active')
+
+
+class BookingInventoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('traveler', password='x')
+        cls.route = Route.objects.create(title='Tour', description='Tour', duration_days=3,
+                                         budget_range='$200', difficulty='Easy')
+        cls.departure = Departure.objects.create(route=cls.route, date='2026-07-01', capacity=5)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def book(self, people=1, date='2026-07-01'):
+        return self.client.post('/api/bookings/', {'route': self.route.pk, 'date': date, 'people_count': people})
+
+    def seats(self):
+        self.departure.refresh_from_db()
+        return self.departure.seats_available
+
+    def test_reserves_seats_and_rejects_overbooking(self):
+        response = self.book(3)
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(response.json()['expires_at'])
+        self.assertEqual(self.seats(), 2)
+
+        response = self.book(3)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['seats_available'], 2)
+        # Отказ откатывает и саму бронь
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(self.book(0).status_code, 400)
+
+    def test_dates_without_departure_are_unlimited(self):
+        response = self.book(50, date='2026-08-01')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.json()['expires_at'])
+
+    def test_expired_hold_returns_seats(self):
+        booking_id = self.book(5).json()['id']
+        self.assertEqual(self.book(1).status_code, 409)
+        Booking.objects.filter(pk=booking_id).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        # Мест не хватило — истекшие брони этого выезда возвращают места
+        self.assertEqual(self.book(2).status_code, 201)
+        self.assertEqual(Booking.objects.get(pk=booking_id).status, 'expired')
+        self.assertEqual(self.seats(), 3)
+
+        response = self.client.post(f'/api/bookings/{booking_id}/pay/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['booking_status'], 'expired')
+
+    def test_pay_after_hold_time_releases_seats(self):
+        booking_id = self.book(2).json()['id']
+        Booking.objects.filter(pk=booking_id).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.client.post(f'/api/bookings/{booking_id}/pay/').status_code, 409)
+        self.assertEqual(self.seats(), 5)
+
+    def test_paid_booking_keeps_seats_and_delete_returns_them(self):
+        booking_id = self.book(2).json()['id']
+        self.assertEqual(self.client.post(f'/api/bookings/{booking_id}/pay/').status_code, 200)
+        self.assertEqual(inventory.release_expired(), 0)
+        self.assertEqual(self.seats(), 3)
+        self.assertEqual(self.client.patch(f'/api/bookings/{booking_id}/', {'people_count': 1}).status_code, 405)
+        self.assertEqual(self.client.delete(f'/api/bookings/{booking_id}/').status_code, 204)
+        self.assertEqual(self.seats(), 5)
+
+    def test_expire_command_and_departures_endpoint(self):
+        self.book(4)
+        Booking.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        output = StringIO()
+        call_command('expire_bookings', stdout=output)
+        self.assertIn('Returned 4 seats', output.getvalue())
+
+        with mock.patch('api.views.timezone.localdate', return_value=date(2026, 6, 1)):
+            response = self.client.get(f'/api/routes/{self.route.pk}/departures/')
+        self.assertEqual(response.json(), [{'id': self.departure.pk, 'date': '2026-07-01', 'capacity': 5, 'seats_available': 5}])
+
+
+class BookingAdminTests(TestCase):
+    # Админка меняет места выезда только через api/inventory.py
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('boss', password='x')
+        cls.user = User.objects.create_user('traveler', password='x')
+        route = Route.objects.create(title='Tour', description='Tour', duration_days=3,
+                                     budget_range='$200', difficulty='Easy')
+        cls.departure = Departure.objects.create(route=route, date='2026-07-01', capacity=5, seats_available=2)
+        cls.booking = Booking.objects.create(user=cls.user, route=route, date='2026-07-01', people_count=3,
+                                             total_price=300, departure=cls.departure)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def seats(self):
+        self.departure.refresh_from_db()
+        return self.departure.seats_available
+
+    def test_delete_returns_seats(self):
+        response = self.client.post(f'/admin/api/booking/{self.booking.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.seats(), 5)
+
+    def test_cancel_action_and_bulk_delete_return_seats_once(self):
+        changelist = '/admin/api/booking/'
+        self.client.post(changelist, {'action': 'cancel_bookings', '_selected_action': [self.booking.pk]})
+        self.assertEqual(Booking.objects.get().status, 'cancelled')
+        self.assertEqual(self.seats(), 5)
+        # Отмененная бронь мест уже не держит — удаление их не добавляет
+        self.client.post(changelist, {'action': 'delete_selected', '_selected_action': [self.booking.pk],
+                                      'post': 'yes'})
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.seats(), 5)
+
+    def change_capacity(self, capacity):
+        return self.client.post(f'/admin/api/departure/{self.departure.pk}/change/', {
+            'route': self.departure.route_id, 'date': '2026-07-01', 'capacity': capacity,
+        })
+
+    def test_capacity_change_keeps_sold_seats(self):
+        self.assertEqual(self.change_capacity(4).status_code, 302)
+        self.assertEqual(self.seats(), 1)
+        response = self.change_capacity(2)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '3 seats are already booked')
+        self.assertEqual(self.seats(), 1)
+
+
+class BookingConcurrencyTests(TransactionTestCase):
+    # Много параллельных покупателей на один выезд: продано ровно capacity мест, не больше
+    BOOKERS = 16
+    CAPACITY = 200
+
+    def test_parallel_bookers_do_not_oversell(self):
+        route = Route.objects.create(title='Tour', description='Tour', duration_days=1,
+                                     budget_range='$100', difficulty='Easy')
+        departure = Departure.objects.create(route=route, date='2026-07-01', capacity=self.CAPACITY)
+        users = [User.objects.create_user(f'booker{i}', password='x') for i in range(self.BOOKERS)]
+        accepted, unexpected = [], []
+        start = threading.Barrier(self.BOOKERS)
+        # SQLite пускает одного писателя за раз и на конкурирующую запись сразу отвечает
+        # "table is locked" — там запросы идут по очереди (в случайном порядке потоков).
+        # PostgreSQL пропускает их параллельно: конкурирующие брони ждут блокировку строки выезда
+        serialized = threading.Lock() if connection.vendor == 'sqlite' else nullcontext()
+
+        def booker(user, seed):
+            rng = random.Random(seed)
+            # Исключения запроса тестовый клиент ловит глобальным сигналом — из разных потоков
+            # они достаются чужим клиентам. Поэтому смотрим только на код ответа
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user)
+            start.wait()
+            try:
+                while True:
+                    people = rng.randint(1, 3)
+                    with serialized:
+                        response = client.post('/api/bookings/', {'route': route.pk, 'date': '2026-07-01',
+                                                                  'people_count': people})
+                    if response.status_code == 201:
+                        accepted.append(people)
+                    elif response.status_code == 409:
+                        if response.json()['seats_available'] == 0:
+                            return
+                    else:
+                        # Любой другой ответ (в том числе 500) — ошибка, а не повод повторить
+                        unexpected.append(response.status_code)
+                        return
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=booker, args=(user, i)) for i, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        departure.refresh_from_db()
+        booked = list(Booking.objects.filter(departure=departure).values_list('people_count', flat=True))
+        self.assertEqual(departure.seats_available, 0)
+        self.assertEqual(sum(booked), self.CAPACITY)
+        self.assertEqual(sorted(booked), sorted(accepted))
+        self.assertEqual(unexpected, [])
+        throughput = len(accepted) / elapsed
+        # Порог с большим запасом: тест ловит многократно замедленные брони, а не замеряет железо
+        self.assertGreater(throughput, 5, f'{len(accepted)} bookings in {elapsed:.2f}s')
+
+
+class IdempotencyKeyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('traveler', password='x')
+        cls.route = Route.objects.create(title='Tour', description='Tour', duration_days=3,
+                                         budget_range='$200', difficulty='Easy')
+        cls.departure = Departure.objects.create(route=cls.route, date='2026-07-01', capacity=3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def book(self, key, people=2, **headers):
+        return self.client.post('/api/bookings/', {'route': self.route.pk, 'date': '2026-07-01', 'people_count': people},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key, **headers)
+
+    def test_retry_replays_response_without_new_booking(self):
+        first = self.book('key-1')
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as captured:
+            retry = self.book('key-1')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        # Только ключ: ни брони, ни выезда повтор не читает и не пишет
+        self.assertFalse([q for q in captured if 'api_booking' in q['sql'] or 'api_departure' in q['sql']])
+        self.assertEqual(Booking.objects.count(), 1)
+        self.departure.refresh_from_db()
+        self.assertEqual(self.departure.seats_available, 1)
+
+        # Без ключа и с новым ключом — обычные запросы
+        self.assertEqual(self.book('key-2').status_code, 409)
+        self.assertEqual(self.client.post('/api/bookings/', {'route': self.route.pk, 'date': '2026-08-01'}).status_code, 201)
+
+    def test_key_reused_with_different_request(self):
+        self.book('key-1')
+        response = self.book('key-1', people=1)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.book('key-1', people=1)
+        self.client.force_authenticate(User.objects.create_user('other', password='x'))
+        response = self.book('key-1', people=1)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_pay_is_replayed(self):
+        booking_id = self.book('key-1').json()['id']
+        url = f'/api/bookings/{booking_id}/pay/'
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1').status_code, 200)
+        with mock.patch.object(inventory, 'pay') as pay:
+            response = self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')
+        pay.assert_not_called()
+        self.assertEqual(response.json()['booking_status'], 'paid')
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='x' * 300).status_code, 400)
+
+    def test_server_error_releases_key(self):
+        with mock.patch.object(inventory, 'take_seats', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.book('key-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.book('key-1').status_code, 201)
+
+    def test_expired_keys(self):
+        self.book('key-1', people=1)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=idempotency.IDEMPOTENCY_KEY_TTL_HOURS + 1))
+        # Просроченный, но еще не удаленный ключ больше не защищает от повтора
+        response = self.book('key-1', people=1)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Booking.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(hours=idempotency.IDEMPOTENCY_KEY_TTL_HOURS + 1))
+        output = StringIO()
+        call_command('expire_idempotency_keys', stdout=output)
+        self.assertIn('Deleted 1 idempotency keys', output.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
@@ -0,0 +1,184 @@
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Разбивка времени запроса: SQL (число запросов и время), сериализация, внешние вызовы
+# (OpenAI). Счетчики собираются всегда — это пара perf_counter() на SQL-запрос.
+# Тексты SQL (для поиска повторяющихся запросов, N+1) запоминаются только у доли
+# запросов REQUEST_TIMING_SQL_SAMPLE_RATE.
+# Персонал получает заголовок Server-Timing (виден во вкладке Network браузера),
+# запросы дольше SLOW_REQUEST_MS пишутся в лог 'api.timing'
+REQUEST_TIMING_ENABLED = getattr(settings, 'REQUEST_TIMING_ENABLED', True)
+SQL_SAMPLE_RATE = getattr(settings, 'REQUEST_TIMING_SQL_SAMPLE_RATE', 0.1)
+SLOW_REQUEST_MS = getattr(settings, 'SLOW_REQUEST_MS', 1000)
+# Сколько повторяющихся SQL показывать в логе медленного запроса
+TOP_DUPLICATES = 3
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'db_count', 'db_time', 'serialize_time', 'external_time', 'statements', 'open_spans')
+
+    def __init__(self, sample_sql=False):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.external_time = 0.0
+        # {sql: [число выполнений, время]} — только у выборки запросов
+        self.statements = {} if sample_sql else None
+        self.open_spans = set()
+
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def duplicates(self, top=TOP_DUPLICATES):
+        # -> [(sql, число, время)] для запросов, выполненных больше одного раза
+        if not self.statements:
+            return []
+        repeated = [(sql, count, spent) for sql, (count, spent) in self.statements.items() if count > 1]
+        repeated.sort(key=lambda item: (-item[1], -item[2]))
+        return repeated[:top]
+
+    def server_timing(self):
+        # Время сериализации и внешних вызовов — без SQL, выполненного внутри них
+        total = self.total_time()
+        parts = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'external;dur={self.external_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        return ', '.join(parts)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        spent = time.perf_counter() - started
+        metrics.db_count += 1
+        metrics.db_time += spent
+        if metrics.statements is not None:
+            # В sql параметры еще не подставлены: одинаковый текст — один и тот же запрос
+            entry = metrics.statements.get(sql)
+            if entry is None:
+                metrics.statements[sql] = [1, spent]
+            else:
+                entry[0] += 1
+                entry[1] += spent
+
+
+@receiver(connection_created)
+def _install_wrapper(sender, connection, **kwargs):
+    # Обертка ставится один раз на соединение и ничего не делает вне запроса
+    if REQUEST_TIMING_ENABLED and _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class span:
+    # with span('serialize'): ... / with span('external'): ...
+    # Вложенные участки того же вида не считаются дважды
+    __slots__ = ('kind', 'metrics', 'started', 'db_before')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.metrics = None
+
+    def __enter__(self):
+        metrics = _current.get()
+        if metrics is None or self.kind in metrics.open_spans:
+            return self
+        metrics.open_spans.add(self.kind)
+        self.metrics = metrics
+        self.db_before = metrics.db_time
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        if metrics is None:
+            return False
+        spent = time.perf_counter() - self.started - (metrics.db_time - self.db_before)
+        attribute = f'{self.kind}_time'
+        setattr(metrics, attribute, getattr(metrics, attribute) + spent)
+        metrics.open_spans.discard(self.kind)
+        self.metrics = None
+        return False
+
+
+class TimedSerializerMixin:
+    # Время to_representation попадает в serialize (для many=True — сумма по объектам)
+    def to_representation(self, instance):
+        with span('serialize'):
+            return super().to_representation(instance)
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not REQUEST_TIMING_ENABLED:
+            return self.get_response(request)
+        metrics = RequestMetrics(sample_sql=random.random() < SQL_SAMPLE_RATE)
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        if not REQUEST_TIMING_ENABLED:
+            return await self.get_response(request)
+        metrics = RequestMetrics(sample_sql=random.random() < SQL_SAMPLE_RATE)
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        # request.user может быть ленивым и сходить в БД за сессией — только из потока
+        await sync_to_async(self.finish)(request, response, metrics)
+        return response
+
+    def finish(self, request, response, metrics):
+        # Потоковый ответ (SSE ИИ-гида) еще не отдан: его время здесь неполное
+        if getattr(response, 'streaming', False):
+            return
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['Server-Timing'] = metrics.server_timing()
+
+        total_ms = metrics.total_time() * 1000
+        if total_ms < SLOW_REQUEST_MS:
+            return
+        lines = [
+            f'Slow request {request.method} {request.get_full_path()} -> {response.status_code}: '
+            f'{total_ms:.0f} ms, db {metrics.db_time * 1000:.0f} ms / {metrics.db_count} queries, '
+            f'serialize {metrics.serialize_time * 1000:.0f} ms, external {metrics.external_time * 1000:.0f} ms'
+        ]
+        for sql, count, spent in metrics.duplicates():
+            lines.append(f'  {count}x ({spent * 1000:.0f} ms) {sql[:300]}')
+        logger.warning('\n'.join(lines))
@@ -2,9 +2,10 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 #from .views import AttractionViewSet, ReviewViewSet, RegisterView ,RouteViewSet, CategoryViewSet, RegionViewSet, UserProfileViewSet
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .ai import ask_stream
 from .views import (
     AttractionViewSet, ReviewViewSet, RegisterView, RouteViewSet, 
-    CategoryViewSet, RegionViewSet, UserProfileViewSet, AdminStatsView, BookingViewSet, AIChatViewSet
+    CategoryViewSet, RegionViewSet, UserProfileViewSet, AdminStatsView, BookingViewSet, AIChatViewSet, SearchView
 )
 router = DefaultRouter()
 router.register(r'attractions', AttractionViewSet)
@@ -17,10 +18,13 @@ router.register(r'bookings', BookingViewSet, basename='booking')
 router.register(r'ai', AIChatViewSet, basename='ai')
 
 urlpatterns = [
+    # Потоковый ответ ИИ (SSE), асинхронный — запускать под ASGI
+    path('ai/ask/stream/', ask_stream, name='ai_ask_stream'),
     path('', include(router.urls)),
     # Эндпоинты для аутентификации (Login)
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/register/', RegisterView.as_view(), name='auth_register'),
     path('admin/stats/', AdminStatsView.as_view(), name='admin_stats'),
+    path('search/', SearchView.as_view(), name='search'),
 ]
\ No newline at end of file
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Attraction, Route
+from .timing import span
+
+# Векторный индекс для контекста ИИ-гида: все активные достопримечательности и маршруты
+# лежат в памяти процесса одной матрицей (строки нормированы), поиск — одно умножение
+# матрицы на вектор вопроса (косинусная близость) и top-k.
+# Сохранения в этом процессе обновляют индекс после COMMIT в фоновом потоке (api/signals.py,
+# schedule), изменения из других
+# процессов подхватываются перестройкой раз в INDEX_MAX_AGE секунд. Перестройка идет в
+# фоновом потоке (запрос ищет по текущей матрице и не ждет) и заново считает векторы
+# только тех документов, текст которых изменился (sha1 текста)
+AI_EMBEDDER = getattr(settings, 'AI_EMBEDDER', 'api.vectors.HashingEmbedder')
+INDEX_MAX_AGE = getattr(settings, 'AI_INDEX_MAX_AGE', 300)
+# Сколько текстов уходит в один запрос к API эмбеддингов (у OpenAI предел — 2048 текстов
+# и 300 тыс. токенов на запрос)
+EMBEDDING_BATCH_SIZE = getattr(settings, 'AI_EMBEDDING_BATCH_SIZE', 256)
+# Ниже этого порога совпадение считается случайным и в контекст не попадает
+MIN_SCORE = getattr(settings, 'AI_INDEX_MIN_SCORE', 0.1)
+# False — обновлять индекс сразу в сигнале, внутри транзакции сохранения (тесты)
+INDEX_ASYNC = getattr(settings, 'AI_INDEX_ASYNC', True)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# --- Эмбеддеры: embed(texts) -> np.ndarray (len(texts), dim), строки нормированы ---
+
+class HashingEmbedder:
+    # Работает офлайн и без обучения: слова и их символьные триграммы хэшируются в
+    # фиксированное число измерений. Триграммы сближают формы слова ("lake" / "lakes",
+    # "озеро" / "озера"), поэтому вопрос целым предложением находит нужные места
+    dim = 1024
+    trigram_weight = 0.5
+
+    def _features(self, text):
+        for word in _WORD_RE.findall(text.lower()):
+            yield word, 1.0
+            padded = f'#{word}#'
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], self.trigram_weight
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                # crc32, а не hash(): значение не должно зависеть от процесса
+                bucket = zlib.crc32(feature.encode())
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                matrix[row, bucket % self.dim] += sign * weight
+        return _normalize(matrix)
+
+
+class OpenAIEmbedder:
+    # Эмбеддинги OpenAI: AI_EMBEDDER = 'api.vectors.OpenAIEmbedder'
+    model = getattr(settings, 'AI_EMBEDDING_MODEL', 'text-embedding-3-small')
+
+    def embed(self, texts):
+        from .ai import get_client
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            with span('external'):
+                response = get_client().embeddings.create(
+                    model=self.model, input=texts[start:start + EMBEDDING_BATCH_SIZE],
+                )
+            vectors.extend(item.embedding for item in response.data)
+        return _normalize(np.array(vectors, dtype=np.float32))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+# --- Тексты документов ---
+
+def attraction_document(attraction):
+    return ' '.join([
+        attraction.name, attraction.region.name, attraction.category.name, attraction.description or '',
+    ])
+
+
+def route_document(route):
+    stops = ' '.join(f'{stop.title} {stop.description}' for stop in route.stops.all())
+    return ' '.join([route.title, route.description, route.difficulty, stops])
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode()).digest()
+
+
+def _attraction_documents(queryset):
+    queryset = queryset.filter(status='active').select_related('region', 'category')
+    return {('attraction', obj.pk): attraction_document(obj) for obj in queryset}
+
+
+def _route_documents(queryset):
+    return {('route', obj.pk): route_document(obj) for obj in queryset.prefetch_related('stops')}
+
+
+# --- Индекс ---
+
+class VectorIndex:
+
+    def __init__(self, embedder=None):
+        self._embedder = embedder
+        self._lock = threading.Lock()
+        self.clear()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = import_string(AI_EMBEDDER)()
+        return self._embedder
+
+    def clear(self):
+        with self._lock:
+            self._keys = []          # строка матрицы -> ('attraction' | 'route', pk)
+            self._rows = {}          # ('attraction' | 'route', pk) -> строка матрицы
+            self._digests = {}       # ('attraction' | 'route', pk) -> sha1 текста документа
+            self._matrix = None
+            self._built_at = None
+            self._rebuilding = False
+            # Номер последнего инкрементального изменения и номер изменения каждого ключа:
+            # build() по ним узнает, что поменялось, пока он считал векторы
+            self._version = 0
+            self._touched = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def build(self):
+        with self._lock:
+            started = self._version
+        documents = _attraction_documents(Attraction.objects.all())
+        documents.update(_route_documents(Route.objects.all()))
+        keys = list(documents)
+        digests = {key: _digest(documents[key]) for key in keys}
+        # Векторы документов с прежним текстом берем из текущей матрицы
+        with self._lock:
+            reused = {
+                key: self._matrix[self._rows[key]]
+                for key in keys if key in self._rows and self._digests.get(key) == digests[key]
+            }
+        changed = [key for key in keys if key not in reused]
+        vectors = dict(zip(changed, self.embedder.embed([documents[key] for key in changed])))
+        entries = {key: (digests[key], reused[key] if key in reused else vectors[key]) for key in keys}
+        with self._lock:
+            # refresh/remove, сделанные во время перестройки, новее прочитанного ею:
+            # берем их результат из текущей матрицы, а не затираем
+            for key, version in self._touched.items():
+                if version <= started:
+                    continue
+                row = self._rows.get(key)
+                if row is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = (self._digests[key], self._matrix[row])
+            self._touched = {key: version for key, version in self._touched.items() if version > started}
+            keys = list(entries)
+            digests = {key: digest for key, (digest, _) in entries.items()}
+            matrix = np.array([vector for _, vector in entries.values()], dtype=np.float32)
+            self._keys = keys
+            self._rows = {key: row for row, key in enumerate(keys)}
+            self._digests = digests
+            self._matrix = matrix
+            self._built_at = time.monotonic()
+        return len(changed)
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Vector index rebuild failed')
+        finally:
+            self._rebuilding = False
+            # Поток разовый — его соединение с БД больше не понадобится
+            connection.close()
+
+    def _ensure_built(self):
+        # Первый поиск процесса строит индекс сразу, дальше устаревший индекс
+        # перестраивается в фоне, а поиск идет по текущей матрице
+        if self._built_at is None:
+            self.build()
+            return
+        if time.monotonic() - self._built_at <= INDEX_MAX_AGE:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name='vector-index', daemon=True).start()
+
+    # Инкрементальные обновления. Пока индекс не построен, обновлять нечего:
+    # первая выборка все равно прочитает актуальные данные
+
+    def refresh_attractions(self, queryset):
+        # Индекс еще не построен — документы не нужны, build() прочитает все сам
+        if self._built_at is not None:
+            self._refresh('attraction', queryset, _attraction_documents(queryset))
+
+    def refresh_routes(self, queryset):
+        if self._built_at is not None:
+            self._refresh('route', queryset, _route_documents(queryset))
+
+    def _refresh(self, kind, queryset, documents):
+        if self._built_at is None:
+            return
+        # Записи из queryset, которых нет в documents (удалены, сняты с публикации), убираем
+        stale = [(kind, pk) for pk in queryset.values_list('pk', flat=True) if (kind, pk) not in documents]
+        self.remove(stale)
+        keys = list(documents)
+        if not keys:
+            return
+        vectors = self.embedder.embed([documents[key] for key in keys])
+        with self._lock:
+            self._version += 1
+            new_rows = []
+            for key, vector in zip(keys, vectors):
+                self._touched[key] = self._version
+                self._digests[key] = _digest(documents[key])
+                row = self._rows.get(key)
+                if row is None:
+                    new_rows.append(vector)
+                    self._rows[key] = len(self._keys)
+                    self._keys.append(key)
+                else:
+                    self._matrix[row] = vector
+            if new_rows:
+                new_rows = np.array(new_rows)
+                self._matrix = np.vstack([self._matrix, new_rows]) if len(self._matrix) else new_rows
+
+    def remove(self, keys):
+        with self._lock:
+            self._version += 1
+            for key in keys:
+                self._touched[key] = self._version
+                row = self._rows.pop(key, None)
+                self._digests.pop(key, None)
+                if row is None:
+                    continue
+                # На место удаленной строки ставим последнюю — без сдвига всей матрицы
+                last = len(self._keys) - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._keys[row] = self._keys[last]
+                    self._rows[self._keys[row]] = row
+                self._keys.pop()
+                self._matrix = self._matrix[:last]
+
+    def search(self, query, k=3, min_score=MIN_SCORE):
+        # -> [(kind, pk, score), ...] по убыванию близости
+        self._ensure_built()
+        vector = self.embedder.embed([query])[0]
+        with self._lock:
+            if not self._keys:
+                return []
+            scores = self._matrix @ vector
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (*self._keys[row], float(scores[row]))
+                for row in top if scores[row] >= min_score
+            ]
+
+
+vector_index = VectorIndex()
+
+
+# --- Обновления из сигналов ---
+
+def _run(method, args):
+    try:
+        method(*args)
+    except Exception:
+        logger.exception('Vector index update failed')
+    finally:
+        # Поток пула держит свое соединение с БД — закрываем, если оно устарело
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Один поток: обновления применяются в порядке коммитов
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vector-index-update')
+        return _executor
+
+
+def schedule(method, *args):
+    # Вызывается из сигналов: с OpenAIEmbedder обновление — это запрос к API, поэтому
+    # оно идет после COMMIT в фоновом потоке, а не внутри транзакции сохранения
+    if INDEX_ASYNC:
+        transaction.on_commit(lambda: _get_executor().submit(_run, method, args))
+    else:
+        method(*args)
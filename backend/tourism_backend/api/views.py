@@ -1,23 +1,38 @@
+import logging
+
 from rest_framework import viewsets, permissions, status, filters, generics
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django_filters import rest_framework as django_filters # Импортируем фильтры
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import Attraction, Review, Route, Category, Region, UserProfile
+from .models import Attraction, Review, Route, RouteStop, Category, Region, UserProfile, Conversation
 from .serializers import (
-    AttractionSerializer, ReviewSerializer, RouteSerializer,
+    AttractionSerializer, ReviewSerializer, RouteSerializer, RouteListSerializer,
     CategorySerializer, RegionSerializer, UserProfileSerializer,
-    RegisterSerializer, BookingSerializer
+    RegisterSerializer, BookingSerializer, FavoriteCardSerializer, NearbyAttractionSerializer,
+    DepartureSerializer,
 )
-import openai
-import os
 from django.conf import settings
-from .models import Booking
+from .models import Booking, Departure
 from .serializers import BookingSerializer
 from django.db.models import Q 
+from .search import FullTextSearchFilter, search_attractions, search_routes
+from .pagination import CursorOrPageNumberPagination, SublistCursorPagination
+from .cache import CachedCatalogMixin, bump_generation
+from .counters import pending_views, record_view, visitor_key
+from . import ai, catalog_io, conversations, geo, inventory, route_optimizer
+from .ai_cache import reply_cache
+from .idempotency import idempotent
+
+logger = logging.getLogger(__name__)
 
 class IsAdminOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -35,49 +50,190 @@ class AttractionFilter(django_filters.FilterSet):
         model = Attraction
         fields = ['region', 'category', 'status']
 
-class AttractionViewSet(viewsets.ModelViewSet):
+# Максимум id в одном запросе favorite_status
+MAX_FAVORITE_STATUS_IDS = 500
+# /attractions/nearby/: радиус по умолчанию и максимальный (км), максимум результатов
+NEARBY_DEFAULT_RADIUS_KM = 10
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_DEFAULT_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+
+def annotate_reviews_count(queryset):
+    # Число отзывов — коррелированным подзапросом по индексу (attraction, status, ...):
+    # он выполняется только для строк страницы, после ORDER BY/LIMIT. annotate(Count('reviews'))
+    # делал JOIN и GROUP BY по всему каталогу ради 10 строк.
+    # search_vector в карточке не нужен — не читаем его
+    reviews = (
+        Review.objects.filter(attraction=OuterRef('pk')).order_by()
+        .values('attraction').annotate(total=Count('pk')).values('total')
+    )
+    return queryset.annotate(reviews_count=Coalesce(Subquery(reviews), 0)).defer('search_vector')
+
+class AttractionViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Attraction.objects.all().order_by('-id') # Добавляем сортировку, чтобы убрать Warning в консоли
     serializer_class = AttractionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    # Курсорная пагинация по -id (индекс attraction_status_id_idx), ?page= — для админки
+    pagination_class = CursorOrPageNumberPagination
+    cursor_ordering = '-id'
     
     # Подключаем наш фильтр
-    filter_backends = [django_filters.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # ?search= — полнотекстовый поиск с ранжированием (api/search.py)
+    filter_backends = [django_filters.DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter]
     filterset_class = AttractionFilter 
     
-    search_fields = ['name', 'description']
     ordering_fields = ['name', 'visitors_count']
 
     def get_queryset(self):
-        if self.request.user.is_staff:
-            return Attraction.objects.all().order_by('-id')
-        return Attraction.objects.filter(status='active').order_by('-id')
+        queryset = Attraction.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(status='active')
+        # Регион и категория приходят одним JOIN, количество отзывов — подзапросом в том же
+        # SELECT, поэтому число запросов не зависит от размера страницы
+        queryset = annotate_reviews_count(queryset.select_related('region', 'category'))
+        return queryset.order_by('-id')
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        # Считаем и ответы из кэша, и 304. Запись в БД идет пачками (api/counters.py),
+        # а не UPDATE на каждый запрос
+        if response.status_code in (200, 304):
+            record_view(int(self.kwargs[self.lookup_field]), visitor_key(request))
+        return response
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def toggle_favorite(self, request, pk=None):
-        attraction = self.get_object()
-        user = request.user
-        if user in attraction.favorited_by.all():
-            attraction.favorited_by.remove(user)
-            return Response({'status': 'removed'})
-        else:
-            attraction.favorited_by.add(user)
-            return Response({'status': 'added'})
+        # Легкий запрос вместо get_object(): нам нужен только факт существования
+        attractions = Attraction.objects.only('id')
+        if not request.user.is_staff:
+            attractions = attractions.filter(status='active')
+        attraction = get_object_or_404(attractions, pk=pk)
+
+        # Работаем напрямую с промежуточной таблицей: DELETE/INSERT по уникальному
+        # индексу (attraction_id, user_id), не загружая всех, кто добавил место в избранное
+        Favorite = Attraction.favorited_by.through
+        with transaction.atomic():
+            deleted, _ = Favorite.objects.filter(attraction_id=attraction.pk, user_id=request.user.pk).delete()
+            if deleted:
+                self._shift_favorites_count(attraction, -1)
+                return Response({'status': 'removed'})
+            try:
+                with transaction.atomic():
+                    Favorite.objects.create(attraction_id=attraction.pk, user_id=request.user.pk)
+            except IntegrityError:
+                # Параллельный запрос уже добавил эту запись
+                return Response({'status': 'added'})
+            self._shift_favorites_count(attraction, 1)
+        return Response({'status': 'added'})
+
+    @staticmethod
+    def _shift_favorites_count(attraction, delta):
+        # .update() не шлет сигналов, поэтому кэш каталога (страницы и ETag
+        # с favorites_count) сбрасываем сами — как это делает m2m_changed
+        Attraction.objects.filter(pk=attraction.pk).update(favorites_count=F('favorites_count') + delta)
+        bump_generation()
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def favorite_status(self, request):
+        # /api/attractions/favorite_status/?ids=1,2,3 -> {"favorited": [1, 3]} одним запросом,
+        # чтобы список мог нарисовать "сердечки" без запроса на каждую карточку
+        try:
+            ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be a comma-separated list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > MAX_FAVORITE_STATUS_IDS:
+            return Response({'error': f'Too many ids (max {MAX_FAVORITE_STATUS_IDS})'}, status=status.HTTP_400_BAD_REQUEST)
+
+        favorited = Attraction.favorited_by.through.objects.filter(
+            user_id=request.user.pk, attraction_id__in=ids
+        ).values_list('attraction_id', flat=True)
+        return Response({'favorited': sorted(favorited)})
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        # /api/attractions/nearby/?lat=43.2&lon=76.9&radius_km=10&limit=20 -> ближайшие активные места,
+        # отсортированные по расстоянию. Поиск по geohash-ячейкам (api/geo.py)
+        params = request.query_params
+        try:
+            lat, lon = float(params['lat']), float(params['lon'])
+            radius_km = float(params.get('radius_km', NEARBY_DEFAULT_RADIUS_KM))
+            limit = int(params.get('limit', NEARBY_DEFAULT_LIMIT))
+        except (KeyError, ValueError):
+            return Response({'error': 'lat and lon are required; radius_km and limit must be numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({'error': 'lat must be in [-90, 90], lon in [-180, 180]'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+            return Response({'error': f'radius_km must be in (0, {NEARBY_MAX_RADIUS_KM}]'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= NEARBY_MAX_LIMIT:
+            return Response({'error': f'limit must be in [1, {NEARBY_MAX_LIMIT}]'}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = geo.nearby(Attraction.objects.filter(status='active'), lat, lon, radius_km, limit)
+        attractions = Attraction.objects.select_related('region', 'category').in_bulk([pk for pk, _ in found])
+        results = []
+        for pk, distance in found:
+            attraction = attractions[pk]
+            attraction.distance_km = distance
+            results.append(attraction)
+        return Response({'results': NearbyAttractionSerializer(results, many=True, context={'request': request}).data})
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        # /api/attractions/export/?type=csv&status=active -> весь каталог файлом (api/catalog_io.py).
+        # Строки отдаются по мере чтения из БД — память не растет с размером каталога
+        file_format = request.query_params.get('type', 'ndjson')
+        if file_format not in catalog_io.FORMATS:
+            return Response({'error': f'type must be one of: {", ".join(catalog_io.FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = AttractionFilter(request.query_params, queryset=Attraction.objects.all()).qs
+        response = StreamingHttpResponse(
+            catalog_io.export_lines(queryset, file_format), content_type=catalog_io.FORMATS[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="attractions.{file_format}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAdminUser])
+    def import_catalog(self, request):
+        # multipart: file=<файл выгрузки>, create_missing=true — создать неизвестные регионы/категории,
+        # dry_run=true — только проверить. Записи с id (или с тем же названием в том же регионе)
+        # обновляются, остальные создаются
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('type') or catalog_io.guess_format(upload.name)
+        if file_format not in catalog_io.FORMATS:
+            return Response({'error': f'type must be one of: {", ".join(catalog_io.FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = catalog_io.import_rows(
+                catalog_io.read_rows(upload, file_format),
+                create_missing=request.data.get('create_missing') in (True, 'true', '1', 1),
+                dry_run=request.data.get('dry_run') in (True, 'true', '1', 1),
+            )
+        except ValueError as error:
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
 
 class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all().order_by('-created_at')
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = CursorOrPageNumberPagination
+    cursor_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
+        # Имя автора и название места — JOIN'ом, а не запросом на каждый отзыв
+        reviews = Review.objects.select_related('author', 'attraction')
+
         # 1. Если админ - видит всё
         if self.request.user.is_staff:
-            return Review.objects.all().order_by('-created_at')
+            return reviews.order_by('-created_at')
         
         # Получаем ID достопримечательности из запроса
         attraction_id = self.request.query_params.get('attraction')
         
         # Базовый запрос
-        queryset = Review.objects.all()
+        queryset = reviews
 
         if attraction_id:
             queryset = queryset.filter(attraction_id=attraction_id)
@@ -114,17 +270,126 @@ class ReviewViewSet(viewsets.ModelViewSet):
         review.save()
         return Response({'status': f'Review {status_val}'})
 
-class RouteViewSet(viewsets.ModelViewSet):
+def annotate_route_list(queryset):
+    # Все, что нужно карточке маршрута, — одним запросом: число остановок и дней
+    # через COUNT, картинка первой остановки — коррелированным подзапросом
+    first_image = (
+        RouteStop.objects.filter(route=OuterRef('pk')).exclude(image='')
+        .order_by('day_number', 'id').values('image')[:1]
+    )
+    return queryset.annotate(
+        stops_count=Count('stops'),
+        days=Count('stops__day_number', distinct=True),
+        first_image=Subquery(first_image),
+    )
+
+class RouteViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Route.objects.all().order_by('id')
     serializer_class = RouteSerializer
     permission_classes = [IsAdminOrReadOnly]
+    filter_backends = [FullTextSearchFilter]
+
+    def get_queryset(self):
+        queryset = Route.objects.all().order_by('id')
+        if self.action == 'list':
+            return annotate_route_list(queryset)
+        # Детальная страница: все остановки одним prefetch-запросом
+        return queryset.prefetch_related('stops')
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return RouteListSerializer
+        return RouteSerializer
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def optimize(self, request, pk=None):
+        # Предлагает порядок остановок с самой короткой дорогой (api/route_optimizer.py).
+        # {"apply": true} — сохраняет его и пересчитывает distance_km
+        route = get_object_or_404(Route, pk=pk)
+        stops = list(route.stops.select_related('attraction').order_by('day_number', 'id'))
+        located = [
+            index for index, stop in enumerate(stops)
+            if stop.attraction and stop.attraction.latitude is not None and stop.attraction.longitude is not None
+        ]
+        if len(located) < 2:
+            return Response({'error': 'At least two stops must be linked to attractions with coordinates'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        order, distance_km, current_km = route_optimizer.optimize(
+            [stops[index].attraction.latitude for index in located],
+            [stops[index].attraction.longitude for index in located],
+        )
+        # Остановки без координат остаются на своих местах, остальные занимают
+        # освободившиеся места в новом порядке. Номера дней те же, что были, по возрастанию:
+        # если в один день несколько остановок, внутри дня порядок задает id
+        days = [stop.day_number for stop in stops]
+        proposed = list(stops)
+        for slot, position in zip(located, order):
+            proposed[slot] = stops[located[position]]
+
+        apply = request.data.get('apply') in (True, 'true', '1', 1)
+        if apply:
+            changed = []
+            for stop, day in zip(proposed, days):
+                if stop.day_number != day:
+                    stop.day_number = day
+                    changed.append(stop)
+            with transaction.atomic():
+                RouteStop.objects.bulk_update(changed, ['day_number'])
+                route.distance_km = round(distance_km)
+                # post_save маршрута обновит поисковый вектор, индекс ИИ-гида и кэш каталога
+                route.save(update_fields=['distance_km'])
+
+        return Response({
+            'stops': [
+                {'id': stop.id, 'title': stop.title, 'day_number': day, 'attraction': stop.attraction_id}
+                for stop, day in zip(proposed, days)
+            ],
+            'distance_km': round(distance_km, 1),
+            'current_distance_km': round(current_km, 1),
+            'applied': apply,
+        })
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def departures(self, request, pk=None):
+        # Ближайшие выезды маршрута с остатком мест. Не кэшируется: остаток меняется с каждой бронью
+        route = get_object_or_404(Route.objects.only('id'), pk=pk)
+        departures = Departure.objects.filter(route=route, date__gte=timezone.localdate()).order_by('date')
+        return Response(DepartureSerializer(departures, many=True).data)
+
+class SearchView(APIView):
+    # Общий поиск по достопримечательностям и маршрутам: /api/search/?q=...&limit=...
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not query:
+            return Response({'query': query, 'attractions': [], 'routes': []})
+
+        attractions = annotate_reviews_count(Attraction.objects.select_related('region', 'category'))
+        if not request.user.is_staff:
+            attractions = attractions.filter(status='active')
+        attractions = search_attractions(attractions, query)[:limit]
+        routes = search_routes(annotate_route_list(Route.objects.all()), query)[:limit]
+
+        context = {'request': request}
+        return Response({
+            'query': query,
+            'attractions': AttractionSerializer(attractions, many=True, context=context).data,
+            'routes': RouteListSerializer(routes, many=True, context=context).data,
+        })
+
+class CategoryViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all().order_by('name')
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
 
-class RegionViewSet(viewsets.ModelViewSet):
+class RegionViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Region.objects.all().order_by('name')
     serializer_class = RegionSerializer
     permission_classes = [IsAdminOrReadOnly]
@@ -143,19 +408,35 @@ class UserProfileViewSet(viewsets.ModelViewSet): # Было ReadOnlyModelViewSet
         profile, _ = UserProfile.objects.get_or_create(user=request.user)
 
         if request.method == 'GET':
+            profile.user = request.user  # Уже загружен аутентификацией, не запрашиваем повторно
             serializer = self.get_serializer(profile)
             data = serializer.data
-            
-            # 1. Добавляем избранное
-            favorites = request.user.favorites.all()
-            data['favorites'] = AttractionSerializer(favorites, many=True).data
-            
-            # 2. Добавляем бронирования (ВОТ ЭТОТ КОД РАНЬШЕ БЫЛ НЕДОСТУПЕН)
-            # Используем related_name='bookings', который мы проверили в моделях
-            bookings = request.user.bookings.all().order_by('-created_at')
-            data['bookings'] = BookingSerializer(bookings, many=True).data
-
-            # 3. И только теперь возвращаем полный ответ
+            context = self.get_serializer_context()
+
+            # Число запросов фиксировано: по одному COUNT и одной странице на каждый список.
+            # Списки листаются независимо: ?favorites_cursor=... и ?bookings_cursor=...
+
+            # 1. Избранное — компактные карточки, новые добавления сверху.
+            # Пагинируем промежуточную таблицу, регион и категорию берем JOIN'ом
+            favorites = Attraction.favorited_by.through.objects.filter(user=request.user)
+            data['favorites'] = SublistCursorPagination('favorites', ordering='-id').paginate(
+                favorites.select_related('attraction__region', 'attraction__category'),
+                request,
+                lambda page: FavoriteCardSerializer(
+                    [favorite.attraction for favorite in page], many=True, context=context
+                ).data,
+                count=favorites.count(),
+            )
+
+            # 2. Бронирования, route.title — через select_related
+            bookings = request.user.bookings.all()
+            data['bookings'] = SublistCursorPagination('bookings', ordering=('-created_at', '-id')).paginate(
+                bookings.select_related('route'),
+                request,
+                lambda page: BookingSerializer(page, many=True, context=context).data,
+                count=bookings.count(),
+            )
+
             return Response(data)
         
         elif request.method in ['PATCH', 'PUT']:
@@ -178,8 +459,16 @@ class AdminStatsView(APIView):
             'total_users': UserProfile.objects.count(),
             'total_attractions': Attraction.objects.count(),
             'pending_reviews': Review.objects.filter(status='pending').count(),
-            'total_page_views': 89342,
-            'popular_destinations': Attraction.objects.order_by('-visitors_count')[:5].values('name', 'visitors_count')
+            # Плюс просмотры, которые еще не сброшены в БД этим процессом
+            'total_page_views': (Attraction.objects.aggregate(total=Sum('page_views'))['total'] or 0) + pending_views(),
+            'popular_destinations': Attraction.objects.order_by('-visitors_count')[:5].values('name', 'visitors_count'),
+            # Кэш ответов ИИ-гида и очередь запросов к модели (счетчики этого процесса)
+            'ai_cache': reply_cache.stats(),
+            'ai_upstream': ai.gate.stats(),
+            'ai_tokens': Conversation.objects.aggregate(
+                conversations=Count('id'), prompt_tokens=Sum('prompt_tokens'),
+                completion_tokens=Sum('completion_tokens'),
+            ),
         })
     
 # booking
@@ -188,10 +477,23 @@ class AdminStatsView(APIView):
 class BookingViewSet(viewsets.ModelViewSet):
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorOrPageNumberPagination
+    cursor_ordering = ('-created_at', '-id')
+    # Без PUT/PATCH: смена даты или числа людей разошлась бы с занятыми местами
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
 
     def get_queryset(self):
-        # Пользователь видит только свои брони
-        return Booking.objects.filter(user=self.request.user)
+        # Пользователь видит только свои брони (route.title — JOIN'ом)
+        return Booking.objects.filter(user=self.request.user).select_related('route')
+
+    # Повтор с тем же заголовком Idempotency-Key получает сохраненный ответ (api/idempotency.py)
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except inventory.SoldOut as error:
+            return Response({'error': 'Not enough seats left for this date', 'seats_available': error.seats_available},
+                            status=status.HTTP_409_CONFLICT)
 
     def perform_create(self, serializer):
         # Автоматически считаем цену и привязываем юзера
@@ -203,32 +505,47 @@ class BookingViewSet(viewsets.ModelViewSet):
         # Пока возьмем заглушку: 100$ за человека
         price_per_person = 100 
         total = price_per_person * people
-        
-        serializer.save(user=self.request.user, total_price=total, status='pending')
+
+        # Места ограничены, только если на эту дату заведен выезд (api/inventory.py)
+        departure = inventory.departure_id(route.pk, serializer.validated_data['date'])
+        if departure is None:
+            serializer.save(user=self.request.user, total_price=total, status='pending')
+            return
+        with transaction.atomic():
+            serializer.save(user=self.request.user, total_price=total, status='pending',
+                            departure_id=departure, expires_at=inventory.hold_until())
+            # Последним: строка выезда заблокирована только до COMMIT. SoldOut откатит бронь
+            inventory.take_seats(departure, people)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            inventory.cancel(instance)
+            instance.delete()
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def pay(self, request, pk=None):
         booking = self.get_object()
         # ЗДЕСЬ ПОДКЛЮЧАЕТСЯ STRIPE / KASPI / EPAY
-        # Пока просто меняем статус
-        booking.status = 'paid'
-        booking.save()
+        # Пока просто меняем статус (условным UPDATE — истекшую бронь не оплатить)
+        if booking.status != 'paid' and not inventory.pay(booking):
+            if booking.status == 'pending' and booking.departure_id is not None:
+                # Срок вышел, но бронь еще не истекла — возвращаем места сейчас
+                inventory.release_expired(booking.departure_id)
+            booking.refresh_from_db(fields=['status'])
+            return Response({'error': f'Booking is {booking.status} and cannot be paid', 'booking_status': booking.status},
+                            status=status.HTTP_409_CONFLICT)
         return Response({'status': 'payment successful', 'booking_status': 'paid'})
     
 
-# Настраиваем клиента OpenAI
-# Ключ берется из переменных окружения (os.getenv) или settings
-# 1. Настройка клиента OpenAI
-# Мы создаем "пульт управления" (client), передавая ему ключ из .env файла
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 class AIChatViewSet(viewsets.ViewSet):
-    # 2. Права доступа
+    # 1. Права доступа
     # AllowAny значит, что писать в чат могут даже незарегистрированные гости
     permission_classes = [permissions.AllowAny]
 
-    # 3. Метод 'ask' (Спрашивать)
-    # Это функция, которая срабатывает, когда прилетает запрос на /api/chat/ask/
+    # 2. Метод 'ask' (Спрашивать)
+    # Срабатывает, когда прилетает запрос на /api/ai/ask/.
+    # Потоковая (SSE) асинхронная версия — /api/ai/ask/stream/, см. api/ai.py
     @action(detail=False, methods=['post'])
     def ask(self, request):
         # Получаем текст, который ввел пользователь (например, "Куда поехать в горы?")
@@ -236,175 +553,38 @@ class AIChatViewSet(viewsets.ViewSet):
         
         # Если прислали пустоту — сразу отвечаем заглушкой, не тратим деньги на ИИ
         if not user_query:
-            return Response({'reply': "Спроси меня что-нибудь!", 'recommendations': []})
+            return Response({'reply': ai.EMPTY_QUERY_REPLY, 'recommendations': []})
 
-        recommendations = [] # Сюда будем складывать карточки для фронтенда
-        context_data = ""    # А сюда — текст для "мозгов" ИИ
+        # Диалог: "conversation" — id из прошлого ответа. Без него начинается новый диалог
+        conversation = conversations.load(request.data.get('conversation'), request.user)
 
-        # --- ЭТАП 1: Поиск в твоей базе данных ---
-        # Мы ищем совпадения в базе, чтобы ИИ знал о ТВОИХ турах, а не выдумывал
-        
-        # Ищем достопримечательности (по имени, описанию, региону...)
-        attractions = Attraction.objects.filter(
-            Q(name__icontains=user_query) | 
-            Q(description__icontains=user_query) |
-            Q(region__name__icontains=user_query)
-        )[:3] # Берем только первые 3, чтобы не перегружать
-
-        # Если нашли места — добавляем их в контекст
-        if attractions.exists():
-            context_data += "Found Attractions in DB:\n"
-            for attr in attractions:
-                # Собираем данные для красивой карточки на сайте
-                img_url = request.build_absolute_uri(attr.image.url) if attr.image else ""
-                recommendations.append({
-                    'id': attr.id,
-                    'title': attr.name,
-                    'image': img_url,
-                    'type': 'attraction'
-                })
-                # Формируем текст для ИИ: "Название - Описание (первые 300 букв)"
-                desc_text = attr.description[:300] if attr.description else "No description"
-                context_data += f"- {attr.name}: {desc_text}...\n"
-
-        # (Аналогичный блок кода идет для маршрутов/Routes...)
-
-        # --- ЭТАП 2: Запрос к ИИ ---
-        
-        # Инструкция для нейросети (System Prompt)
-        # Мы говорим: "Ты гид. Используй данные из базы (context_data), чтобы ответить юзеру."
-        system_instruction = (
-            "You are a guide for TourismKZ. "
-            f"Use this DB data to answer: {context_data}"
+        # --- ЭТАП 1: Поиск в базе данных (карточки для фронтенда + контекст для ИИ) ---
+        # Заодно собираем историю диалога в пределах бюджета токенов (api/conversations.py)
+        recommendations, context, messages = ai.prepare_conversation(
+            conversation, user_query, request.build_absolute_uri
         )
 
+        # --- ЭТАП 2: Запрос к ИИ ---
+        usage = None
         try:
-            # Отправляем запрос в OpenAI
-            ai_response = client.chat.completions.create(
-                model="gpt-4o-mini", # Дешевая модель
-                messages=[
-                    {"role": "system", "content": system_instruction}, # Инструкция
-                    {"role": "user", "content": user_query}            # Вопрос юзера
-                ],
-                max_tokens=500 # Ограничение длины ответа
+            reply_text, usage = ai.answer_in_conversation(conversation, user_query, context, messages)
+        except ai.UpstreamBusy:
+            # Очередь к модели не подошла до дедлайна — просим повторить позже
+            return Response(
+                {'reply': ai.AI_BUSY_REPLY, 'recommendations': recommendations},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(ai.gate.retry_after())},
             )
-            # Достаем текст ответа из сложной структуры JSON, которую прислал OpenAI
-            reply_text = ai_response.choices[0].message.content
-        except Exception as e:
-            # Если интернет пропал или ключ неверный — не роняем сайт, а пишем ошибку в консоль
-            print(f"Error: {e}")
-            reply_text = "Ошибка связи с ИИ."
+        except Exception:
+            # Если интернет пропал или ключ неверный — не роняем сайт, а пишем ошибку в лог
+            logger.exception('AI chat request failed')
+            reply_text = ai.AI_ERROR_REPLY
 
         # --- ЭТАП 3: Ответ фронтенду ---
-        # Возвращаем JSON с текстом ответа и списком найденных карточек
+        # Возвращаем JSON с текстом ответа, списком найденных карточек и расходом токенов
         return Response({
             'reply': reply_text,
-            'recommendations': recommendations
+            'recommendations': recommendations,
+            'conversation': str(conversation.pk) if not conversation._state.adding else None,
+            'usage': usage,
         })
-
-
-
-""" class AIChatViewSet(viewsets.ViewSet):
-    permission_classes = [permissions.AllowAny]
-
-    @action(detail=False, methods=['post'])
-    def ask(self, request):
-        # 1. Получаем запрос пользователя
-        user_query = request.data.get('message', '').lower().strip()
-        
-        response_text = ""
-        recommendations = []
-
-        if not user_query:
-            return Response({'reply': "Please type something!", 'recommendations': []})
-
-        # --- ВСТАВЛЯТЬ СЮДА (НАЧАЛО) ---
-        
-        # Словарь синонимов (Маппинг намерений)
-        # Ключ = слово, которое точно есть в твоей БД (например, в Category или Region)
-        # Значение = список слов, которые может написать человек
-        keywords_map = {
-            'mountains': ['горы', 'mountain', 'hiking', 'climbing', 'peak', 'восхождение', 'хайкинг', 'альпинизм'],
-            'lakes': ['озеро', 'lake', 'water', 'swim', 'beach', 'вода', 'купаться', 'пляж', 'река'],
-            'historical': ['history', 'museum', 'monument', 'culture', 'old', 'ancient', 'история', 'музей', 'памятник'],
-            'forest': ['forest', 'trees', 'nature', 'wood', 'лес', 'природа', 'деревья'],
-            'canyon': ['canyon', 'rock', 'каньон', 'скалы', 'ущелье'],
-            'almaty': ['almaty', 'city', 'apple', 'алматы', 'город'],
-        }
-
-        # Проверяем, есть ли синоним в запросе пользователя
-        found_category = False
-        for category, synonyms in keywords_map.items():
-            if any(syn in user_query for syn in synonyms):
-                # Если нашли синоним (например "хайкинг"), меняем запрос на категорию ("mountains")
-                # Это поможет найти "Mountains" в базе, даже если слова "хайкинг" там нет
-                user_query = category 
-                found_category = True
-                break
-        
-        # --- ВСТАВЛЯТЬ СЮДА (КОНЕЦ) ---
-
-
-        # 2. Логика приветствия (если это не поиск категории)
-        greetings = ['hello', 'hi', 'привет', 'сәлем', 'hey']
-        # Если мы НЕ нашли категорию и это просто приветствие
-        if not found_category and any(word == user_query for word in greetings):
-            return Response({
-                'reply': "Hello! I am your AI Guide for Kazakhstan. Ask me about mountains, lakes, or historical places!",
-                'recommendations': []
-            })
-
-        # 3. Поиск по Достопримечательностям
-        # Теперь user_query может быть заменен на 'mountains', что точно найдется в базе
-        attractions = Attraction.objects.filter(
-            Q(name__icontains=user_query) | 
-            Q(description__icontains=user_query) |
-            Q(region__name__icontains=user_query) |
-            Q(category__name__icontains=user_query)
-        )[:3]
-
-        if attractions.exists():
-            count = attractions.count()
-            response_text += f"I found {count} place{'s' if count > 1 else ''} matching '{user_query}':\n"
-            for attr in attractions:
-                img_url = None
-                if attr.image:
-                    img_url = attr.image.url if hasattr(attr.image, 'url') else attr.image
-
-                recommendations.append({
-                    'id': attr.id,
-                    'type': 'attraction',
-                    'title': attr.name,
-                    'image': img_url,
-                    'desc': attr.category.name if attr.category else ""
-                })
-        
-        # 4. Поиск по Маршрутам
-        routes = Route.objects.filter(
-            Q(title__icontains=user_query) |
-            Q(description__icontains=user_query)
-        )[:2]
-
-        if routes.exists():
-            if response_text: 
-                response_text += "\n\nAlso, check out these tours:\n"
-            else:
-                response_text += f"I found some great tours for '{user_query}':\n"
-                
-            for route in routes:
-                recommendations.append({
-                    'id': route.id,
-                    'type': 'route',
-                    'title': route.title,
-                    'image': route.image,
-                    'desc': f"{route.duration_days} Days Tour"
-                })
-
-        # 5. Если ничего не нашли
-        if not response_text:
-            response_text = "I couldn't find anything matching that. Try searching for 'Almaty', 'National Park', or specific activities."
-
-        return Response({
-            'reply': response_text,
-            'recommendations': recommendations
-        }) """
\ No newline at end of file
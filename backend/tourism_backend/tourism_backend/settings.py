@@ -3,6 +3,7 @@
 from pathlib import Path
 import os
 from datetime import timedelta
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'django_filters',
@@ -39,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: меряет весь запрос, включая остальные middleware (api/timing.py)
+    'api.timing.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,6 +57,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:5173",
 ]
+# Idempotency-Key для брони и оплаты (api/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 
 # Настройки медиа файлов (для картинок достопримечательностей)
@@ -75,6 +82,14 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite — для локальных тестов без PostgreSQL.
+# Поиск в этом режиме работает через запасной вариант на icontains (api/search.py)
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_NAME') or BASE_DIR / 'db.sqlite3',
+    }
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -82,10 +97,73 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
     'PAGE_SIZE': 10
 }
 
+# Кэш. По умолчанию — память процесса; в продакшене укажите общий бэкенд (Redis/Memcached),
+# иначе у каждого воркера будет свое поколение каталога
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'tourism-cache'),
+    }
+}
+
+# Время жизни закэшированных ответов каталога (секунды), см. api/cache.py
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60))
+
+# Счетчики просмотров (api/counters.py): как часто сбрасывать буфер в БД (секунды)
+# и сколько разных достопримечательностей держать в буфере. Сбрасывает и фоновый поток,
+# поэтому просмотр попадает в БД не позже чем через интервал + 1 с, даже без новых
+# запросов. Это же — верхняя граница потерь при падении процесса
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.getenv('VIEW_COUNTER_FLUSH_INTERVAL', 10))
+VIEW_COUNTER_MAX_PENDING = int(os.getenv('VIEW_COUNTER_MAX_PENDING', 1000))
+VIEW_COUNTER_FLUSH_IN_BACKGROUND = os.getenv('VIEW_COUNTER_FLUSH_IN_BACKGROUND', 'True') == 'True'
+
+# ИИ-гид (api/ai.py). OPENAI_BASE_URL — для OpenAI-совместимых серверов
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+AI_MODEL = os.getenv('AI_MODEL', 'gpt-4o-mini')
+AI_MAX_TOKENS = int(os.getenv('AI_MAX_TOKENS', 500))
+# Кэш ответов ИИ (api/ai_cache.py): время жизни записи (секунды) и максимум записей (LRU)
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 60 * 60 * 6))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', 1000))
+# Шлюз запросов к модели (api/ai_upstream.py): сколько запросов идет одновременно,
+# сколько секунд можно ждать очереди, пауза после 429 (начальная и максимальная)
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 8))
+AI_QUEUE_TIMEOUT = float(os.getenv('AI_QUEUE_TIMEOUT', 15))
+AI_BACKOFF_BASE = float(os.getenv('AI_BACKOFF_BASE', 1))
+AI_BACKOFF_MAX = float(os.getenv('AI_BACKOFF_MAX', 30))
+# Память диалога (api/conversations.py): бюджет токенов одного запроса к модели
+# и сколько из него отдается под пересказ старых реплик
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', 1500))
+AI_SUMMARY_MAX_TOKENS = int(os.getenv('AI_SUMMARY_MAX_TOKENS', 200))
+# Векторный индекс контекста (api/vectors.py). HashingEmbedder работает офлайн,
+# 'api.vectors.OpenAIEmbedder' — эмбеддинги OpenAI (AI_EMBEDDING_MODEL)
+AI_EMBEDDER = os.getenv('AI_EMBEDDER', 'api.vectors.HashingEmbedder')
+AI_EMBEDDING_MODEL = os.getenv('AI_EMBEDDING_MODEL', 'text-embedding-3-small')
+AI_INDEX_MAX_AGE = int(os.getenv('AI_INDEX_MAX_AGE', 300))
+# Сколько текстов отправляется в один запрос к API эмбеддингов
+AI_EMBEDDING_BATCH_SIZE = int(os.getenv('AI_EMBEDDING_BATCH_SIZE', 256))
+AI_INDEX_MIN_SCORE = float(os.getenv('AI_INDEX_MIN_SCORE', 0.1))
+# Обновлять индекс после сохранений в фоновом потоке после коммита (False — сразу в сигнале)
+AI_INDEX_ASYNC = os.getenv('AI_INDEX_ASYNC', 'True') == 'True'
+
+# Разбивка времени запроса (api/timing.py): Server-Timing для персонала и лог медленных
+# запросов. Тексты SQL (повторы в логе) собираются только у доли запросов SQL_SAMPLE_RATE
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'True') == 'True'
+REQUEST_TIMING_SQL_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SQL_SAMPLE_RATE', 0.1))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 1000))
+
+# Уменьшенные копии фото (api/images.py): строить в фоновых потоках после коммита
+# (False — сразу в save()) и сколько потоков
+IMAGE_VARIANTS_ASYNC = os.getenv('IMAGE_VARIANTS_ASYNC', 'True') == 'True'
+IMAGE_VARIANTS_WORKERS = int(os.getenv('IMAGE_VARIANTS_WORKERS', 2))
+
+# Словарь для полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'simple')
+
 # Настройки JWT
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -110,6 +188,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tourism_backend.wsgi.application'
+# Потоковый чат (/api/ai/ask/stream/) рассчитан на ASGI: uvicorn tourism_backend.asgi:application
+ASGI_APPLICATION = 'tourism_backend.asgi.application'
 
 
 # Database
@@ -152,3 +232,9 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+# Сколько минут неоплаченная бронь держит места выезда (api/inventory.py)
+BOOKING_HOLD_MINUTES = int(os.getenv('BOOKING_HOLD_MINUTES', 15))
+
+# Сколько часов хранится ответ на запрос с Idempotency-Key (api/idempotency.py)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
@@ -1,9 +1,26 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.static import serve
+from django.utils.cache import patch_cache_control
+
+
+def serve_immutable(request, path, document_root=None):
+    # Копии фото (api/images.py) с хэшем содержимого в имени не меняются —
+    # браузер может не перепроверять их год. В продакшене то же делает nginx (см. README)
+    response = serve(request, path, document_root=document_root)
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
+if settings.DEBUG:
+    urlpatterns.append(re_path(
+        r'^%s(?P<path>variants/.*)$' % settings.MEDIA_URL.lstrip('/'), serve_immutable,
+        {'document_root': settings.MEDIA_ROOT},
+    ))
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -48,7 +48,7 @@ export function AdminManageAttractions({ onNavigate }: AdminManageAttractionsPro
     try {
       const headers = { Authorization: `Bearer ${token}` };
       const [attrRes, regionRes, catRes] = await Promise.all([
-        axios.get('http://localhost:8000/api/attractions/', { headers }),
+        axios.get('http://localhost:8000/api/attractions/', { headers, params: { page: 1 } }),
         axios.get('http://localhost:8000/api/regions/', { headers }),
         axios.get('http://localhost:8000/api/categories/', { headers })
       ]);
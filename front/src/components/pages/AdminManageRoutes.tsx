@@ -82,17 +82,26 @@ export function AdminManageRoutes({ onNavigate }: AdminManageRoutesProps) {
     setIsDialogOpen(true);
   };
 
-  const handleEdit = (route: any) => {
-    setEditingId(route.id);
+  const handleEdit = async (route: any) => {
+    // В списке маршрутов нет остановок (только stops_count), берем полную версию маршрута
+    let fullRoute = route;
+    try {
+      const response = await axios.get(`http://localhost:8000/api/routes/${route.id}/`);
+      fullRoute = response.data;
+    } catch (error) {
+      console.error("Error fetching route details", error);
+      return;
+    }
+    setEditingId(fullRoute.id);
     setFormData({
-      title: route.title,
-      description: route.description,
-      duration_days: route.duration_days,
-      budget_range: route.budget_range,
-      difficulty: route.difficulty,
-      distance_km: route.distance_km,
-      image: route.image,
-      stops: route.stops || []
+      title: fullRoute.title,
+      description: fullRoute.description,
+      duration_days: fullRoute.duration_days,
+      budget_range: fullRoute.budget_range,
+      difficulty: fullRoute.difficulty,
+      distance_km: fullRoute.distance_km,
+      image: fullRoute.image,
+      stops: fullRoute.stops || []
     });
     setIsDialogOpen(true);
   };
@@ -397,7 +406,7 @@ export function AdminManageRoutes({ onNavigate }: AdminManageRoutesProps) {
                     <TableCell className="py-1 text-xs font-medium">{route.title}</TableCell>
                     <TableCell className="py-1 text-xs">{route.duration_days}</TableCell>
                     <TableCell className="py-1 text-xs">{route.difficulty}</TableCell>
-                    <TableCell className="py-1 text-xs">{route.stops?.length || 0}</TableCell>
+                    <TableCell className="py-1 text-xs">{route.stops_count || 0}</TableCell>
                     <TableCell className="py-1 text-xs text-right">
                       <div className="flex items-center justify-end gap-1">
                         <Button variant="ghost" size="icon" className="h-6 w-6" onClick={() => handleEdit(route)}>
@@ -109,7 +109,8 @@ export function AdminModerateReviews({ onNavigate }: AdminModerateReviewsProps)
   const fetchReviews = async () => {
     try {
       const response = await axios.get('http://localhost:8000/api/reviews/', {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { page: 1 } // Админка использует постраничную пагинацию (с count)
       });
       // Маппинг данных с бэкенда
       const mappedReviews = response.data.results.map((r: any) => ({
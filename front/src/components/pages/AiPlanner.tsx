@@ -1,6 +1,5 @@
 import { Header } from "../Header";
 import { useState, useRef, useEffect } from "react";
-import axios from "axios";
 import { Button } from "../ui/button";
 import { Input } from "../ui/input";
 import { Send, Bot, User, Sparkles, MapPin, ArrowRight } from "lucide-react";
@@ -34,6 +33,8 @@ export function AiPlanner({ onNavigate, isAdmin }: AiPlannerProps) {
   ]);
   
   const [loading, setLoading] = useState(false);
+  // id диалога на сервере: с ним ИИ помнит предыдущие вопросы
+  const [conversationId, setConversationId] = useState<string | null>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const scrollToBottom = () => {
@@ -52,19 +53,46 @@ export function AiPlanner({ onNavigate, isAdmin }: AiPlannerProps) {
     setInput("");
     setLoading(true);
 
+    const aiId = Date.now() + 1;
+    const updateAiMsg = (update: (msg: Message) => Message) =>
+      setMessages(prev => prev.map(msg => (msg.id === aiId ? update(msg) : msg)));
+
     try {
-      const response = await axios.post('http://localhost:8000/api/ai/ask/', {
-        message: userMsg.text
+      // Потоковый ответ (Server-Sent Events): сначала карточки, потом текст по кусочкам
+      const response = await fetch('http://localhost:8000/api/ai/ask/stream/', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message: userMsg.text, conversation: conversationId })
       });
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
 
-      const aiMsg: Message = {
-        id: Date.now() + 1,
-        sender: 'ai',
-        text: response.data.reply,
-        recommendations: response.data.recommendations
-      };
+      setMessages(prev => [...prev, { id: aiId, sender: 'ai', text: "", recommendations: [] }]);
+      setLoading(false);
 
-      setMessages(prev => [...prev, aiMsg]);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const blocks = buffer.split("\n\n");
+        buffer = blocks.pop() || "";
+        for (const block of blocks) {
+          const eventLine = block.split("\n").find(line => line.startsWith("event: "));
+          const dataLine = block.split("\n").find(line => line.startsWith("data: "));
+          if (!eventLine || !dataLine) continue;
+          const event = eventLine.slice(7);
+          const data = JSON.parse(dataLine.slice(6));
+          if (event === 'recommendations') {
+            updateAiMsg(msg => ({ ...msg, recommendations: data }));
+          } else if (event === 'token' || event === 'error') {
+            updateAiMsg(msg => ({ ...msg, text: msg.text + data.text }));
+          } else if (event === 'usage') {
+            setConversationId(data.conversation);
+          }
+        }
+      }
 
     } catch (error) {
       console.error(error);
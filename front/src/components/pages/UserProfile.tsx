@@ -33,6 +33,8 @@ export function UserProfile({ onNavigate }: UserProfileProps) {
   const [favorites, setFavorites] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
   const [bookings, setBookings] = useState<Booking[]>([]);
+  const [favoritesCount, setFavoritesCount] = useState(0);
+  const [bookingsCount, setBookingsCount] = useState(0);
   const [isEditing, setIsEditing] = useState(false);
   const [saving, setSaving] = useState(false);
   const [editForm, setEditForm] = useState({
@@ -52,8 +54,15 @@ export function UserProfile({ onNavigate }: UserProfileProps) {
       
       const data = response.data;
       setProfile(data);
-      if (data.favorites) setFavorites(data.favorites);
-      if (data.bookings) setBookings(data.bookings);
+      // favorites и bookings приходят постранично: { count, next, previous, results }
+      if (data.favorites) {
+        setFavorites(data.favorites.results);
+        setFavoritesCount(data.favorites.count);
+      }
+      if (data.bookings) {
+        setBookings(data.bookings.results);
+        setBookingsCount(data.bookings.count);
+      }
       
       setEditForm({
         bio: data.bio || "",
@@ -181,12 +190,12 @@ export function UserProfile({ onNavigate }: UserProfileProps) {
                   <div className="mt-4">
                     <div className="flex items-center gap-6 text-gray-600">
                       <div>
-                        <span className="text-2xl text-gray-900 mr-2 font-bold">{favorites.length}</span>
+                        <span className="text-2xl text-gray-900 mr-2 font-bold">{favoritesCount}</span>
                         <span>{t('favorites_stat') || "Favorites"}</span>
                       </div>
                       <div>
                         {/* Статистика покупок */}
-                        <span className="text-2xl text-gray-900 mr-2 font-bold">{bookings.length}</span>
+                        <span className="text-2xl text-gray-900 mr-2 font-bold">{bookingsCount}</span>
                         <span>{t('bookings_stat') || "Bookings"}</span>
                       </div>
                       <div className="flex items-center gap-1">